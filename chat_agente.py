@@ -12,6 +12,7 @@ from __future__ import annotations
 
 import sys
 import os
+import asyncio
 from typing import TypedDict
 
 # ---------- CONFIGURACIÓN DE LOGGING ----------
@@ -36,13 +37,12 @@ logger = get_logger(__name__)
 
 # ---------- IMPORTS DEL PROYECTO ----------
 from src.config.config import get_chat_model
-from src.components.estado import State
 from src.components.agent_builder import build_agent  # ← NUEVO IMPORT
-from src.tools.rag import init_rag
+from src.components.streaming import astream_turn
+from src.components.utils import _print_event
 
 # ---------- CONFIGURACIÓN ----------
-logger.info("Inicializando RAG...")
-init_rag("data")
+# El índice RAG se carga (con mmap) en la primera llamada a Herramienta_RAG
 logger.info("Inicializando modelo de chat...")
 model = get_chat_model() 
 
@@ -59,11 +59,11 @@ config = {
 }
 
 # ---------- BUCLE INTERACTIVO ----------
-def main() -> None:
+async def amain() -> None:
+    """Bucle del chat sobre el camino asíncrono del grafo: la respuesta se imprime token a token."""
     try:
         # Construir el agente usando el nuevo componente
         agente = build_agent(model)
-        state: State = {"messages": []}  
         _printed: set[str] = set()
 
         print("\n💬  Escribe 'exit' para terminar.\n")
@@ -71,7 +71,8 @@ def main() -> None:
 
         while True:
             try:
-                user_text = input("👤: ").strip()
+                # input() bloquea: se lee en un hilo para no parar el bucle de eventos
+                user_text = (await asyncio.to_thread(input, "👤: ")).strip()
             except (EOFError, KeyboardInterrupt):
                 print("\n👋 Hasta luego!")
                 logger.info("Sesión terminada por el usuario")
@@ -86,31 +87,42 @@ def main() -> None:
 
             logger.debug(f"Usuario dice: {user_text[:50]}...")
             
-            # 1) turno del usuario
-            state["messages"].append(("user", user_text))
+            # 1) turno del usuario: solo el mensaje nuevo, el historial lo guarda el checkpointer
+            turno = {"messages": [("user", user_text)]}
 
-            # 2) stream del grafo
+            # 2) stream del grafo: tokens, progreso de herramientas y fin del turno
+            escribiendo = False
+            fin = None
             try:
-                for ev in agente.stream(state, config, stream_mode="values"):
-                    state = ev
-                logger.debug("Procesamiento del agente completado")
+                async for ev in astream_turn(agente, turno, config):
+                    _print_event(ev, _printed)
+                    if ev["type"] == "token":
+                        if not escribiendo:
+                            print("🤖: ", end="", flush=True)
+                            escribiendo = True
+                        print(ev["content"], end="", flush=True)
+                    elif ev["type"] == "tool":
+                        if escribiendo:
+                            print()
+                            escribiendo = False
+                        print(f"🔎 {ev['label']}", flush=True)
+                    elif ev["type"] == "retry" and escribiendo:
+                        print("\n🤖 (reintentando…)", flush=True)
+                        escribiendo = False
+                    elif ev["type"] == "end":
+                        fin = ev
             except Exception as e:
+                if escribiendo:
+                    print()
                 logger.error(f"Error en el procesamiento del agente: {str(e)}")
                 print(f"🤖: Lo siento, hubo un error procesando tu pregunta: {str(e)}")
                 continue
 
-            # 3) extrae la última respuesta del asistente
-            asistencia = None
-            for msg in reversed(state["messages"]):
-                if getattr(msg, "type", None) == "ai" or (
-                    isinstance(msg, tuple) and msg[0] == "assistant"
-                ):
-                    asistencia = msg.content if hasattr(msg, "content") else msg[1]
-                    break
-
-            if asistencia:
-                print(f"��: {asistencia}\n")
-                logger.debug(f"Asistente responde: {asistencia[:100]}...")
+            # 3) cierre del turno
+            if escribiendo:
+                print("\n")
+            if fin and fin["respuesta"]:
+                logger.debug(f"Asistente responde: {fin['respuesta'][:100]}...")
             else:
                 logger.warning("No se encontró respuesta del asistente")
                 print("🤖: Lo siento, no pude generar una respuesta válida.")
@@ -120,6 +132,9 @@ def main() -> None:
         print(f"❌ Error crítico: {str(e)}")
         sys.exit(1)
 
+def main() -> None:
+    asyncio.run(amain())
+
 # ---------- ENTRY POINT ----------
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+servidor_agente.py  ·  Servidor HTTP (ASGI) del agente LangGraph + RAG
+----------------------------------------------------------------------
+Ejecuta:
+    python servidor_agente.py --port 8000
+o con uvicorn directamente:
+    uvicorn servidor_agente:app --port 8000
+
+Prueba:
+    curl -N -X POST localhost:8000/chat/stream \
+         -H 'Content-Type: application/json' \
+         -d '{"thread_id": "demo", "input": "¿Qué es una red neuronal?"}'
+"""
+
+from __future__ import annotations
+
+import os
+import argparse
+from datetime import datetime
+
+# ---------- CONFIGURACIÓN DE LOGGING ----------
+from src.config.logging_config import setup_logging, get_logger
+
+os.makedirs("logs", exist_ok=True)
+timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    log_file=f"logs/servidor_{timestamp}.log",
+    format_string="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = get_logger(__name__)
+
+# ---------- APLICACIÓN ----------
+from src.components.server import create_app
+
+# El grafo y el índice RAG se crean al arrancar el proceso (lifespan)
+app = create_app(
+    max_concurrency=int(os.getenv("MAX_CONCURRENCY", "32")),
+    request_timeout=float(os.getenv("REQUEST_TIMEOUT", "120")),
+)
+
+# ---------- ENTRY POINT ----------
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor HTTP del agente")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # Un solo worker por proceso: el índice se comparte entre procesos vía mmap
+    uvicorn.run(app, host=args.host, port=args.port)
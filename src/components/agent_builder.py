@@ -3,32 +3,92 @@
 Constructor del agente LangGraph + RAG
 """
 import logging
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import END, StateGraph, START
 from langchain_openai import ChatOpenAI
+from langchain_openai.chat_models.base import BaseChatOpenAI
 
 from src.components.estado import State
 from src.components.assistant import Assistant
 from src.components.utils import create_tool_node_with_fallback, route_tools
+from src.components.checkpointer import make_checkpointer
+from src.components.history import HistoryTrimmer
+from src.components.semantic_cache import (
+    SemanticCache, SemanticCacheLookup, SemanticCacheStore, context_fingerprint, route_cache,
+)
 from src.config.prompt import prompt as mi_prompt
-from src.tools.Herramienta_RAG import Herramienta_RAG
+from src.tools.Herramienta_RAG import Herramienta_RAG, herramienta_rag_batch, aherramienta_rag_batch
+from src.tools.collection_registry import init_registry
 
 logger = logging.getLogger(__name__)
 
+# Herramientas cuyas llamadas de un mismo turno se ejecutan en un solo lote
+BATCH_HANDLERS = {
+    Herramienta_RAG.name: (herramienta_rag_batch, aherramienta_rag_batch),
+}
+
+
+def default_semantic_cache() -> SemanticCache:
+    """
+    Caché semántica que reutiliza los embeddings (y su caché) de las colecciones RAG.
+    Un candidato solo se reutiliza si sus búsquedas en Herramienta_RAG, repetidas,
+    devuelven los mismos fragmentos; la versión es la de los shards ya cargados.
+    """
+    def replay(steps: list) -> list | None:
+        """Argumentos validados de cada paso, o None si hay herramientas que no se pueden repetir."""
+        if any(call["name"] != Herramienta_RAG.name for step in steps for call in step):
+            return None
+        # Los mismos valores por defecto que aplica el nodo de herramientas
+        schema = Herramienta_RAG.args_schema
+        return [[schema.model_validate(call["args"]).model_dump() for call in step] for step in steps]
+
+    def context_fn(steps: list) -> str | None:
+        args = replay(steps)
+        if args is None:
+            return None
+        return context_fingerprint([out for step in args for out in herramienta_rag_batch(step)])
+
+    async def acontext_fn(steps: list) -> str | None:
+        args = replay(steps)
+        if args is None:
+            return None
+        return context_fingerprint([out for step in args for out in await aherramienta_rag_batch(step)])
+
+    return SemanticCache(
+        embed_fn=lambda texts: init_registry("data").embed_texts(texts),
+        aembed_fn=lambda texts: init_registry("data").aembed_texts(texts),
+        version_fn=lambda: init_registry("data").index_versions(),
+        context_fn=context_fn,
+        acontext_fn=acontext_fn,
+    )
+
+
 class AgentBuilder:
     """Constructor del agente con configuración flexible."""
     
-    def __init__(self, model: ChatOpenAI, tools: list = None):
+    def __init__(self, model: ChatOpenAI, tools: list = None,
+                 semantic_cache: SemanticCache | None = None, use_semantic_cache: bool = True,
+                 checkpointer: BaseCheckpointSaver | None = None,
+                 history_trimmer: HistoryTrimmer | None = None):
         """
         Inicializa el constructor del agente.
         
         Args:
             model: Modelo de chat configurado
             tools: Lista de herramientas disponibles
+            semantic_cache: Caché de respuestas (por defecto, la basada en el índice RAG)
+            use_semantic_cache: Si es False el grafo no usa caché semántica
+            checkpointer: Persistencia de las conversaciones (por defecto make_checkpointer())
+            history_trimmer: Recorte del historial por tokens antes de cada llamada al modelo
         """
         self.model = model
         self.tools = tools or [Herramienta_RAG]
         self.prompt = mi_prompt
+        if semantic_cache is None and use_semantic_cache:
+            semantic_cache = default_semantic_cache()
+        self.semantic_cache = semantic_cache
+        self.checkpointer = checkpointer
+        self.history_trimmer = history_trimmer or HistoryTrimmer(model)
     
     def build(self) -> StateGraph:
         """
@@ -41,27 +101,50 @@ class AgentBuilder:
             logger.info("Construyendo agente...")
             
             # Bind the tools to the LLM via the prompt
-            assistant_runnable = self.prompt | self.model.bind_tools(self.tools)
+            model_with_tools = self.model.bind_tools(self.tools)
+            assistant_runnable = self.prompt | model_with_tools
+            # Con ChatOpenAI el plazo del turno viaja como timeout de la petición (se cancela de verdad)
+            def with_timeout(timeout: float):
+                return self.prompt | model_with_tools.bind(timeout=timeout)
+            timeout_runnable = with_timeout if isinstance(self.model, BaseChatOpenAI) else None
             logger.debug(f"Herramientas configuradas: {[tool.name for tool in self.tools]}")
 
             # Build the state graph for the agent
             builder = StateGraph(State)
             
             # Define Nodes
-            builder.add_node("assistant", Assistant(assistant_runnable, max_retries=3))
-            builder.add_node("tools", create_tool_node_with_fallback(self.tools))
+            builder.add_node("assistant", Assistant(assistant_runnable, max_retries=3,
+                                                  timeout_runnable=timeout_runnable).as_runnable())
+            builder.add_node("tools", create_tool_node_with_fallback(self.tools, BATCH_HANDLERS))
+            # Presupuesto de tokens: se aplica antes de cada llamada al modelo
+            builder.add_node("trim_history", self.history_trimmer.as_runnable())
 
             # Define edges
-            builder.add_edge(START, "assistant")
-            builder.add_conditional_edges(
-                "assistant", route_tools, ["tools", END]
-            )
-            builder.add_edge("tools", "assistant")
+            if self.semantic_cache is not None:
+                # Caché semántica: START -> cache_lookup -> (END | trim_history -> assistant ... -> cache_store -> END)
+                builder.add_node("cache_lookup", SemanticCacheLookup(self.semantic_cache).as_runnable())
+                builder.add_node("cache_store", SemanticCacheStore(self.semantic_cache).as_runnable())
+                builder.add_edge(START, "cache_lookup")
+                builder.add_conditional_edges(
+                    "cache_lookup", route_cache, {"assistant": "trim_history", END: END}
+                )
+                builder.add_conditional_edges(
+                    "assistant", route_tools, {"tools": "tools", END: "cache_store"}
+                )
+                builder.add_edge("cache_store", END)
+            else:
+                builder.add_edge(START, "trim_history")
+                builder.add_conditional_edges(
+                    "assistant", route_tools, ["tools", END]
+                )
+            builder.add_edge("trim_history", "assistant")
+            builder.add_edge("tools", "trim_history")
 
-            # Set up the memory checkpointer for the graph
-            memory = MemorySaver()
+            # Checkpointer acotado (SQLite/Postgres/memoria, ver src/components/checkpointer.py)
+            if self.checkpointer is None:
+                self.checkpointer = make_checkpointer()
             agent_graph = builder.compile(
-                checkpointer=memory,
+                checkpointer=self.checkpointer,
             )
             logger.info("✅ Agente compilado exitosamente")
             return agent_graph
@@ -70,16 +153,25 @@ class AgentBuilder:
             logger.exception("❌ Fallo inicializando el agente")
             raise
 
-def build_agent(model: ChatOpenAI, tools: list = None) -> StateGraph:
+def build_agent(model: ChatOpenAI, tools: list = None,
+                semantic_cache: SemanticCache | None = None,
+                use_semantic_cache: bool = True,
+                checkpointer: BaseCheckpointSaver | None = None,
+                history_trimmer: HistoryTrimmer | None = None) -> StateGraph:
     """
     Función de conveniencia para construir el agente.
     
     Args:
         model: Modelo de chat configurado
         tools: Lista de herramientas disponibles
+        semantic_cache: Caché de respuestas a usar (opcional)
+        use_semantic_cache: Si es False el grafo no usa caché semántica
+        checkpointer: Persistencia de las conversaciones (opcional)
+        history_trimmer: Recorte del historial por tokens (opcional)
         
     Returns:
         StateGraph: Grafo del agente compilado
     """
-    builder = AgentBuilder(model, tools)
+    builder = AgentBuilder(model, tools, semantic_cache, use_semantic_cache, checkpointer,
+                           history_trimmer)
     return builder.build()
\ No newline at end of file
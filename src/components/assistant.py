@@ -1,56 +1,170 @@
-
-from langgraph.graph import StateGraph, END
-
-from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 from src.components.estado import State
-from typing import Dict, Any
+from src.components.retry import CircuitBreaker, RetryPolicy, shared_circuit_breaker
+from src.components.streaming import emit
+from typing import Any, Callable
+import time
+import asyncio
+import threading
+import concurrent.futures
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Margen del plazo por hilo sobre el timeout del proveedor: este debe saltar antes
+_BACKSTOP_GRACE = 0.5
+
 class Assistant:
-    def __init__(self, runnable: Runnable, max_retries: int = 3) -> None:
-        """Wrapper para ejecutar un runnable LangChain con re‑intentos."""
+    def __init__(self, runnable: Runnable, max_retries: int = 3,
+                 retry_policy: RetryPolicy | None = None,
+                 circuit_breaker: CircuitBreaker | None = None,
+                 timeout_runnable: Callable[[float], Runnable] | None = None,
+                 max_workers: int = 8) -> None:
+        """
+        Wrapper para ejecutar un runnable LangChain con re‑intentos.
+
+        Con stream_mode="messages" el modelo emite sus tokens mientras genera
+        (ver streaming.astream_turn); cada reintento se avisa con un evento
+        "retry" para que la CLI o el servidor descarten el texto parcial.
+
+        Args:
+            runnable: prompt | modelo con herramientas
+            max_retries: intentos por turno si no se pasa retry_policy
+            retry_policy: backoff, errores reintentables y plazo por turno
+            circuit_breaker: compartido entre sesiones (por defecto shared_circuit_breaker())
+            timeout_runnable: segundos -> el mismo runnable con ese timeout en la petición al
+                proveedor (p. ej. prompt | modelo.bind(timeout=s)), para que la llamada se
+                cancele de verdad al agotarse el plazo del turno
+            max_workers: hilos compartidos para las llamadas síncronas con plazo
+        """
         self.runnable: Runnable = runnable
-        self.max_retries: int = max_retries
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy(max_attempts=max_retries)
+        self.max_retries: int = self.retry_policy.max_attempts
+        self.circuit_breaker: CircuitBreaker = circuit_breaker or shared_circuit_breaker()
+        self.timeout_runnable = timeout_runnable
+        self.max_workers = max_workers
+        self._executor: ContextThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
 
     def __call__(self, state: State, config: RunnableConfig | None = None):
-        retries = 0
+        started = time.monotonic()
         last_error = None
-        
-        while retries < self.max_retries:
+
+        for attempt in range(1, self.max_retries + 1):
+            logger.debug(f"Intento {attempt}/{self.max_retries} del asistente")
+            self.circuit_breaker.before_call()
             try:
-                logger.debug(f"Intento {retries + 1}/{self.max_retries} del asistente")
-                result = self.runnable.invoke(state, config)
-                
-                if self._needs_retry(result):
-                    retries += 1
-                    logger.warning(f"Respuesta vacía o inválida, reintentando... (intento {retries})")
-                    # Insertamos un aviso al final del historial
-                    messages = state["messages"] + [("user", "Por favor, proporciona una respuesta válida y útil.")]
-                    state = {**state, "messages": messages}
-                    continue
-                
-                logger.debug("Respuesta del asistente obtenida exitosamente")
-                return {"messages": result}
-                
+                result = self._invoke(state, config, started)
             except Exception as e:
                 last_error = e
-                retries += 1
-                logger.error(f"Error en intento {retries}: {str(e)}")
-                
-                if retries < self.max_retries:
-                    # Añadir mensaje de error al estado para el siguiente intento
-                    messages = state["messages"] + [("user", f"Hubo un error: {str(e)}. Por favor, intenta de nuevo.")]
-                    state = {**state, "messages": messages}
-                else:
-                    logger.error("Se agotaron todos los reintentos")
+                delay = self._on_error(e, attempt, started)
+                if delay is None:
+                    break
+                self._notify_retry(attempt)
+                time.sleep(delay)
+                continue
+
+            self.circuit_breaker.record_success()
+            if self._needs_retry(result):
+                # Se reenvía el mismo historial, sin añadir mensajes
+                logger.warning(f"Respuesta vacía o inválida, reintentando... (intento {attempt})")
+                self._notify_retry(attempt)
+                continue
+
+            logger.debug("Respuesta del asistente obtenida exitosamente")
+            return {"messages": result}
+
+        self._exhausted(last_error)
+
+    def _bounded(self, remaining: float | None) -> tuple[Runnable, float | None]:
+        """(runnable con el timeout del proveedor si se puede, espera máxima de respaldo)."""
+        if remaining is None:
+            return self.runnable, None
+        if self.timeout_runnable is None:
+            return self.runnable, remaining
+        return self.timeout_runnable(remaining), remaining + _BACKSTOP_GRACE
+
+    def _pool(self) -> ContextThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ContextThreadPoolExecutor(max_workers=self.max_workers,
+                                                           thread_name_prefix="assistant")
+            return self._executor
+
+    def _invoke(self, state: State, config: RunnableConfig | None, started: float):
+        """invoke del runnable acotado por el plazo del turno, como asyncio.wait_for en acall."""
+        remaining = self.retry_policy.remaining(started)
+        if remaining is None:
+            return self.runnable.invoke(state, config)
+        if remaining <= 0:
+            raise TimeoutError("Plazo del turno agotado antes de llamar al modelo")
+        runnable, wait = self._bounded(remaining)
+        # Hilos compartidos con el contexto copiado (callbacks de streaming, config del grafo).
+        # El timeout de la petición cancela la llamada; la espera por hilo es solo el respaldo
+        future = self._pool().submit(runnable.invoke, state, config)
+        try:
+            return future.result(timeout=wait)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"La llamada al modelo superó el plazo del turno ({remaining:.1f}s)") from None
+
+    async def acall(self, state: State, config: RunnableConfig | None = None):
+        """Versión asíncrona de __call__ (usa ainvoke del runnable, acotado por el plazo del turno)."""
+        started = time.monotonic()
+        last_error = None
+
+        for attempt in range(1, self.max_retries + 1):
+            logger.debug(f"Intento {attempt}/{self.max_retries} del asistente (async)")
+            self.circuit_breaker.before_call()
+            try:
+                runnable, wait = self._bounded(self.retry_policy.remaining(started))
+                result = await asyncio.wait_for(runnable.ainvoke(state, config), wait)
+            except Exception as e:
+                last_error = e
+                delay = self._on_error(e, attempt, started)
+                if delay is None:
                     break
-        
+                self._notify_retry(attempt)
+                await asyncio.sleep(delay)
+                continue
+
+            self.circuit_breaker.record_success()
+            if self._needs_retry(result):
+                logger.warning(f"Respuesta vacía o inválida, reintentando... (intento {attempt})")
+                self._notify_retry(attempt)
+                continue
+
+            logger.debug("Respuesta del asistente obtenida exitosamente")
+            return {"messages": result}
+
+        self._exhausted(last_error)
+
+    def as_runnable(self) -> RunnableLambda:
+        """Nodo para el grafo con camino síncrono (invoke/stream) y asíncrono (ainvoke/astream)."""
+        return RunnableLambda(self.__call__, afunc=self.acall, name="assistant")
+
+    def _on_error(self, error: Exception, attempt: int, started: float) -> float | None:
+        """Registra el fallo y devuelve la espera antes del siguiente intento (None = no reintentar)."""
+        logger.error(f"Error en intento {attempt}: {type(error).__name__}: {str(error)}")
+        if self.retry_policy.retry_on(error):
+            self.circuit_breaker.record_failure()
+        else:
+            # El proveedor respondió (p. ej. 400): no cuenta como caída
+            self.circuit_breaker.record_success()
+        return self.retry_policy.next_delay(attempt, error, started)
+
+    def _notify_retry(self, attempt: int) -> None:
+        """Avisa al stream del grafo: los tokens ya emitidos en este intento se descartan."""
+        if attempt < self.max_retries:
+            emit({"type": "retry", "attempt": attempt + 1})
+
+    @staticmethod
+    def _exhausted(last_error: Exception | None) -> None:
         # Si llegamos aquí no hubo respuesta válida
         error_msg = f"Assistant agotó los re‑intentos sin obtener salida válida. Último error: {str(last_error)}"
         logger.error(error_msg)
-        raise RuntimeError(error_msg)
+        raise RuntimeError(error_msg) from last_error
 
     @staticmethod
     def _needs_retry(result: Any) -> bool:
@@ -0,0 +1,283 @@
+# src/components/checkpointer.py
+"""
+Checkpointers acotados para el grafo del agente.
+
+MemorySaver guarda en el proceso todos los checkpoints de todos los hilos
+para siempre. Aquí se ofrecen tres backends con la misma política de
+retención:
+- memory:   en el proceso, con límite de hilos (LRU) y compactación.
+- sqlite:   archivo local en modo WAL; la memoria del proceso no crece.
+- postgres: pool de conexiones compartido por varios workers
+            (src/components/checkpointer_postgres.py, dependencia opcional).
+
+Retención:
+- keep_checkpoints: checkpoints que se conservan por hilo; los anteriores
+  (y sus escrituras pendientes) se borran tras cada paso.
+- idle_ttl: los hilos sin actividad durante ese tiempo se eliminan.
+- compact(): compactación completa de todos los hilos (p. ej. en un cron).
+
+Se elige con make_checkpointer() o con las variables de entorno CHECKPOINTER,
+CHECKPOINT_PATH, CHECKPOINT_DSN, CHECKPOINT_KEEP y CHECKPOINT_IDLE_TTL.
+"""
+import os, time, sqlite3, asyncio, threading, logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, List, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_BACKENDS = ("memory", "sqlite", "postgres")
+
+
+class RetentionMixin:
+    """
+    Política de retención común. Las subclases implementan _touch,
+    _compact_thread, _idle_threads y _threads para su almacenamiento.
+    """
+    def _init_retention(self, keep_checkpoints: int, idle_ttl: Optional[float], sweep_every: int) -> None:
+        # El último checkpoint y su padre son necesarios para reanudar un paso
+        if keep_checkpoints < 2:
+            raise ValueError("keep_checkpoints debe ser al menos 2")
+        self.keep_checkpoints = keep_checkpoints
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self._puts = 0
+
+    def put(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        try:
+            self._touch(thread_id)
+            self._compact_thread(thread_id)
+            self._puts += 1
+            if self.idle_ttl and self._puts % self.sweep_every == 0:
+                self.evict_idle()
+        except Exception as e:
+            # La retención nunca debe romper un turno de la conversación
+            logger.warning(f"Retención de checkpoints fallida para {thread_id}: {str(e)}")
+        return saved
+
+    def evict_idle(self) -> int:
+        """Elimina los hilos sin actividad durante idle_ttl segundos."""
+        if not self.idle_ttl:
+            return 0
+        idle = self._idle_threads(time.time() - self.idle_ttl)
+        for thread_id in idle:
+            self.delete_thread(thread_id)
+        if idle:
+            logger.info(f"Checkpoints: {len(idle)} hilos inactivos eliminados")
+        return len(idle)
+
+    def compact(self) -> None:
+        """Compacta todos los hilos y elimina los inactivos."""
+        started = time.perf_counter()
+        threads = self._threads()
+        for thread_id in threads:
+            self._compact_thread(thread_id)
+        evicted = self.evict_idle()
+        logger.info(
+            f"Checkpoints compactados: {len(threads)} hilos, {evicted} eliminados "
+            f"en {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+
+
+class ThreadedAsyncMixin:
+    """
+    Métodos asíncronos para savers solo síncronos: cada llamada se ejecuta en
+    un hilo, así el grafo funciona igual con invoke/stream y ainvoke/astream.
+    """
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint, metadata, new_versions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]],
+                          task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+# ---------- memoria ----------
+class BoundedMemorySaver(RetentionMixin, InMemorySaver):
+    """
+    MemorySaver con memoria acotada: como mucho max_threads hilos (se expulsa
+    el usado hace más tiempo) y keep_checkpoints checkpoints por hilo.
+    """
+    def __init__(self, keep_checkpoints: int = 4, idle_ttl: Optional[float] = 3600,
+                 max_threads: int = 1000, sweep_every: int = 50, **kwargs):
+        super().__init__(**kwargs)
+        self._init_retention(keep_checkpoints, idle_ttl, sweep_every)
+        self.max_threads = max_threads
+        self._lock = threading.RLock()
+        # thread_id -> última actividad; el orden es el de uso (LRU)
+        self._activity: "OrderedDict[str, float]" = OrderedDict()
+
+    def _touch(self, thread_id: str) -> None:
+        with self._lock:
+            self._activity[thread_id] = time.time()
+            self._activity.move_to_end(thread_id)
+            overflow = list(self._activity)[:max(len(self._activity) - self.max_threads, 0)]
+        for old in overflow:
+            self.delete_thread(old)
+
+    def _compact_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for ns, checkpoints in self.storage.get(thread_id, {}).items():
+                if len(checkpoints) <= self.keep_checkpoints:
+                    continue
+                ordered = sorted(checkpoints)
+                for checkpoint_id in ordered[:-self.keep_checkpoints]:
+                    del checkpoints[checkpoint_id]
+                    self.writes.pop((thread_id, ns, checkpoint_id), None)
+                # Solo se conservan los valores de canal que usan los checkpoints restantes
+                live = set()
+                for saved, _, _ in checkpoints.values():
+                    versions = self.serde.loads_typed(saved)["channel_versions"]
+                    live.update(versions.items())
+                for key in [k for k in self.blobs if k[0] == thread_id and k[1] == ns]:
+                    if (key[2], key[3]) not in live:
+                        del self.blobs[key]
+
+    def _idle_threads(self, cutoff: float) -> List[str]:
+        with self._lock:
+            return [t for t, last in self._activity.items() if last < cutoff]
+
+    def _threads(self) -> List[str]:
+        with self._lock:
+            return list(self.storage)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._activity.pop(thread_id, None)
+
+
+# ---------- SQLite ----------
+class RetentionSqliteSaver(RetentionMixin, ThreadedAsyncMixin, SqliteSaver):
+    """SqliteSaver en modo WAL con retención y métodos asíncronos."""
+    def __init__(self, path: str = "checkpoints/agente.sqlite", keep_checkpoints: int = 4,
+                 idle_ttl: Optional[float] = 7 * 24 * 3600, sweep_every: int = 50, **kwargs):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        super().__init__(conn, **kwargs)
+        self._init_retention(keep_checkpoints, idle_ttl, sweep_every)
+        self.path = path
+        with self.cursor() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS thread_activity "
+                "(thread_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+            )
+
+    def _touch(self, thread_id: str) -> None:
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, last_access) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET last_access = excluded.last_access",
+                (thread_id, time.time()),
+            )
+
+    def _compact_thread(self, thread_id: str) -> None:
+        with self.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM checkpoints WHERE thread_id = ? AND (checkpoint_ns, checkpoint_id) IN (
+                    SELECT checkpoint_ns, checkpoint_id FROM (
+                        SELECT checkpoint_ns, checkpoint_id, row_number() OVER (
+                            PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+                        FROM checkpoints WHERE thread_id = ?
+                    ) WHERE rn > ?
+                )
+                """,
+                (thread_id, thread_id, self.keep_checkpoints),
+            )
+            if cur.rowcount:
+                cur.execute(
+                    """
+                    DELETE FROM writes WHERE thread_id = ? AND NOT EXISTS (
+                        SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id
+                        AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id
+                    )
+                    """,
+                    (thread_id,),
+                )
+
+    def _idle_threads(self, cutoff: float) -> List[str]:
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE last_access < ?", (cutoff,))
+            return [row[0] for row in cur.fetchall()]
+
+    def _threads(self) -> List[str]:
+        with self.cursor(transaction=False) as cur:
+            cur.execute("SELECT DISTINCT thread_id FROM checkpoints")
+            return [row[0] for row in cur.fetchall()]
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+
+    def compact(self, vacuum: bool = False) -> None:
+        """Compactación completa; con vacuum=True además devuelve el espacio al disco."""
+        super().compact()
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if vacuum:
+                self.conn.execute("VACUUM")
+
+
+# ---------- fábrica ----------
+def make_checkpointer(backend: Optional[str] = None, *, path: Optional[str] = None,
+                      dsn: Optional[str] = None, keep_checkpoints: Optional[int] = None,
+                      idle_ttl: Optional[float] = None, **kwargs) -> BaseCheckpointSaver:
+    """
+    Crea el checkpointer del agente. Los argumentos no indicados se toman de
+    las variables de entorno (CHECKPOINTER, CHECKPOINT_PATH, CHECKPOINT_DSN,
+    CHECKPOINT_KEEP, CHECKPOINT_IDLE_TTL). Por defecto: SQLite local.
+    """
+    backend = backend or os.getenv("CHECKPOINTER", "sqlite")
+    if backend not in CHECKPOINT_BACKENDS:
+        raise ValueError(f"backend debe ser uno de {CHECKPOINT_BACKENDS}")
+
+    options = dict(kwargs)
+    keep = keep_checkpoints or os.getenv("CHECKPOINT_KEEP")
+    if keep:
+        options["keep_checkpoints"] = int(keep)
+    ttl = idle_ttl if idle_ttl is not None else os.getenv("CHECKPOINT_IDLE_TTL")
+    if ttl is not None:
+        options["idle_ttl"] = float(ttl) or None
+
+    if backend == "memory":
+        saver = BoundedMemorySaver(**options)
+    elif backend == "sqlite":
+        saver = RetentionSqliteSaver(path or os.getenv("CHECKPOINT_PATH", "checkpoints/agente.sqlite"), **options)
+    else:
+        from src.components.checkpointer_postgres import RetentionPostgresSaver
+        dsn = dsn or os.getenv("CHECKPOINT_DSN")
+        if not dsn:
+            raise ValueError("El backend postgres necesita dsn o la variable CHECKPOINT_DSN")
+        saver = RetentionPostgresSaver.from_dsn(dsn, **options)
+
+    logger.info(
+        f"Checkpointer {backend}: {saver.keep_checkpoints} checkpoints por hilo, "
+        f"hilos inactivos fuera tras {saver.idle_ttl or '∞'} s"
+    )
+    return saver
@@ -0,0 +1,109 @@
+# src/components/checkpointer_postgres.py
+"""
+Checkpointer PostgreSQL con pool de conexiones, para varios workers o
+procesos que comparten las conversaciones.
+
+Dependencias opcionales:
+    pip install langgraph-checkpoint-postgres "psycopg[binary]" psycopg-pool
+"""
+import time, logging
+from typing import List, Optional
+
+from langgraph.checkpoint.postgres import PostgresSaver
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+
+from src.components.checkpointer import RetentionMixin, ThreadedAsyncMixin
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPostgresSaver(RetentionMixin, ThreadedAsyncMixin, PostgresSaver):
+    """PostgresSaver sobre un ConnectionPool, con retención y métodos asíncronos."""
+    def __init__(self, pool: ConnectionPool, keep_checkpoints: int = 4,
+                 idle_ttl: Optional[float] = 7 * 24 * 3600, sweep_every: int = 200, **kwargs):
+        super().__init__(pool, **kwargs)
+        self._init_retention(keep_checkpoints, idle_ttl, sweep_every)
+        self.pool = pool
+        self.setup()
+        with self._cursor() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS thread_activity "
+                "(thread_id TEXT PRIMARY KEY, last_access DOUBLE PRECISION NOT NULL)"
+            )
+
+    @classmethod
+    def from_dsn(cls, dsn: str, pool_size: int = 10, **kwargs) -> "RetentionPostgresSaver":
+        """Crea el pool (autocommit y filas como dict, como exige PostgresSaver)."""
+        pool = ConnectionPool(
+            dsn,
+            min_size=1,
+            max_size=pool_size,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+            open=True,
+        )
+        logger.info(f"Pool PostgreSQL de checkpoints abierto (máx. {pool_size} conexiones)")
+        return cls(pool, **kwargs)
+
+    def _touch(self, thread_id: str) -> None:
+        with self._cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_activity (thread_id, last_access) VALUES (%s, %s) "
+                "ON CONFLICT (thread_id) DO UPDATE SET last_access = EXCLUDED.last_access",
+                (thread_id, time.time()),
+            )
+
+    def _compact_thread(self, thread_id: str) -> None:
+        with self._cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM checkpoints c USING (
+                    SELECT checkpoint_ns, checkpoint_id, row_number() OVER (
+                        PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+                    FROM checkpoints WHERE thread_id = %s
+                ) old
+                WHERE c.thread_id = %s AND c.checkpoint_ns = old.checkpoint_ns
+                  AND c.checkpoint_id = old.checkpoint_id AND old.rn > %s
+                """,
+                (thread_id, thread_id, self.keep_checkpoints),
+            )
+            if not cur.rowcount:
+                return
+            cur.execute(
+                """
+                DELETE FROM checkpoint_writes w WHERE w.thread_id = %s AND NOT EXISTS (
+                    SELECT 1 FROM checkpoints c WHERE c.thread_id = w.thread_id
+                    AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id
+                )
+                """,
+                (thread_id,),
+            )
+            # Los valores de canal se guardan por versión; se borran los que ya no usa ningún checkpoint
+            cur.execute(
+                """
+                DELETE FROM checkpoint_blobs b WHERE b.thread_id = %s AND NOT EXISTS (
+                    SELECT 1 FROM checkpoints c WHERE c.thread_id = b.thread_id
+                    AND c.checkpoint_ns = b.checkpoint_ns
+                    AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+                )
+                """,
+                (thread_id,),
+            )
+
+    def _idle_threads(self, cutoff: float) -> List[str]:
+        with self._cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE last_access < %s", (cutoff,))
+            return [row["thread_id"] for row in cur.fetchall()]
+
+    def _threads(self) -> List[str]:
+        with self._cursor() as cur:
+            cur.execute("SELECT DISTINCT thread_id FROM checkpoints")
+            return [row["thread_id"] for row in cur.fetchall()]
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self._cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = %s", (thread_id,))
+
+    def close(self) -> None:
+        self.pool.close()
@@ -1,8 +1,13 @@
-from typing import Annotated
-from typing_extensions import TypedDict
+from typing import Annotated, Dict
+from typing_extensions import NotRequired, TypedDict
 from langgraph.graph.message import AnyMessage, add_messages
 
 
 class State(TypedDict):
     """Estructura de datos que mantiene el historial de la conversación."""
     messages: Annotated[list[AnyMessage], add_messages]
+    # Métricas de tokens del último prompt (ver src/components/history.py)
+    token_metrics: NotRequired[Dict[str, float]]
+    # Ámbito de la pregunta en la caché semántica, fijado al empezar el turno
+    # (el recorte del historial puede resumir el intercambio anterior después)
+    cache_scope: NotRequired[str]
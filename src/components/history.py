@@ -0,0 +1,204 @@
+# src/components/history.py
+"""
+Recorte del historial por presupuesto de tokens.
+
+Nodo previo al asistente. Si los mensajes superan max_history_tokens:
+1. Trunca las salidas de herramientas de turnos anteriores (los fragmentos
+   RAG ya respondidos casi nunca hacen falta completos).
+2. Si no basta, resume los turnos antiguos en un mensaje de resumen
+   acumulativo y conserva solo los últimos keep_last_turns turnos.
+
+Los tokens se cuentan con tiktoken (src/tools/tokens.py). Las métricas de
+cada llamada quedan en state["token_metrics"] y en el log.
+"""
+import json, time, logging
+from typing import Dict, List, Optional
+
+from langchain_core.messages import (
+    AIMessage, BaseMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage,
+)
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from src.components.estado import State
+from src.tools.tokens import count_tokens, count_tokens_batch, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Id fijo del mensaje de resumen: se sustituye en cada nuevo resumen
+SUMMARY_ID = "resumen-conversacion"
+SUMMARY_PREFIX = "Resumen de la conversación anterior: "
+TRUNCATED_MARK = " …[salida recortada]"
+
+# Tokens extra por mensaje (rol y separadores) que añade el formato de chat
+_TOKENS_PER_MESSAGE = 4
+
+_SUMMARY_PROMPT = (
+    "Resume en español y en pocas frases la conversación siguiente, conservando "
+    "nombres, datos y preguntas pendientes del usuario. Si hay un resumen previo, "
+    "intégralo.\n\n{conversation}"
+)
+
+
+def _text(msg: BaseMessage) -> str:
+    """Texto de un mensaje para contar tokens (contenido + llamadas a herramientas)."""
+    content = msg.content
+    if isinstance(content, list):
+        content = " ".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    calls = getattr(msg, "tool_calls", None)
+    if calls:
+        content += json.dumps([{"name": c["name"], "args": c["args"]} for c in calls], ensure_ascii=False)
+    return content
+
+
+def count_message_tokens(messages: List[BaseMessage]) -> List[int]:
+    """Tokens de cada mensaje."""
+    return [n + _TOKENS_PER_MESSAGE for n in count_tokens_batch([_text(m) for m in messages])]
+
+
+class HistoryTrimmer:
+    """
+    Nodo que mantiene el historial dentro de un presupuesto de tokens.
+
+    Args:
+        model: modelo de chat para resumir (None = resumen extractivo, sin LLM)
+        max_history_tokens: presupuesto para los mensajes del prompt
+        keep_last_turns: turnos recientes (pregunta del usuario en adelante) que nunca se resumen
+        stale_tool_tokens: tokens que se conservan de cada salida de herramienta antigua
+        summary_max_tokens: tamaño máximo del resumen acumulativo
+    """
+    def __init__(self, model=None, max_history_tokens: int = 4000, keep_last_turns: int = 2,
+                 stale_tool_tokens: int = 200, summary_max_tokens: int = 300):
+        self.model = model
+        self.max_history_tokens = max_history_tokens
+        self.keep_last_turns = keep_last_turns
+        self.stale_tool_tokens = stale_tool_tokens
+        self.summary_max_tokens = summary_max_tokens
+
+    # ---------- pasos ----------
+    def _truncate_stale_tools(self, messages: List[BaseMessage]) -> tuple[List[BaseMessage], int]:
+        """Recorta las salidas de herramientas anteriores a la última pregunta."""
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        result, truncated = [], 0
+        for i, msg in enumerate(messages):
+            if (i < last_human and isinstance(msg, ToolMessage) and isinstance(msg.content, str)
+                    and not msg.content.endswith(TRUNCATED_MARK)):
+                short = truncate_tokens(msg.content, self.stale_tool_tokens)
+                if short != msg.content:
+                    msg = msg.model_copy(update={"content": short + TRUNCATED_MARK})
+                    truncated += 1
+            result.append(msg)
+        return result, truncated
+
+    def _split_old(self, messages: List[BaseMessage]) -> tuple[Optional[str], List[BaseMessage], List[BaseMessage]]:
+        """(resumen previo, mensajes a resumir, mensajes recientes); se corta en una pregunta del usuario."""
+        previous = None
+        if messages and messages[0].id == SUMMARY_ID:
+            previous = str(messages[0].content).removeprefix(SUMMARY_PREFIX)
+            messages = messages[1:]
+        humans = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if len(humans) <= self.keep_last_turns:
+            return previous, [], messages
+        cut = humans[-self.keep_last_turns]
+        return previous, messages[:cut], messages[cut:]
+
+    def _transcript(self, previous: Optional[str], old: List[BaseMessage]) -> str:
+        lines = [f"Resumen previo: {previous}"] if previous else []
+        for msg in old:
+            if isinstance(msg, HumanMessage):
+                lines.append(f"Usuario: {_text(msg)}")
+            elif isinstance(msg, AIMessage) and msg.content:
+                lines.append(f"Asistente: {_text(msg)}")
+            elif isinstance(msg, ToolMessage):
+                lines.append(f"Herramienta: {truncate_tokens(str(msg.content), self.stale_tool_tokens)}")
+        return "\n".join(lines)
+
+    def _extractive_summary(self, previous: Optional[str], old: List[BaseMessage]) -> str:
+        """Resumen sin LLM: preguntas y respuestas anteriores, recortadas."""
+        parts = [previous] if previous else []
+        for msg in old:
+            if isinstance(msg, HumanMessage):
+                parts.append(f"el usuario preguntó «{truncate_tokens(_text(msg), 40)}»")
+            elif isinstance(msg, AIMessage) and msg.content and not msg.tool_calls:
+                parts.append(f"se respondió «{truncate_tokens(_text(msg), 60)}»")
+        # Se conserva lo más reciente si el resumen excede el presupuesto
+        while len(parts) > 1 and count_tokens("; ".join(parts)) > self.summary_max_tokens:
+            parts.pop(0)
+        return truncate_tokens("; ".join(parts), self.summary_max_tokens)
+
+    def _summary_message(self, summary: str) -> SystemMessage:
+        return SystemMessage(content=SUMMARY_PREFIX + summary, id=SUMMARY_ID)
+
+    def _finish(self, state: State, messages: List[BaseMessage], metrics: Dict, started: float) -> Dict:
+        metrics["tokens_despues"] = sum(count_message_tokens(messages))
+        metrics["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if metrics["tokens_despues"] > self.max_history_tokens:
+            logger.warning(f"Historial sobre el presupuesto tras recortar: {metrics}")
+        logger.info(f"Tokens del prompt: {metrics}")
+        update: Dict = {"token_metrics": metrics}
+        if messages is not state["messages"]:
+            update["messages"] = [RemoveMessage(id=REMOVE_ALL_MESSAGES), *messages]
+        return update
+
+    def _plan(self, state: State) -> tuple[List[BaseMessage], Dict, Optional[tuple]]:
+        """Aplica el recorte de herramientas y decide si hace falta resumir."""
+        messages = state["messages"]
+        before = sum(count_message_tokens(messages))
+        metrics = {
+            "tokens_antes": before,
+            "presupuesto": self.max_history_tokens,
+            "herramientas_recortadas": 0,
+            "mensajes_resumidos": 0,
+        }
+        if before <= self.max_history_tokens:
+            return messages, metrics, None
+
+        trimmed, n_truncated = self._truncate_stale_tools(messages)
+        metrics["herramientas_recortadas"] = n_truncated
+        if n_truncated == 0:
+            trimmed = messages
+        if sum(count_message_tokens(trimmed)) <= self.max_history_tokens:
+            return trimmed, metrics, None
+
+        previous, old, recent = self._split_old(trimmed)
+        if not old:
+            return trimmed, metrics, None
+        metrics["mensajes_resumidos"] = len(old)
+        return trimmed, metrics, (previous, old, recent)
+
+    # ---------- nodo ----------
+    def __call__(self, state: State, config: RunnableConfig | None = None):
+        started = time.perf_counter()
+        messages, metrics, pending = self._plan(state)
+        if pending is not None:
+            previous, old, recent = pending
+            summary = None
+            if self.model is not None:
+                try:
+                    prompt = _SUMMARY_PROMPT.format(conversation=self._transcript(previous, old))
+                    summary = _text(self.model.invoke([HumanMessage(prompt)], config)).strip()
+                except Exception as e:
+                    logger.warning(f"No se pudo resumir con el modelo, se usa resumen extractivo: {str(e)}")
+            summary = truncate_tokens(summary, self.summary_max_tokens) if summary else self._extractive_summary(previous, old)
+            messages = [self._summary_message(summary), *recent]
+        return self._finish(state, messages, metrics, started)
+
+    async def acall(self, state: State, config: RunnableConfig | None = None):
+        """Versión asíncrona de __call__ (el resumen usa ainvoke)."""
+        started = time.perf_counter()
+        messages, metrics, pending = self._plan(state)
+        if pending is not None:
+            previous, old, recent = pending
+            summary = None
+            if self.model is not None:
+                try:
+                    prompt = _SUMMARY_PROMPT.format(conversation=self._transcript(previous, old))
+                    summary = _text(await self.model.ainvoke([HumanMessage(prompt)], config)).strip()
+                except Exception as e:
+                    logger.warning(f"No se pudo resumir con el modelo, se usa resumen extractivo: {str(e)}")
+            summary = truncate_tokens(summary, self.summary_max_tokens) if summary else self._extractive_summary(previous, old)
+            messages = [self._summary_message(summary), *recent]
+        return self._finish(state, messages, metrics, started)
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.__call__, afunc=self.acall, name="trim_history")
@@ -0,0 +1,152 @@
+# src/components/retry.py
+"""
+Política de reintentos y circuit breaker para las llamadas al modelo.
+
+- RetryPolicy: backoff exponencial con jitter completo, solo para errores
+  transitorios (timeouts, 429, 5xx), respetando Retry-After y con un plazo
+  máximo por turno.
+- CircuitBreaker: tras varios fallos transitorios seguidos deja de llamar
+  al proveedor durante reset_timeout segundos y después deja pasar una
+  sola llamada de prueba. Se comparte entre todas las sesiones del proceso
+  (shared_circuit_breaker) para no insistir contra un proveedor caído.
+"""
+import time, random, threading, logging
+from functools import lru_cache
+from typing import Callable, Optional
+
+from src.tools.async_embedder import is_transient_error, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """El circuito está abierto: no se llama al proveedor hasta pasado retry_after."""
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito '{name}' abierto por fallos repetidos; "
+                         f"reintenta en {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    """
+    Cuándo y cuánto esperar antes de reintentar.
+
+    Args:
+        max_attempts: intentos totales por turno (el primero incluido)
+        base_delay: espera base del backoff (segundos), se duplica en cada intento
+        max_delay: techo de la espera calculada
+        deadline: segundos máximos por turno, esperas incluidas (None = sin plazo)
+        max_retry_after: techo para la espera que pida el proveedor con Retry-After
+        retry_on: clasificador de errores transitorios
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 20.0,
+                 deadline: Optional[float] = 60.0, max_retry_after: float = 30.0,
+                 retry_on: Callable[[Exception], bool] = is_transient_error):
+        if max_attempts < 1:
+            raise ValueError("max_attempts debe ser al menos 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.max_retry_after = max_retry_after
+        self.retry_on = retry_on
+
+    def remaining(self, started: float) -> Optional[float]:
+        """Segundos que quedan del plazo del turno (None = sin plazo)."""
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - started)
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Espera antes del intento attempt + 1; Retry-After manda si viene."""
+        wait = retry_after_seconds(error)
+        if wait is not None:
+            return min(max(wait, 0.0), self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def next_delay(self, attempt: int, error: Exception, started: float) -> Optional[float]:
+        """Espera antes de reintentar o None si no hay que reintentar."""
+        if not self.retry_on(error):
+            logger.error(f"Error no transitorio ({type(error).__name__}), no se reintenta: {str(error)}")
+            return None
+        if attempt >= self.max_attempts:
+            logger.error("Se agotaron todos los reintentos")
+            return None
+        wait = self.delay(attempt, error)
+        remaining = self.remaining(started)
+        if remaining is not None and wait >= remaining:
+            logger.error(f"Sin tiempo para otro intento: espera {wait:.2f}s, quedan {max(remaining, 0):.2f}s del plazo")
+            return None
+        logger.warning(f"Error transitorio ({type(error).__name__}), "
+                       f"reintento {attempt + 1}/{self.max_attempts} en {wait:.2f}s")
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker seguro entre hilos (cerrado -> abierto -> semiabierto).
+
+    Args:
+        failure_threshold: fallos transitorios seguidos que abren el circuito
+        reset_timeout: segundos abierto antes de permitir una llamada de prueba
+        name: nombre para los logs
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, name: str = "llm"):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold debe ser al menos 1")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def before_call(self) -> None:
+        """Lanza CircuitOpenError si el circuito no deja pasar la llamada."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            waited = now - self._opened_at
+            if waited < self.reset_timeout:
+                raise CircuitOpenError(self.name, self.reset_timeout - waited)
+            # Semiabierto: una sola llamada de prueba (si se pierde, otra tras reset_timeout)
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                raise CircuitOpenError(self.name, self.reset_timeout - (now - self._probe_started))
+            self._probe_started = now
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuito '{self.name}' cerrado: el proveedor responde de nuevo")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probe_started is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+                logger.error(f"Circuito '{self.name}' abierto tras {self._failures} fallos transitorios; "
+                             f"pausa de {self.reset_timeout:.0f}s")
+
+    def stats(self) -> dict:
+        return {"estado": self.state, "fallos_seguidos": self._failures}
+
+
+@lru_cache(maxsize=None)
+def shared_circuit_breaker(name: str = "llm") -> CircuitBreaker:
+    """Circuit breaker único por nombre en el proceso, compartido por todas las sesiones."""
+    return CircuitBreaker(name=name)
@@ -0,0 +1,428 @@
+# src/components/semantic_cache.py
+"""
+Caché semántica de respuestas delante del agente.
+
+Cada pregunta se convierte en embedding y se busca en un índice FAISS
+pequeño de preguntas anteriores. Si la más parecida supera el umbral de
+similitud, se responde con la respuesta guardada sin llamar al LLM ni a
+Herramienta_RAG. Las entradas caducan por TTL, se expulsan por LRU y se
+descartan todas cuando cambia la versión del índice RAG.
+
+La huella del contexto de una entrada es la de las salidas de herramientas
+de su turno. Con context_fn, un candidato que supera el umbral solo se
+reutiliza si sus llamadas a herramientas, repetidas ahora, devuelven el
+mismo contexto: la recuperación se paga solo en los posibles aciertos.
+
+La caché es compartida por todas las conversaciones y cada pregunta se
+decide en su turno: la entrada lleva un ámbito (history_scope), vacío para
+la primera pregunta de un hilo y, en los siguientes turnos, la huella del
+intercambio anterior (pregunta y respuesta, o el resumen de la conversación).
+Un seguimiento como "¿y el segundo?" solo reutiliza una respuesta dada tras
+el mismo intercambio. En el CLI, que usa un único thread_id por sesión, la
+primera pregunta se comparte entre sesiones y las demás aciertan cuando la
+conversación repite el intercambio anterior (p. ej. dos sesiones que empiezan
+igual); repetir una pregunta más adelante en la misma sesión no acierta.
+"""
+import time, asyncio, hashlib, threading, logging
+import faiss
+import numpy as np
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.graph import END
+
+from src.components.estado import State
+
+logger = logging.getLogger(__name__)
+
+# Marca en response_metadata de las respuestas servidas desde la caché
+CACHE_MARK = "semantic_cache"
+
+
+class SemanticCache:
+    """
+    Índice FAISS (producto interno sobre vectores normalizados) de entradas
+    (pregunta, huella del contexto recuperado, respuesta).
+
+    Args:
+        embed_fn: función lista de textos -> matriz de embeddings
+        aembed_fn: versión asíncrona de embed_fn (opcional; si falta se usa embed_fn en un hilo)
+        version_fn: versión actual del índice RAG, o {componente: versión} (p. ej. por
+            shard); debe ser barata. None en una versión = aún sin cargar, no invalida
+        context_fn: huella (context_fingerprint) de las salidas que darían ahora las
+            llamadas a herramientas de una entrada, por pasos del asistente; None si
+            no se pueden repetir. Si falta, la huella guardada no se comprueba
+        acontext_fn: versión asíncrona de context_fn (opcional; si falta se usa context_fn en un hilo)
+        threshold: similitud coseno mínima para reutilizar una respuesta
+        ttl_seconds: vida máxima de una entrada
+        max_entries: tamaño máximo antes de expulsar las menos usadas
+        min_chars: preguntas más cortas (p. ej. "¿y eso?") no se cachean
+    """
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray],
+                 aembed_fn: Optional[Callable[[List[str]], Awaitable[np.ndarray]]] = None,
+                 version_fn: Optional[Callable[[], Union[Optional[str], Dict[str, Optional[str]]]]] = None,
+                 context_fn: Optional[Callable[[List[List[Dict]]], Optional[str]]] = None,
+                 acontext_fn: Optional[Callable[[List[List[Dict]]], Awaitable[Optional[str]]]] = None,
+                 threshold: float = 0.95, ttl_seconds: float = 24 * 3600,
+                 max_entries: int = 1000, min_chars: int = 12):
+        self.embed_fn = embed_fn
+        self.aembed_fn = aembed_fn
+        self.version_fn = version_fn
+        self.context_fn = context_fn
+        self.acontext_fn = acontext_fn
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.min_chars = min_chars
+
+        # Protege índice, entradas, versión, _recent y contadores
+        self._lock = threading.Lock()
+        # Un índice por ámbito de historial: solo se comparan preguntas del mismo ámbito
+        self._indexes: Dict[str, faiss.Index] = {}
+        # id -> {question, scope, answer, context_fp, calls, created}; el orden es el de uso (LRU)
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        # Última versión conocida de cada componente del índice RAG
+        self._versions: Dict[str, str] = {}
+        # Último embedding de cada pregunta consultada, para no recalcularlo al guardar
+        self._recent: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- utilidades ----------
+    def _remember(self, question: str, embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        with self._lock:
+            self._recent[question] = vector
+            if len(self._recent) > 64:
+                self._recent.popitem(last=False)
+        return vector
+
+    def _recent_vector(self, question: str) -> Optional[np.ndarray]:
+        with self._lock:
+            return self._recent.get(question)
+
+    def _embed(self, question: str) -> np.ndarray:
+        # El embedding se calcula fuera del lock: puede ser una llamada de red
+        vector = self._recent_vector(question)
+        if vector is None:
+            vector = self._remember(question, self.embed_fn([question]))
+        return vector
+
+    async def _aembed(self, question: str) -> np.ndarray:
+        vector = self._recent_vector(question)
+        if vector is None:
+            if self.aembed_fn is not None:
+                embedding = await self.aembed_fn([question])
+            else:
+                embedding = await asyncio.to_thread(self.embed_fn, [question])
+            vector = self._remember(question, embedding)
+        return vector
+
+    def _remove(self, ids: List[int]) -> None:
+        by_scope: Dict[str, List[int]] = {}
+        for i in ids:
+            entry = self._entries.pop(i, None)
+            if entry is not None:
+                by_scope.setdefault(entry["scope"], []).append(i)
+        for scope, scope_ids in by_scope.items():
+            index = self._indexes[scope]
+            index.remove_ids(np.asarray(scope_ids, dtype=np.int64))
+            if index.ntotal == 0:
+                del self._indexes[scope]
+
+    def _check_version(self) -> None:
+        """
+        Vacía la caché si cambió la versión de algún componente ya conocido del
+        índice RAG. Un componente que se carga por primera vez no invalida nada.
+        """
+        if self.version_fn is None:
+            return
+        versions = self.version_fn()
+        if not isinstance(versions, dict):
+            versions = {"": versions}
+        versions = {name: v for name, v in versions.items() if v is not None}
+        with self._lock:
+            if any(self._versions.get(name, v) != v for name, v in versions.items()):
+                if self._entries:
+                    logger.info(f"Índice RAG actualizado: se invalidan {len(self._entries)} respuestas cacheadas")
+                self._clear()
+            self._versions.update(versions)
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._indexes.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def cacheable(self, question: str) -> bool:
+        return len(question.strip()) >= self.min_chars
+
+    # ---------- consulta ----------
+    def lookup(self, question: str, scope: str = "") -> Optional[Dict]:
+        """Entrada cacheada más parecida del ámbito *scope* (con su "similarity") o None."""
+        if not self.cacheable(question):
+            return None
+        self._check_version()
+        hit = self._search(self._embed(question), scope)
+        if hit is not None and hit["calls"] and self.context_fn is not None:
+            hit = self._same_context(hit, self.context_fn(hit["calls"]))
+        return self._count(hit)
+
+    async def alookup(self, question: str, scope: str = "") -> Optional[Dict]:
+        """Versión asíncrona de lookup."""
+        if not self.cacheable(question):
+            return None
+        self._check_version()
+        hit = self._search(await self._aembed(question), scope)
+        if hit is not None and hit["calls"] and self.context_fn is not None:
+            hit = self._same_context(hit, await self._acontext(hit["calls"]))
+        return self._count(hit)
+
+    async def _acontext(self, calls: List[List[Dict]]) -> Optional[str]:
+        if self.acontext_fn is not None:
+            return await self.acontext_fn(calls)
+        return await asyncio.to_thread(self.context_fn, calls)
+
+    @staticmethod
+    def _same_context(hit: Dict, context_fp: Optional[str]) -> Optional[Dict]:
+        """El acierto solo vale si las herramientas de la entrada devuelven ahora el mismo contexto."""
+        if hit["context_fp"] != context_fp:
+            logger.debug(f"Caché semántica: el contexto de '{hit['question'][:50]}' ha cambiado")
+            return None
+        return hit
+
+    def _count(self, hit: Optional[Dict]) -> Optional[Dict]:
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return hit
+
+    def _search(self, vector: np.ndarray, scope: str) -> Optional[Dict]:
+        """Entrada vigente más parecida del ámbito por encima del umbral (sin contar acierto ni fallo)."""
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                return None
+            scores, ids = index.search(vector, 1)
+            score, entry_id = float(scores[0][0]), int(ids[0][0])
+            entry = self._entries.get(entry_id)
+            if entry is not None and time.time() - entry["created"] > self.ttl_seconds:
+                self._remove([entry_id])
+                entry = None
+            if entry is None or score < self.threshold:
+                return None
+            self._entries.move_to_end(entry_id)
+            return {**entry, "similarity": score}
+
+    def store(self, question: str, answer: str, context_fp: str, scope: str = "",
+              calls: Optional[List[List[Dict]]] = None) -> None:
+        """
+        Guarda una respuesta en el ámbito *scope*; sustituye a la entrada casi
+        idéntica si existe. *calls* son las llamadas a herramientas del turno
+        ({name, args} por paso del asistente) cuyas salidas dan *context_fp*.
+        """
+        if not self.cacheable(question) or not answer:
+            return
+        self._check_version()
+        self._insert(question, scope, answer, context_fp, calls or [], self._embed(question))
+
+    async def astore(self, question: str, answer: str, context_fp: str, scope: str = "",
+                     calls: Optional[List[List[Dict]]] = None) -> None:
+        """Versión asíncrona de store."""
+        if not self.cacheable(question) or not answer:
+            return
+        self._check_version()
+        self._insert(question, scope, answer, context_fp, calls or [], await self._aembed(question))
+
+    def _insert(self, question: str, scope: str, answer: str, context_fp: str, calls: List[List[Dict]],
+                vector: np.ndarray) -> None:
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is not None:
+                scores, ids = index.search(vector, 1)
+                if scores[0][0] >= self.threshold and int(ids[0][0]) in self._entries:
+                    self._remove([int(ids[0][0])])
+
+            now = time.time()
+            expired = [i for i, e in self._entries.items() if now - e["created"] > self.ttl_seconds]
+            overflow = len(self._entries) - len(expired) + 1 - self.max_entries
+            lru = [i for i in self._entries if i not in set(expired)][:max(overflow, 0)]
+            self._remove(expired + lru)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            if scope not in self._indexes:
+                self._indexes[scope] = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            self._indexes[scope].add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                "question": question,
+                "scope": scope,
+                "answer": answer,
+                "context_fp": context_fp,
+                "calls": calls,
+                "created": now,
+            }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+# ---------- nodos del grafo ----------
+def _current_turn(messages: list) -> tuple[Optional[str], list, str]:
+    """
+    Última pregunta del usuario, los mensajes generados después y su ámbito
+    (history_scope de los mensajes anteriores). (None, [], "") si no hay pregunta de texto.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            content = messages[i].content
+            if not isinstance(content, str):
+                return None, [], ""
+            return content, messages[i + 1:], history_scope(messages[:i])
+    return None, [], ""
+
+
+def history_scope(history: list) -> str:
+    """
+    Huella corta del intercambio anterior a una pregunta: desde la pregunta
+    previa del usuario (o el resumen de la conversación) hasta su respuesta,
+    sin llamadas ni salidas de herramientas. "" si la pregunta abre el hilo.
+    """
+    start = 0
+    for i in range(len(history) - 1, -1, -1):
+        if isinstance(history[i], HumanMessage):
+            start = i
+            break
+    digest = hashlib.sha256()
+    for msg in history[start:]:
+        if isinstance(msg, ToolMessage) or getattr(msg, "tool_calls", None):
+            continue
+        digest.update(f"{msg.type}:{msg.content}\n".encode("utf-8"))
+    return digest.hexdigest()[:16] if history else ""
+
+
+def context_fingerprint(outputs: List[Union[ToolMessage, str]]) -> str:
+    """Huella del contexto recuperado por las herramientas durante el turno (mensajes o sus textos)."""
+    digest = hashlib.sha256()
+    for output in outputs:
+        digest.update(str(output.content if isinstance(output, ToolMessage) else output).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def tool_steps(turn: list) -> List[List[Dict]]:
+    """Llamadas a herramientas de un turno ({name, args}), agrupadas por mensaje del asistente."""
+    return [[{"name": call["name"], "args": call["args"]} for call in msg.tool_calls]
+            for msg in turn if isinstance(msg, AIMessage) and msg.tool_calls]
+
+
+class SemanticCacheLookup:
+    """Nodo inicial: responde desde la caché si la pregunta ya se contestó."""
+    def __init__(self, cache: SemanticCache):
+        self.cache = cache
+
+    def __call__(self, state: State, config: RunnableConfig | None = None):
+        question, _, scope = _current_turn(state["messages"])
+        if not question:
+            return {"messages": []}
+        started = time.perf_counter()
+        try:
+            hit = self.cache.lookup(question, scope)
+        except Exception as e:
+            # La caché nunca debe impedir responder
+            logger.warning(f"Caché semántica no disponible: {str(e)}")
+            return {"messages": [], "cache_scope": scope}
+        return self._answer(hit, scope, started)
+
+    async def acall(self, state: State, config: RunnableConfig | None = None):
+        question, _, scope = _current_turn(state["messages"])
+        if not question:
+            return {"messages": []}
+        started = time.perf_counter()
+        try:
+            hit = await self.cache.alookup(question, scope)
+        except Exception as e:
+            logger.warning(f"Caché semántica no disponible: {str(e)}")
+            return {"messages": [], "cache_scope": scope}
+        return self._answer(hit, scope, started)
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.__call__, afunc=self.acall, name="cache_lookup")
+
+    @staticmethod
+    def _answer(hit: Optional[Dict], scope: str, started: float) -> Dict:
+        if hit is None:
+            return {"messages": [], "cache_scope": scope}
+        logger.info(
+            f"Respuesta desde caché semántica (similitud {hit['similarity']:.3f}, "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms)"
+        )
+        return {"messages": [AIMessage(
+            content=hit["answer"],
+            response_metadata={CACHE_MARK: True, "similarity": hit["similarity"]},
+        )], "cache_scope": scope}
+
+
+class SemanticCacheStore:
+    """Nodo final: guarda la respuesta del turno si no hubo errores de herramientas."""
+    def __init__(self, cache: SemanticCache):
+        self.cache = cache
+
+    def __call__(self, state: State, config: RunnableConfig | None = None):
+        entry = self._entry(state)
+        if entry is not None:
+            try:
+                self.cache.store(*entry)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar en la caché semántica: {str(e)}")
+        return {"messages": []}
+
+    async def acall(self, state: State, config: RunnableConfig | None = None):
+        entry = self._entry(state)
+        if entry is not None:
+            try:
+                await self.cache.astore(*entry)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar en la caché semántica: {str(e)}")
+        return {"messages": []}
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.__call__, afunc=self.acall, name="cache_store")
+
+    @staticmethod
+    def _entry(state: State) -> Optional[tuple[str, str, str, str, List[List[Dict]]]]:
+        """(pregunta, respuesta, huella, ámbito, llamadas) del turno o None si no se debe cachear."""
+        question, turn, scope = _current_turn(state["messages"])
+        # El ámbito es el de la búsqueda del turno, aunque luego se resumiera el historial
+        scope = state.get("cache_scope", scope)
+        if not question or not turn:
+            return None
+        answer = turn[-1]
+        if not isinstance(answer, AIMessage) or answer.tool_calls or not isinstance(answer.content, str):
+            return None
+        tool_messages = [m for m in turn if isinstance(m, ToolMessage)]
+        if any(str(m.content).startswith("Error") for m in tool_messages):
+            return None
+        return question, answer.content, context_fingerprint(tool_messages), scope, tool_steps(turn)
+
+
+def route_cache(state: State):
+    """Tras la búsqueda en caché: fin si hubo acierto, si no al asistente."""
+    last = state["messages"][-1] if state["messages"] else None
+    if isinstance(last, AIMessage) and last.response_metadata.get(CACHE_MARK):
+        return END
+    return "assistant"
@@ -0,0 +1,216 @@
+# src/components/server.py
+"""
+Servidor ASGI (FastAPI) del agente LangGraph + RAG.
+
+El grafo y el índice RAG se crean una vez por proceso al arrancar. Cada
+petición es un UserQueryRequest; su thread_id es el thread_id del
+checkpointer, así que varias sesiones conviven en el mismo proceso.
+
+Endpoints:
+- POST /chat:        respuesta completa en JSON.
+- POST /chat/stream: tokens por Server-Sent Events (eventos token, tool, retry, end, error;
+                     ver streaming.astream_turn).
+- GET  /health:      estado y peticiones en curso.
+
+Ejecuta con:
+    python servidor_agente.py --port 8000
+"""
+import json, time, asyncio, logging, weakref
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from src.components.retry import CircuitOpenError, shared_circuit_breaker
+from src.components.streaming import astream_turn
+from src.components.utils import UserQueryRequest
+
+logger = logging.getLogger(__name__)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que libera el hueco de concurrencia al terminar, también
+    si el cliente se desconecta o el envío falla antes de empezar el generador.
+    """
+    def __init__(self, content, release: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._release()
+
+
+def _last_answer(state: dict) -> Optional[str]:
+    for msg in reversed(state.get("messages", [])):
+        if getattr(msg, "type", None) == "ai" and msg.content:
+            return msg.content if isinstance(msg.content, str) else str(msg.content)
+    return None
+
+
+def create_app(agent=None, model=None, rag=None, data_path: str = "data",
+               max_concurrency: int = 32, queue_timeout: float = 5.0,
+               request_timeout: float = 120.0) -> FastAPI:
+    """
+    Crea la aplicación.
+
+    Args:
+        agent: grafo ya compilado (si falta se construye con build_agent al arrancar)
+        model: modelo de chat para build_agent (por defecto get_chat_model())
+        rag: instancia RAGLocal que sirve como única colección (por defecto, las
+            colecciones de data_path; ver collection_registry)
+        max_concurrency: peticiones al agente a la vez en este proceso
+        queue_timeout: segundos de espera por un hueco antes de responder 503
+        request_timeout: segundos máximos por petición
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # Un lock por conversación: dos peticiones del mismo thread_id no se mezclan
+    thread_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+    stats = {"en_curso": 0, "atendidas": 0, "rechazadas": 0, "timeouts": 0}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        from src.tools.collection_registry import (
+            DEFAULT_COLLECTION, Collection, CollectionRegistry, init_registry, set_registry,
+        )
+
+        started = time.perf_counter()
+        if rag is not None:
+            set_registry(CollectionRegistry([Collection(DEFAULT_COLLECTION, [rag])]), data_path)
+        else:
+            # Carga (o crea) los índices de todas las colecciones antes de aceptar peticiones
+            await asyncio.to_thread(lambda: init_registry(data_path).load())
+        if agent is not None:
+            app.state.agent = agent
+        else:
+            from src.components.agent_builder import build_agent
+            chat_model = model
+            if chat_model is None:
+                from src.config.config import get_chat_model
+                chat_model = get_chat_model()
+            app.state.agent = build_agent(chat_model)
+        logger.info(f"Servidor listo en {(time.perf_counter() - started) * 1000:.1f} ms "
+                    f"(max_concurrency={max_concurrency}, timeout={request_timeout}s)")
+        yield
+
+    app = FastAPI(title="Agente LangGraph + RAG", lifespan=lifespan)
+
+    @asynccontextmanager
+    async def slot(thread_id: str):
+        """Hueco de concurrencia del proceso + turno dentro de la conversación."""
+        try:
+            await asyncio.wait_for(semaphore.acquire(), queue_timeout)
+        except asyncio.TimeoutError:
+            stats["rechazadas"] += 1
+            logger.warning(f"Servidor saturado: petición de {thread_id} rechazada")
+            raise HTTPException(status_code=503, detail="Servidor ocupado, reintenta en unos segundos",
+                                headers={"Retry-After": "1"})
+        stats["en_curso"] += 1
+        try:
+            lock = thread_locks.get(thread_id)
+            if lock is None:
+                lock = thread_locks[thread_id] = asyncio.Lock()
+            async with lock:
+                yield
+        finally:
+            stats["en_curso"] -= 1
+            stats["atendidas"] += 1
+            semaphore.release()
+
+    def _validate(body: UserQueryRequest) -> tuple[dict, dict]:
+        if not body.input or not body.input.strip():
+            raise HTTPException(status_code=422, detail="input no puede estar vacío")
+        if not body.thread_id:
+            raise HTTPException(status_code=422, detail="thread_id es obligatorio")
+        config = {"configurable": {"thread_id": body.thread_id}}
+        return {"messages": [("user", body.input.strip())]}, config
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "max_concurrency": max_concurrency, **stats,
+                "circuito_llm": shared_circuit_breaker().stats()}
+
+    @app.post("/chat")
+    async def chat(body: UserQueryRequest, request: Request):
+        state, config = _validate(body)
+        started = time.perf_counter()
+        async with slot(body.thread_id):
+            try:
+                result = await asyncio.wait_for(
+                    request.app.state.agent.ainvoke(state, config), request_timeout
+                )
+            except asyncio.TimeoutError:
+                stats["timeouts"] += 1
+                logger.error(f"Timeout ({request_timeout}s) en la conversación {body.thread_id}")
+                raise HTTPException(status_code=504, detail="Tiempo de respuesta agotado")
+            except CircuitOpenError as e:
+                logger.warning(f"Proveedor no disponible ({body.thread_id}): {str(e)}")
+                raise HTTPException(status_code=503, detail="Modelo no disponible, reintenta más tarde",
+                                    headers={"Retry-After": str(max(1, round(e.retry_after)))})
+            except Exception as e:
+                logger.error(f"Error en el agente ({body.thread_id}): {str(e)}")
+                raise HTTPException(status_code=500, detail=f"Error procesando la pregunta: {str(e)}")
+        logger.info(f"Respuesta para {body.thread_id} en {(time.perf_counter() - started) * 1000:.0f} ms")
+        return {"thread_id": body.thread_id, "respuesta": _last_answer(result)}
+
+    @app.post("/chat/stream")
+    async def chat_stream(body: UserQueryRequest, request: Request):
+        state, config = _validate(body)
+        # El hueco se reserva antes de responder para poder devolver 503. Se libera una
+        # sola vez (aclose es idempotente): al acabar el generador o al terminar la respuesta
+        slot_stack = AsyncExitStack()
+        await slot_stack.enter_async_context(slot(body.thread_id))
+
+        async def events() -> AsyncIterator[str]:
+            deadline = time.perf_counter() + request_timeout
+            stream = astream_turn(request.app.state.agent, state, config)
+            try:
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    try:
+                        event = await asyncio.wait_for(stream.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    if event["type"] == "token":
+                        yield _sse("token", {"content": event["content"]})
+                    elif event["type"] == "tool":
+                        yield _sse("tool", {"name": event["name"], "label": event["label"]})
+                    elif event["type"] == "retry":
+                        yield _sse("retry", {"attempt": event["attempt"]})
+                    elif event["type"] == "end":
+                        yield _sse("end", {"thread_id": body.thread_id, "respuesta": event["respuesta"],
+                                           "ttft_ms": event["ttft_ms"], "total_ms": event["total_ms"]})
+            except asyncio.TimeoutError:
+                stats["timeouts"] += 1
+                logger.error(f"Timeout ({request_timeout}s) en la conversación {body.thread_id}")
+                yield _sse("error", {"detail": "Tiempo de respuesta agotado"})
+            except CircuitOpenError as e:
+                logger.warning(f"Proveedor no disponible ({body.thread_id}): {str(e)}")
+                yield _sse("error", {"detail": "Modelo no disponible, reintenta más tarde",
+                                     "retry_after": round(e.retry_after, 1)})
+            except Exception as e:
+                logger.error(f"Error en el agente ({body.thread_id}): {str(e)}")
+                yield _sse("error", {"detail": f"Error procesando la pregunta: {str(e)}"})
+            finally:
+                try:
+                    await stream.aclose()
+                finally:
+                    await slot_stack.aclose()
+
+        try:
+            return _SlotStreamingResponse(events(), slot_stack.aclose, media_type="text/event-stream",
+                                          headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        except BaseException:
+            await slot_stack.aclose()
+            raise
+
+    return app
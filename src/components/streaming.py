@@ -0,0 +1,120 @@
+# src/components/streaming.py
+"""
+Streaming de un turno del agente como eventos (CLI y servidor).
+
+astream_turn combina tres modos de stream del grafo:
+- "messages": tokens de la respuesta según los genera el modelo (y la
+  respuesta completa de la caché semántica).
+- "updates":  mensajes completos de cada nodo; de aquí salen el progreso de
+  las herramientas ("Buscando en los documentos…") y sus resultados.
+- "custom":   avisos de los nodos, p. ej. el reintento del asistente (los
+  tokens ya enviados de ese intento dejan de valer).
+
+Eventos (dicts con "type"):
+- token:       {"content"}
+- tool:        {"name", "args", "label"}   el modelo pidió una herramienta
+- tool_result: {"name", "status"}          la herramienta terminó
+- retry:       {"attempt"}                 el asistente repite la llamada
+- message:     {"node", "message"}         mensaje completo de un nodo (ver utils._print_event)
+- end:         {"respuesta", "ttft_ms", "total_ms", "tool_calls"}
+
+El tiempo hasta el primer token (TTFT) y la duración del turno se
+registran en el log en cada turno.
+"""
+import time, logging
+from typing import AsyncIterator, Dict, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
+
+logger = logging.getLogger(__name__)
+
+# Nodos del grafo cuyos mensajes son la respuesta al usuario
+ANSWER_NODES = {"assistant", "cache_lookup"}
+
+# Texto de progreso por herramienta ({name} para las que no están en la tabla)
+TOOL_PROGRESS = {
+    "Herramienta_RAG": "Buscando en los documentos…",
+}
+DEFAULT_TOOL_PROGRESS = "Ejecutando {name}…"
+
+
+def tool_label(name: str) -> str:
+    return TOOL_PROGRESS.get(name, DEFAULT_TOOL_PROGRESS.format(name=name))
+
+
+def emit(event: Dict) -> None:
+    """Envía un evento al modo "custom" del stream del grafo (sin efecto fuera de un nodo)."""
+    try:
+        writer = get_stream_writer()
+    except (RuntimeError, KeyError):
+        return
+    writer(event)
+
+
+def _token(message, metadata: Dict) -> Optional[str]:
+    if metadata.get("langgraph_node") not in ANSWER_NODES:
+        return None
+    if not isinstance(message, (AIMessage, AIMessageChunk)) or not isinstance(message.content, str):
+        return None
+    return message.content or None
+
+
+async def astream_turn(agent, turn: Dict, config: RunnableConfig) -> AsyncIterator[Dict]:
+    """
+    Ejecuta un turno con agent.astream y lo devuelve como eventos.
+
+    Args:
+        agent: grafo compilado
+        turn: entrada del turno, p. ej. {"messages": [("user", texto)]}
+        config: config del grafo (thread_id del checkpointer)
+    """
+    thread_id = config.get("configurable", {}).get("thread_id")
+    started = time.perf_counter()
+    first_token: Optional[float] = None
+    parts: list[str] = []
+    tool_calls = 0
+
+    stream = agent.astream(turn, config, stream_mode=["messages", "updates", "custom"])
+    try:
+        async for mode, chunk in stream:
+            if mode == "messages":
+                content = _token(*chunk)
+                if content is None:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    logger.info(f"Primer token para {thread_id} en {(first_token - started) * 1000:.0f} ms")
+                parts.append(content)
+                yield {"type": "token", "content": content}
+
+            elif mode == "custom":
+                if isinstance(chunk, dict) and chunk.get("type") == "retry":
+                    parts.clear()
+                    yield chunk
+
+            else:
+                for node, update in chunk.items():
+                    messages = update.get("messages", []) if isinstance(update, dict) else []
+                    for message in messages if isinstance(messages, list) else [messages]:
+                        yield {"type": "message", "node": node, "message": message}
+                        if node == "assistant" and getattr(message, "tool_calls", None):
+                            # Lo escrito antes de llamar a herramientas no es la respuesta final
+                            parts.clear()
+                            for call in message.tool_calls:
+                                tool_calls += 1
+                                yield {"type": "tool", "name": call["name"], "args": call["args"],
+                                       "label": tool_label(call["name"])}
+                        elif isinstance(message, ToolMessage):
+                            yield {"type": "tool_result", "name": message.name, "status": message.status}
+    finally:
+        await stream.aclose()
+
+    total_ms = (time.perf_counter() - started) * 1000
+    ttft_ms = round((first_token - started) * 1000, 1) if first_token is not None else None
+    logger.info(f"Turno de {thread_id} completado en {total_ms:.0f} ms "
+                f"(primer token: {f'{ttft_ms:.0f} ms' if ttft_ms is not None else 'sin tokens'}, "
+                f"{tool_calls} llamadas a herramientas)")
+    yield {"type": "end", "respuesta": "".join(parts), "ttft_ms": ttft_ms,
+           "total_ms": round(total_ms, 1), "tool_calls": tool_calls}
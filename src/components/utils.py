@@ -1,8 +1,12 @@
-from langchain_core.messages import ToolMessage
-from langchain_core.runnables import RunnableLambda
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.prebuilt import ToolNode, tools_condition
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from langgraph.graph import END
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import time
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,8 +25,120 @@ def handle_tool_error(state) -> dict:
     }
 
 
-def create_tool_node_with_fallback(tools: list) -> dict:
-    return ToolNode(tools).with_fallbacks(
+# Ejecución en lote de una herramienta: lista de argumentos -> una respuesta por llamada
+BatchFn = Callable[[List[dict]], List[str]]
+ABatchFn = Callable[[List[dict]], Awaitable[List[str]]]
+
+
+class BatchedToolNode:
+    """
+    Nodo de herramientas que ejecuta todas las llamadas de un turno a la vez.
+
+    Las llamadas a una herramienta con ejecución en lote (batch_handlers) se
+    agrupan en una sola invocación (p. ej. Herramienta_RAG: un lote de
+    embeddings y una búsqueda FAISS para todas las subpreguntas). El resto se
+    delega en un ToolNode, en paralelo con los lotes. Cada llamada recibe su
+    propio ToolMessage, en el orden en que el modelo las pidió.
+
+    Args:
+        tools: herramientas del agente
+        batch_handlers: {nombre de herramienta: (función en lote, versión asíncrona)}
+    """
+    def __init__(self, tools: list, batch_handlers: Optional[Dict[str, Tuple[BatchFn, ABatchFn]]] = None):
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.batch_handlers = {
+            name: fns for name, fns in (batch_handlers or {}).items() if name in self.tools_by_name
+        }
+        self.tool_node = ToolNode(tools)
+
+    # ---------- reparto ----------
+    def _split(self, state) -> Tuple[AIMessage, Dict[str, List[dict]], List[dict], List[ToolMessage]]:
+        """(mensaje del modelo, llamadas en lote por herramienta, llamadas sueltas, errores de argumentos)."""
+        message = state["messages"][-1]
+        batches: Dict[str, List[dict]] = {}
+        single: List[dict] = []
+        invalid: List[ToolMessage] = []
+        for call in message.tool_calls:
+            if call["name"] not in self.batch_handlers:
+                single.append(call)
+                continue
+            tool = self.tools_by_name[call["name"]]
+            try:
+                # Aplica los valores por defecto y tipos del esquema, como haría la herramienta
+                args = tool.args_schema.model_validate(call["args"]).model_dump()
+            except ValidationError as e:
+                invalid.append(ToolMessage(
+                    content=f"Error: {repr(e)}\n please fix your mistakes.",
+                    name=call["name"], tool_call_id=call["id"], status="error",
+                ))
+                continue
+            batches.setdefault(call["name"], []).append({**call, "args": args})
+        return message, batches, single, invalid
+
+    def _single_state(self, state, message: AIMessage, single: List[dict]) -> dict:
+        """Estado para el ToolNode con solo las llamadas que no van en lote."""
+        partial = message.model_copy(update={"tool_calls": single})
+        return {**state, "messages": [*state["messages"][:-1], partial]}
+
+    @staticmethod
+    def _batch_messages(name: str, calls: List[dict], outputs: List[str]) -> List[ToolMessage]:
+        if len(outputs) != len(calls):
+            raise ValueError(f"La ejecución en lote de {name} devolvió {len(outputs)} respuestas "
+                             f"para {len(calls)} llamadas")
+        return [
+            ToolMessage(content=output, name=name, tool_call_id=call["id"])
+            for call, output in zip(calls, outputs)
+        ]
+
+    def _finish(self, message: AIMessage, results: List[ToolMessage], started: float) -> dict:
+        order = {call["id"]: i for i, call in enumerate(message.tool_calls)}
+        results.sort(key=lambda m: order.get(m.tool_call_id, len(order)))
+        logger.debug(f"{len(results)} llamadas a herramientas en "
+                     f"{(time.perf_counter() - started) * 1000:.1f} ms")
+        return {"messages": results}
+
+    # ---------- nodo ----------
+    def __call__(self, state, config: RunnableConfig | None = None) -> dict:
+        started = time.perf_counter()
+        message, batches, single, invalid = self._split(state)
+        results: List[ToolMessage] = list(invalid)
+        with ThreadPoolExecutor(max_workers=len(batches) + 1) as executor:
+            futures = {
+                name: executor.submit(self.batch_handlers[name][0], [c["args"] for c in calls])
+                for name, calls in batches.items()
+            }
+            singles = (executor.submit(self.tool_node.invoke, self._single_state(state, message, single), config)
+                       if single else None)
+            for name, future in futures.items():
+                results.extend(self._batch_messages(name, batches[name], future.result()))
+            if singles is not None:
+                results.extend(singles.result()["messages"])
+        return self._finish(message, results, started)
+
+    async def acall(self, state, config: RunnableConfig | None = None) -> dict:
+        """Versión asíncrona de __call__: lotes y herramientas sueltas con asyncio.gather."""
+        started = time.perf_counter()
+        message, batches, single, invalid = self._split(state)
+        names = list(batches)
+        tasks = [self.batch_handlers[name][1]([c["args"] for c in batches[name]]) for name in names]
+        if single:
+            tasks.append(self.tool_node.ainvoke(self._single_state(state, message, single), config))
+        outputs = await asyncio.gather(*tasks)
+        results: List[ToolMessage] = list(invalid)
+        for name, output in zip(names, outputs):
+            results.extend(self._batch_messages(name, batches[name], output))
+        if single:
+            results.extend(outputs[-1]["messages"])
+        return self._finish(message, results, started)
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.__call__, afunc=self.acall, name="tools")
+
+
+def create_tool_node_with_fallback(tools: list,
+                                   batch_handlers: Optional[Dict[str, Tuple[BatchFn, ABatchFn]]] = None) -> dict:
+    node = BatchedToolNode(tools, batch_handlers).as_runnable() if batch_handlers else ToolNode(tools)
+    return node.with_fallbacks(
         [RunnableLambda(handle_tool_error)], exception_key="error"
     )
 
@@ -35,19 +151,22 @@ def route_tools(state):
 
 
 def _print_event(event: dict, _printed: set, max_length=1500):
-    current_state = event.get("dialog_state")
-    if current_state:
-        logger.debug("Currently in: %s", current_state[-1])
-    message = event.get("messages")
-    if message:
-        if isinstance(message, list):
-            message = message[-1]
-        if message.id not in _printed:
-            msg_repr = message.pretty_repr(html=True)
-            if len(msg_repr) > max_length:
-                msg_repr = msg_repr[:max_length] + " ... (truncated)"
-            logger.debug("%s",msg_repr)
-            _printed.add(message.id)
+    """
+    Registra (debug) los mensajes completos de un evento de streaming.astream_turn,
+    una vez por id de mensaje; el resto de eventos se ignora.
+    """
+    if event.get("type") != "message":
+        return
+    message = event["message"]
+    if message.id is not None and message.id in _printed:
+        return
+    logger.debug("Nodo: %s", event.get("node"))
+    msg_repr = message.pretty_repr(html=True)
+    if len(msg_repr) > max_length:
+        msg_repr = msg_repr[:max_length] + " ... (truncated)"
+    logger.debug("%s", msg_repr)
+    if message.id is not None:
+        _printed.add(message.id)
 
 class UserQueryRequest(BaseModel):
     thread_id: str
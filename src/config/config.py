@@ -2,16 +2,12 @@ import os
 import logging
 import asyncio
 from dotenv import load_dotenv
-import nest_asyncio
 import openai
 from langchain_openai import ChatOpenAI
 from langsmith.utils import tracing_is_enabled
 
 logger = logging.getLogger(__name__)
 
-# Configuración de asyncio para Windows
-nest_asyncio.apply()
-
 # Cargar variables de entorno
 load_dotenv(override=True)
 logger.info("Cargando .env…")
@@ -44,13 +40,19 @@ def get_chat_model(
     name: str = "gpt-4o-mini",
     temperature: float = 0,
     max_tokens: int = 1024,
+    max_retries: int = 0,
 ) -> ChatOpenAI:
-    """Devuelve un ChatOpenAI ya configurado."""
+    """
+    Devuelve un ChatOpenAI ya configurado.
+    Por defecto el cliente no reintenta: los reintentos del agente los gestiona
+    Assistant con su RetryPolicy (src/components/retry.py).
+    """
     try:
         return ChatOpenAI(
             model=name,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            max_retries=max_retries,
         )
     except Exception as e:
         logger.exception("No se pudo inicializar el modelo %s: %s", name, str(e))
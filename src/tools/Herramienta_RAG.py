@@ -1,21 +1,77 @@
-from langchain_core.tools import tool
-from typing import Dict
-import openai
-import os
-from src.tools.rag import RAGLocal
-from typing import Annotated
+from langchain_core.tools import StructuredTool
+from typing import Literal, Optional
+import asyncio
 import logging
 
-from src.tools.rag import init_rag
+from src.tools.collection_registry import ALL_COLLECTIONS, CollectionRegistry, init_registry
+from src.tools.chunk_filter import filter_key, make_chunk_filter
+from src.tools.retrieval import format_chunks
 
 logger = logging.getLogger(__name__)
 
-_rag = init_rag("data") 
+# Similitud coseno mínima para que un fragmento llegue al prompt
+MIN_SCORE = 0.25
+# Lambda de MMR: evita que los k fragmentos sean copias del mismo pasaje
+DIVERSITY = 0.7
+# Fragmentos por defecto: con el re-ranker los k mejores de ~50 candidatos, para
+# que el modelo no necesite una segunda llamada por un único fragmento flojo
+DEFAULT_K = 3
+# Argumentos de filtrado de la herramienta -> claves de chunk_filter
+FILTER_ARGS = {
+    "documento": "source",
+    "tipo": "file_type",
+    "pagina_desde": "page_from",
+    "pagina_hasta": "page_to",
+    "modificado_desde": "modified_after",
+    "modificado_antes": "modified_before",
+}
 
-@tool
-def Herramienta_RAG(
+def _get_registry() -> CollectionRegistry:
+    """Inicialización perezosa: cada colección se carga en la primera búsqueda que la usa."""
+    return init_registry("data")
+
+def _filters(args: dict) -> dict | None:
+    """Filtro de metadatos (claves de chunk_filter) a partir de los argumentos de la herramienta."""
+    filters = {FILTER_ARGS[name]: value for name, value in args.items()
+               if name in FILTER_ARGS and value not in (None, "")}
+    return filters or None
+
+def _validate(input: str, k: int, coleccion: str = ALL_COLLECTIONS, filters: dict | None = None) -> str | None:
+    """Mensaje de error para el modelo o None si la entrada es válida."""
+    if not isinstance(input, str) or not input.strip():
+        return "Error: El texto de búsqueda no puede estar vacío."
+    
+    if not isinstance(k, int) or k < 1 or k > 10:
+        return "Error: El parámetro 'k' debe ser un número entero entre 1 y 10."
+
+    names = _get_registry().names()
+    if coleccion != ALL_COLLECTIONS and coleccion not in names:
+        return f"Error: Colección desconocida '{coleccion}'. Disponibles: {', '.join(names)} o '{ALL_COLLECTIONS}'."
+
+    try:
+        make_chunk_filter(**(filters or {}))
+    except (ValueError, TypeError) as e:
+        # TypeError: valores mal tipados en llamadas que no pasan por el esquema (p. ej. en lote)
+        return f"Error: Filtro no válido: {str(e)}"
+    return None
+
+def _format_hits(hits: list) -> str:
+    logger.debug(f"Fragmentos recuperados: {hits}")
+    if not hits:
+        return "No se encontraron documentos relevantes para tu búsqueda."
+    return format_chunks(hits)
+
+def _herramienta_rag(
     input: str,
-    k: int = 1) -> str:
+    k: int = DEFAULT_K,
+    modo: Literal["vector", "lexical", "hybrid"] = "hybrid",
+    coleccion: str = ALL_COLLECTIONS,
+    documento: Optional[str] = None,
+    tipo: Optional[Literal["pdf", "docx", "txt"]] = None,
+    pagina_desde: Optional[int] = None,
+    pagina_hasta: Optional[int] = None,
+    modificado_desde: Optional[str] = None,
+    modificado_antes: Optional[str] = None) -> str:
     """Devuelve la búsqueda RAG para *input* recuperando *k* fragmentos. Esta herramienta te permite buscar información sobre:
         redes neuronales
         deep learning
@@ -27,30 +83,150 @@ def Herramienta_RAG(
     Args:
         input: el texto para realizar la busqueda en la base de datos vectorizada
         k: el número de trozos que recuperamos de la base de datos vectorizada (1-10)
+        modo: "vector" (semántica), "lexical" (términos exactos: siglas, nombres de fórmulas
+            o autores) o "hybrid" (combina ambas; recomendado)
+        coleccion: nombre de la colección de documentos (p. ej. de un equipo o dominio)
+            o "all" para buscar en todas
+        documento: solo en este documento (nombre de archivo, p. ej. "informe.pdf")
+        tipo: solo en documentos de este tipo ("pdf", "docx" o "txt")
+        pagina_desde / pagina_hasta: solo en estas páginas (inclusive) de los PDF
+        modificado_desde / modificado_antes: solo en documentos modificados desde / antes
+            de una fecha ISO, p. ej. "2024-05-01"
 
     Returns:
         str: Fragmentos relevantes encontrados en la base de datos
     """
     
     # Validación de entrada
-    if not input or not input.strip():
-        return "Error: El texto de búsqueda no puede estar vacío."
-    
-    if not isinstance(k, int) or k < 1 or k > 10:
-        return "Error: El parámetro 'k' debe ser un número entero entre 1 y 10."
+    filters = _filters(dict(documento=documento, tipo=tipo, pagina_desde=pagina_desde, pagina_hasta=pagina_hasta,
+                            modificado_desde=modificado_desde, modificado_antes=modificado_antes))
+    error = _validate(input, k, coleccion, filters)
+    if error:
+        return error
     
     try:
         # Limpiar y normalizar el input
         clean_input = input.strip()
-        logger.debug(f"Realizando búsqueda RAG para: '{clean_input}' con k={k}")
+        logger.debug(f"Realizando búsqueda RAG para: '{clean_input}' con k={k}, modo={modo}, coleccion={coleccion}, "
+                     f"filtros={filters}")
         
-        result = _rag.query(clean_input, k=k)
-        
-        if not result or result.strip() == "":
-            return "No se encontraron documentos relevantes para tu búsqueda."
-        
-        return result
+        hits = _get_registry().query_batch([clean_input], k=k, collection=coleccion, min_score=MIN_SCORE,
+                                           mode=modo, diversity=DIVERSITY, filters=filters)[0]
+        return _format_hits(hits)
         
     except Exception as e:
         logger.error(f"Error en búsqueda RAG: {str(e)}")
-        return f"Error interno en la búsqueda: {str(e)}"
\ No newline at end of file
+        return f"Error interno en la búsqueda: {str(e)}"
+
+async def _aherramienta_rag(
+    input: str,
+    k: int = DEFAULT_K,
+    modo: Literal["vector", "lexical", "hybrid"] = "hybrid",
+    coleccion: str = ALL_COLLECTIONS,
+    documento: Optional[str] = None,
+    tipo: Optional[Literal["pdf", "docx", "txt"]] = None,
+    pagina_desde: Optional[int] = None,
+    pagina_hasta: Optional[int] = None,
+    modificado_desde: Optional[str] = None,
+    modificado_antes: Optional[str] = None) -> str:
+    """Versión asíncrona: embeddings con AsyncOpenAI y búsqueda FAISS en un hilo."""
+    filters = _filters(dict(documento=documento, tipo=tipo, pagina_desde=pagina_desde, pagina_hasta=pagina_hasta,
+                            modificado_desde=modificado_desde, modificado_antes=modificado_antes))
+    error = _validate(input, k, coleccion, filters)
+    if error:
+        return error
+
+    try:
+        clean_input = input.strip()
+        logger.debug(f"Realizando búsqueda RAG asíncrona para: '{clean_input}' con k={k}, modo={modo}, "
+                     f"coleccion={coleccion}, filtros={filters}")
+
+        # Las colecciones se cargan fuera del bucle de eventos en su primera consulta
+        hits = (await _get_registry().aquery_batch([clean_input], k=k, collection=coleccion, min_score=MIN_SCORE,
+                                                   mode=modo, diversity=DIVERSITY, filters=filters))[0]
+        return _format_hits(hits)
+
+    except Exception as e:
+        logger.error(f"Error en búsqueda RAG: {str(e)}")
+        return f"Error interno en la búsqueda: {str(e)}"
+
+# ---------- ejecución en lote ----------
+def _group_calls(calls: list[dict]) -> tuple[list[str | None], dict[tuple, list[int]]]:
+    """
+    Valida cada llamada y agrupa las válidas por modo de búsqueda, colección y filtro.
+    Devuelve (errores por llamada, {(modo, colección, filtro): índices de llamadas}),
+    con el filtro normalizado como tupla de pares (vacía si no hay filtro).
+    """
+    errors: list[str | None] = []
+    groups: dict[tuple, list[int]] = {}
+    for i, args in enumerate(calls):
+        coleccion = args.get("coleccion", ALL_COLLECTIONS)
+        filters = _filters(args)
+        error = _validate(args.get("input", ""), args.get("k", DEFAULT_K), coleccion, filters)
+        errors.append(error)
+        if error is None:
+            normalized = make_chunk_filter(**(filters or {}))
+            key = (args.get("modo", "hybrid"), coleccion, filter_key(normalized) if normalized else ())
+            groups.setdefault(key, []).append(i)
+    return errors, groups
+
+def _split_hits(calls: list[dict], idx: list[int], hits: list[list], out: list[str]) -> None:
+    """Cada llamada se queda con sus k primeros fragmentos del lote (pedido con el k máximo)."""
+    for i, call_hits in zip(idx, hits):
+        out[i] = _format_hits(call_hits[: calls[i].get("k", DEFAULT_K)])
+
+def herramienta_rag_batch(calls: list[dict]) -> list[str]:
+    """
+    Ejecuta varias llamadas a Herramienta_RAG del mismo turno como una sola
+    consulta por modo, colección y filtro: un lote de embeddings y una búsqueda sobre la matriz de
+    preguntas. *calls* son los argumentos de cada llamada; devuelve una
+    respuesta por llamada, igual que _herramienta_rag.
+    """
+    errors, groups = _group_calls(calls)
+    out = [e or "" for e in errors]
+    for (modo, coleccion, filters), idx in groups.items():
+        k = max(calls[i].get("k", DEFAULT_K) for i in idx)
+        questions = [calls[i]["input"].strip() for i in idx]
+        logger.debug(f"Búsqueda RAG en lote: {len(questions)} preguntas, k={k}, modo={modo}, coleccion={coleccion}, "
+                     f"filtros={dict(filters)}")
+        try:
+            hits = _get_registry().query_batch(questions, k=k, collection=coleccion, min_score=MIN_SCORE,
+                                               mode=modo, diversity=DIVERSITY, filters=dict(filters) or None)
+            _split_hits(calls, idx, hits, out)
+        except Exception as e:
+            logger.error(f"Error en búsqueda RAG: {str(e)}")
+            for i in idx:
+                out[i] = f"Error interno en la búsqueda: {str(e)}"
+    return out
+
+async def aherramienta_rag_batch(calls: list[dict]) -> list[str]:
+    """Versión asíncrona de herramienta_rag_batch; los grupos se consultan a la vez."""
+    errors, groups = _group_calls(calls)
+    out = [e or "" for e in errors]
+    if not groups:
+        return out
+    registry = _get_registry()
+
+    async def run(modo: str, coleccion: str, filters: tuple, idx: list[int]) -> None:
+        k = max(calls[i].get("k", DEFAULT_K) for i in idx)
+        questions = [calls[i]["input"].strip() for i in idx]
+        logger.debug(f"Búsqueda RAG asíncrona en lote: {len(questions)} preguntas, k={k}, modo={modo}, "
+                     f"coleccion={coleccion}, filtros={dict(filters)}")
+        try:
+            hits = await registry.aquery_batch(questions, k=k, collection=coleccion, min_score=MIN_SCORE,
+                                               mode=modo, diversity=DIVERSITY, filters=dict(filters) or None)
+            _split_hits(calls, idx, hits, out)
+        except Exception as e:
+            logger.error(f"Error en búsqueda RAG: {str(e)}")
+            for i in idx:
+                out[i] = f"Error interno en la búsqueda: {str(e)}"
+
+    await asyncio.gather(*(run(*key, idx) for key, idx in groups.items()))
+    return out
+
+# Una sola herramienta con camino síncrono (invoke) y asíncrono (ainvoke)
+Herramienta_RAG = StructuredTool.from_function(
+    func=_herramienta_rag,
+    coroutine=_aherramienta_rag,
+    name="Herramienta_RAG",
+)
@@ -0,0 +1,205 @@
+# async_embedder.py
+"""
+Motor asíncrono de embeddings para la indexación.
+
+Mantiene varios lotes en vuelo con openai.AsyncOpenAI, agrupa los textos
+por presupuesto de tokens (no por un número fijo de elementos), respeta
+los límites de peticiones/tokens por minuto con un token bucket y
+reintenta los 429/5xx con backoff exponencial con jitter. El orden de
+salida es siempre el de entrada.
+"""
+import asyncio, random, threading, time, logging
+import numpy as np
+import openai
+from typing import Callable, List, Optional, Sequence
+
+from src.tools.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket asíncrono: admite `rate` unidades por minuto con
+    ráfagas de hasta `capacity` unidades.
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute debe ser positivo")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """Espera hasta poder consumir `amount` unidades."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Errores transitorios: límites de tasa, timeouts, conexión y 5xx."""
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError,
+                          openai.APIConnectionError, openai.InternalServerError,
+                          TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Segundos indicados por la cabecera Retry-After (o retry-after-ms), si existe."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000.0
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AsyncEmbeddingEngine:
+    """
+    Genera embeddings con varios lotes concurrentes.
+    - client: openai.AsyncOpenAI (o cualquier objeto con embeddings.create asíncrono).
+    - max_in_flight: lotes enviados a la vez.
+    - max_batch_tokens / max_batch_items: límites de cada lote.
+    - requests_per_minute / tokens_per_minute: límites de la cuenta (None = sin límite).
+    """
+    def __init__(self, client: Optional[openai.AsyncOpenAI] = None,
+                 model: str = "text-embedding-3-large",
+                 max_in_flight: int = 4,
+                 max_batch_tokens: int = 50_000,
+                 max_batch_items: int = 2048,
+                 requests_per_minute: Optional[int] = 3_000,
+                 tokens_per_minute: Optional[int] = 1_000_000,
+                 max_retries: int = 6,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0,
+                 token_counter: Callable[[str], int] = count_tokens):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight debe ser al menos 1")
+        if max_batch_tokens < 1 or max_batch_items < 1:
+            raise ValueError("max_batch_tokens y max_batch_items deben ser positivos")
+
+        self.client = client or openai.AsyncOpenAI()
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.token_counter = token_counter
+
+        # El cliente asíncrono vive siempre en el mismo bucle (hilo propio)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._request_bucket: Optional[TokenBucket] = None
+        self._token_bucket: Optional[TokenBucket] = None
+
+    # ---------- lotes ----------
+    def pack_batches(self, texts: Sequence[str]) -> List[List[int]]:
+        """Agrupa los índices de los textos en lotes por presupuesto de tokens."""
+        batches, current, current_tokens = [], [], 0
+        for i, n in enumerate(self.token_counter(t) for t in texts):
+            if current and (current_tokens + n > self.max_batch_tokens
+                            or len(current) >= self.max_batch_items):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += n
+        if current:
+            batches.append(current)
+        return batches
+
+    # ---------- llamadas ----------
+    async def _create(self, inputs: List[str], n_tokens: int) -> List[List[float]]:
+        """Una petición de embeddings con límites de tasa y reintentos."""
+        for attempt in range(self.max_retries + 1):
+            if self._request_bucket is not None:
+                await self._request_bucket.acquire(1)
+            if self._token_bucket is not None:
+                await self._token_bucket.acquire(n_tokens)
+            try:
+                resp = await self.client.embeddings.create(model=self.model, input=inputs)
+                return [r.embedding for r in resp.data]
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient_error(e):
+                    raise
+                # Backoff exponencial con jitter completo; Retry-After manda si viene
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.warning(
+                    f"Embeddings: error transitorio ({type(e).__name__}), "
+                    f"reintento {attempt + 1}/{self.max_retries} en {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embeddings de los textos en el mismo orden, con max_in_flight lotes a la vez."""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        if self._request_bucket is None and self.requests_per_minute:
+            self._request_bucket = TokenBucket(self.requests_per_minute)
+        if self._token_bucket is None and self.tokens_per_minute:
+            self._token_bucket = TokenBucket(self.tokens_per_minute)
+
+        batches = self.pack_batches(texts)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def run(batch: List[int]) -> None:
+            inputs = [texts[i] for i in batch]
+            n_tokens = sum(self.token_counter(t) for t in inputs)
+            async with semaphore:
+                embeds = await self._create(inputs, n_tokens)
+            for i, emb in zip(batch, embeds):
+                results[i] = emb
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run(b) for b in batches))
+        logger.debug(
+            f"Embeddings asíncronos: {len(texts)} textos en {len(batches)} lotes "
+            f"({time.perf_counter() - started:.2f}s)"
+        )
+        return np.asarray(results, dtype=np.float32)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="embeddings-loop", daemon=True
+                ).start()
+        return self._loop
+
+    async def aembed_threadsafe(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        aembed desde cualquier bucle de eventos: se ejecuta en el bucle del motor
+        (donde viven el cliente y los límites de tasa) sin bloquear al llamante.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.aembed(texts), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Versión síncrona de aembed; funciona aunque el llamante tenga un bucle activo."""
+        future = asyncio.run_coroutine_threadsafe(self.aembed(texts), self._ensure_loop())
+        return future.result()
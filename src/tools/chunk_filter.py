@@ -0,0 +1,114 @@
+# chunk_filter.py
+"""
+Filtros de metadatos para las búsquedas de RAGLocal.
+
+Un filtro restringe la consulta a algunos chunks según los atributos que
+se guardan al indexar (ver chunk_store.ATTR_DTYPE):
+- source: documento(s) por nombre de archivo o ruta relativa ("informe.pdf",
+  "legal/contrato.docx"); sin distinguir mayúsculas.
+- file_type: tipo(s) de archivo ("pdf", "docx", "txt").
+- page_from / page_to: páginas (inclusive) en que empieza el chunk; solo
+  documentos paginados (PDF).
+- modified_after / modified_before: fecha de modificación del documento,
+  como datetime, date, texto ISO ("2024-05-01") o segundos epoch;
+  modified_after es inclusive y modified_before exclusivo.
+
+La máscara de chunks permitidos se calcula con operaciones vectorizadas
+sobre las columnas del almacén y se pasa a FAISS como IDSelectorBitmap
+(y a BM25 como máscara), así que el filtro se aplica dentro de la
+búsqueda en lugar de pedir más resultados y descartarlos después.
+"""
+import os, logging
+import numpy as np
+from datetime import date, datetime
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+from src.tools.chunk_store import ChunkStore, DELETED, FILE_TYPES
+
+logger = logging.getLogger(__name__)
+
+FILTER_KEYS = ("source", "file_type", "page_from", "page_to", "modified_after", "modified_before")
+
+DateLike = Union[datetime, date, str, int, float]
+
+
+def _as_tuple(value: Union[str, Sequence[str]], name: str) -> Tuple[str, ...]:
+    values = (value,) if isinstance(value, str) else tuple(value) if isinstance(value, (list, tuple, set)) else None
+    if values is None or not all(isinstance(v, str) for v in values):
+        raise TypeError(f"{name} debe ser un texto o una lista de textos: {value!r}")
+    return values
+
+
+def _timestamp(value: DateLike, name: str) -> int:
+    """Segundos epoch de una fecha (las fechas sin zona horaria son locales)."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.strip())
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        return int(value.timestamp())
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"{name} debe ser una fecha (p. ej. '2024-05-01'): {value!r}") from e
+
+
+def make_chunk_filter(source: Optional[Union[str, Sequence[str]]] = None,
+                      file_type: Optional[Union[str, Sequence[str]]] = None,
+                      page_from: Optional[int] = None, page_to: Optional[int] = None,
+                      modified_after: Optional[DateLike] = None,
+                      modified_before: Optional[DateLike] = None) -> Optional[Dict]:
+    """
+    Filtro normalizado (o None si no restringe nada). Lanza ValueError si
+    algún valor no es válido y TypeError si no es del tipo esperado.
+    """
+    filters: Dict = {}
+    if source:
+        filters["source"] = tuple(s.strip().replace("\\", "/").lstrip("/").lower()
+                                  for s in _as_tuple(source, "source"))
+    if file_type:
+        types = tuple(t.strip().lower().lstrip(".") for t in _as_tuple(file_type, "file_type"))
+        unknown = [t for t in types if t not in FILE_TYPES]
+        if unknown:
+            raise ValueError(f"file_type debe ser uno de {FILE_TYPES}: {unknown}")
+        filters["file_type"] = types
+    for name, page in (("page_from", page_from), ("page_to", page_to)):
+        if page is not None:
+            if not isinstance(page, int) or page < 1:
+                raise ValueError(f"{name} debe ser un entero mayor o igual que 1")
+            filters[name] = page
+    for name, value in (("modified_after", modified_after), ("modified_before", modified_before)):
+        if value is not None:
+            filters[name] = _timestamp(value, name)
+    return filters or None
+
+
+def filter_key(filters: Dict) -> Tuple:
+    """Clave hashable de un filtro normalizado (para cachear su máscara)."""
+    return tuple(sorted(filters.items()))
+
+
+def _source_matches(path: str, sources: Tuple[str, ...]) -> bool:
+    path = path.replace(os.sep, "/").lower()
+    return any(path == s or path.endswith("/" + s) for s in sources)
+
+
+def chunk_mask(store: ChunkStore, filters: Dict) -> np.ndarray:
+    """Máscara booleana por id de chunk: vivos y que cumplen el filtro."""
+    path_ids, attrs = store.columns()
+    mask = path_ids != DELETED
+    if "source" in filters:
+        # Se evalúa una vez por documento y se propaga a sus chunks
+        allowed_paths = np.asarray([_source_matches(p, filters["source"]) for p in store.paths] + [False])
+        mask &= allowed_paths[path_ids]
+    if "file_type" in filters:
+        mask &= np.isin(attrs["ext"], [FILE_TYPES.index(t) + 1 for t in filters["file_type"]])
+    if "page_from" in filters:
+        mask &= attrs["page"] >= filters["page_from"]
+    if "page_to" in filters:
+        mask &= (attrs["page"] <= filters["page_to"]) & (attrs["page"] > 0)
+    if "modified_after" in filters:
+        mask &= attrs["mtime"] >= filters["modified_after"]
+    if "modified_before" in filters:
+        mask &= (attrs["mtime"] < filters["modified_before"]) & (attrs["mtime"] > 0)
+    return mask
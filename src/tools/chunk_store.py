@@ -0,0 +1,312 @@
+# chunk_store.py
+"""
+Almacén binario de metadatos de chunks, mapeado en memoria.
+
+Sustituye al antiguo vectorized_db_meta.txt (una línea `path|texto` por
+chunk) por tres archivos junto al índice FAISS:
+- <prefijo>_paths.json:  tabla de documentos (path_id -> ruta).
+- <prefijo>_chunks.npy:  array estructurado por chunk (offset, longitud, path_id).
+- <prefijo>_text.bin:    todos los textos en UTF-8, uno tras otro.
+- <prefijo>_attrs.npy:   atributos por chunk para filtrar las búsquedas
+                         (página, fecha de modificación y tipo de archivo).
+
+Los tres últimos se abren con mmap, así que cargar el índice no depende del
+tamaño del corpus y una consulta solo decodifica los k chunks que devuelve.
+El id de un chunk es su fila; los chunks borrados tienen path_id = -1.
+Los índices anteriores a _attrs.npy se cargan con página y fecha a 0
+(desconocidas) hasta reconstruirlos.
+
+Los archivos crecen solo por el final: al guardar, los textos nuevos se
+añaden a _text.bin y sus filas a _chunks.npy y _attrs.npy, y los chunks
+borrados se marcan en su fila (tombstone) sin tocar el resto. El texto de
+los borrados queda como basura hasta que se compacta el almacén: al crearlo
+de cero (create_index) o cuando la basura supera compact_ratio del texto.
+"""
+import os, json, mmap, logging
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from src.tools.npy_append import append_rows
+
+logger = logging.getLogger(__name__)
+
+ROW_DTYPE = np.dtype([
+    ("offset", np.int64),
+    ("length", np.int32),
+    ("path_id", np.int32),
+])
+
+ATTR_DTYPE = np.dtype([
+    ("page", np.int32),    # página en que empieza el chunk (0 = documento sin páginas)
+    ("mtime", np.int64),   # fecha de modificación del documento (segundos epoch; 0 = desconocida)
+    ("ext", np.uint8),     # posición + 1 en FILE_TYPES (0 = otro)
+])
+
+DELETED = -1
+FILE_TYPES = ("pdf", "docx", "txt")
+# Fracción del texto guardado que puede ser de chunks borrados antes de compactar
+COMPACT_RATIO = 0.3
+
+
+def file_type_code(path: str) -> int:
+    """Código de tipo de archivo de ATTR_DTYPE["ext"]."""
+    ext = path.lower().rsplit(".", 1)[-1]
+    return FILE_TYPES.index(ext) + 1 if ext in FILE_TYPES else 0
+
+
+class ChunkStore:
+    """
+    Metadatos de los chunks indexados por id. Las filas guardadas se leen
+    del mmap; los chunks añadidos o borrados desde la última carga se
+    mantienen en memoria hasta save().
+    """
+    def __init__(self, prefix: str, compact_ratio: float = COMPACT_RATIO):
+        self.prefix = prefix
+        self.compact_ratio = compact_ratio
+        self.paths_path = f"{prefix}_paths.json"
+        self.rows_path = f"{prefix}_chunks.npy"
+        self.text_path = f"{prefix}_text.bin"
+        self.attrs_path = f"{prefix}_attrs.npy"
+
+        self._rows = np.empty(0, dtype=ROW_DTYPE)
+        self._attrs = np.empty(0, dtype=ATTR_DTYPE)
+        # False si el almacén guardado no tenía atributos (índice anterior)
+        self.has_attributes = True
+        self._blob: Optional[mmap.mmap] = None
+        self._blob_file = None
+        self._paths: List[str] = []
+        self._path_ids: Dict[str, int] = {}
+        # Cambios pendientes de guardar
+        self._new: List[Tuple[int, str]] = []
+        self._new_attrs: List[Tuple[int, int, int]] = []
+        self._deleted: set = set()
+        # (path_id, atributos) de todos los chunks, calculados al pedirlos
+        self._columns: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # Un almacén sin abrir es nuevo: su primer save() escribe los archivos completos
+        self._replace = True
+        self._n_saved_paths = 0
+
+    # ---------- carga ----------
+    def exists(self) -> bool:
+        return all(os.path.isfile(p) for p in (self.paths_path, self.rows_path, self.text_path))
+
+    def open(self) -> "ChunkStore":
+        """Abre los archivos guardados con mmap (solo lectura)."""
+        self.close()
+        with open(self.paths_path, encoding="utf-8") as fh:
+            self._paths = json.load(fh)
+        self._path_ids = {p: i for i, p in enumerate(self._paths)}
+        self._rows = np.load(self.rows_path, mmap_mode="r")
+        self._attrs = np.load(self.attrs_path, mmap_mode="r") if os.path.isfile(self.attrs_path) else None
+        # Los atributos se añaden antes que las filas: si un guardado se interrumpió puede haber de más
+        self.has_attributes = self._attrs is not None and len(self._attrs) >= len(self._rows)
+        # Con atributos de más, añadir por el final los desalinearía: el próximo save() reescribe
+        stale_attrs = self.has_attributes and len(self._attrs) > len(self._rows)
+        if self.has_attributes:
+            self._attrs = self._attrs[:len(self._rows)]
+        if not self.has_attributes:
+            logger.warning(f"{self.prefix}: índice sin atributos por chunk; los filtros por página o fecha "
+                           f"no encontrarán sus chunks hasta reconstruirlo con create_index()")
+            self._attrs = np.zeros(len(self._rows), dtype=ATTR_DTYPE)
+            ext = np.asarray([file_type_code(p) for p in self._paths] + [0], dtype=np.uint8)
+            self._attrs["ext"] = ext[self._rows["path_id"]]
+        self._blob_file = open(self.text_path, "rb")
+        if os.fstat(self._blob_file.fileno()).st_size:
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._new, self._new_attrs, self._deleted = [], [], set()
+        self._columns = None
+        self._replace = stale_attrs
+        self._n_saved_paths = len(self._paths)
+        return self
+
+    def close(self) -> None:
+        """Libera los mmap (necesario antes de reemplazar los archivos en Windows)."""
+        self._rows = np.empty(0, dtype=ROW_DTYPE)
+        self._attrs = np.empty(0, dtype=ATTR_DTYPE)
+        self._columns = None
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+        if self._blob_file is not None:
+            self._blob_file.close()
+            self._blob_file = None
+
+    # ---------- acceso ----------
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._new)
+
+    def _row(self, i: int) -> Tuple[int, Optional[str]]:
+        """(path_id, texto) de un chunk; el texto solo se decodifica aquí."""
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        if i in self._deleted:
+            return DELETED, None
+        if i >= len(self._rows):
+            return self._new[i - len(self._rows)]
+        offset, length, path_id = self._rows[i]
+        if path_id == DELETED:
+            return DELETED, None
+        return int(path_id), self._blob[offset:offset + length].decode("utf-8")
+
+    def __getitem__(self, i: int) -> Optional[Dict]:
+        """{"path", "text", "page"} del chunk i o None si fue borrado."""
+        i = int(i)
+        path_id, text = self._row(i)
+        if path_id == DELETED:
+            return None
+        page = self._attrs[i]["page"] if i < len(self._attrs) else self._new_attrs[i - len(self._attrs)][0]
+        return {"path": self._paths[path_id], "text": text, "page": int(page)}
+
+    @property
+    def paths(self) -> List[str]:
+        """Tabla de documentos (path_id -> ruta)."""
+        return self._paths
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (path_id, atributos) de todos los chunks como arrays alineados por id,
+        con path_id = -1 en los borrados. Se calculan una vez hasta el
+        siguiente cambio del almacén.
+        """
+        if self._columns is None:
+            path_ids = np.concatenate([np.asarray(self._rows["path_id"]),
+                                       np.asarray([p for p, _ in self._new], dtype=np.int32)])
+            if self._deleted:
+                path_ids[list(self._deleted)] = DELETED
+            attrs = np.concatenate([np.asarray(self._attrs), np.asarray(self._new_attrs, dtype=ATTR_DTYPE)])
+            self._columns = (path_ids, attrs)
+        return self._columns
+
+    def live_ids(self) -> np.ndarray:
+        """Ids de los chunks no borrados."""
+        saved = np.flatnonzero(np.asarray(self._rows["path_id"]) != DELETED)
+        new = np.arange(len(self._rows), len(self), dtype=np.int64)
+        ids = np.concatenate([saved.astype(np.int64), new])
+        if self._deleted:
+            ids = ids[~np.isin(ids, list(self._deleted))]
+        return ids
+
+    # ---------- modificación ----------
+    def append(self, path: str, text: str, page: int = 0, mtime: float = 0.0) -> int:
+        """Añade un chunk (con su página y la fecha de su documento) y devuelve su id."""
+        path_id = self._path_ids.get(path)
+        if path_id is None:
+            path_id = self._path_ids[path] = len(self._paths)
+            self._paths.append(path)
+        self._new.append((path_id, text))
+        self._new_attrs.append((page, int(mtime), file_type_code(path)))
+        self._columns = None
+        return len(self) - 1
+
+    def delete(self, i: int) -> None:
+        self._deleted.add(int(i))
+        self._columns = None
+
+    def garbage_ratio(self) -> float:
+        """Fracción del texto guardado que pertenece a chunks borrados (incluidos los pendientes)."""
+        saved = np.asarray(self._rows)
+        total = int(saved["length"].sum())
+        if not total:
+            return 0.0
+        dead = saved["path_id"] == DELETED
+        pending = [i for i in self._deleted if i < len(saved)]
+        dead[pending] = True
+        return int(saved["length"][dead].sum()) / total
+
+    def save(self) -> None:
+        """
+        Guarda los cambios pendientes y vuelve a abrir el almacén con mmap. Los
+        ids se conservan. Solo se añaden los chunks nuevos y se marcan los
+        borrados; el almacén se reescribe completo (compactado) si es nuevo,
+        si no tenía atributos o si la basura supera compact_ratio.
+        """
+        if self._replace or not self.has_attributes or self.garbage_ratio() > self.compact_ratio:
+            self._rewrite()
+        else:
+            self._append()
+        self.open()
+
+    def _append(self) -> None:
+        """Añade textos y filas nuevos al final de los archivos y marca los borrados en su fila."""
+        n_saved = len(self._rows)
+        tombstones = np.asarray(sorted(i for i in self._deleted if i < n_saved), dtype=np.int64)
+        paths_changed = len(self._paths) > self._n_saved_paths
+        self.close()
+
+        rows = np.empty(len(self._new), dtype=ROW_DTYPE)
+        with open(self.text_path, "ab") as fh:
+            offset = fh.tell()
+            for j, (path_id, text) in enumerate(self._new):
+                if n_saved + j in self._deleted:
+                    # Borrado antes de guardarse: solo ocupa su fila
+                    rows[j] = (offset, 0, DELETED)
+                    continue
+                data = text.encode("utf-8")
+                rows[j] = (offset, len(data), path_id)
+                fh.write(data)
+                offset += len(data)
+        if paths_changed:
+            self._write_paths(self._paths)
+        # Las filas van las últimas: definen cuántos chunks tiene el almacén
+        append_rows(self.attrs_path, np.asarray(self._new_attrs, dtype=ATTR_DTYPE))
+        append_rows(self.rows_path, rows)
+        if len(tombstones):
+            saved = np.load(self.rows_path, mmap_mode="r+")
+            saved["path_id"][tombstones] = DELETED
+            saved.flush()
+            del saved
+        logger.debug(f"{self.prefix}: {len(rows)} chunks añadidos y {len(tombstones)} marcados como borrados")
+
+    def _write_paths(self, paths: List[str]) -> None:
+        with open(self.paths_path + ".tmp", "w", encoding="utf-8") as fh:
+            json.dump(paths, fh, ensure_ascii=False)
+        os.replace(self.paths_path + ".tmp", self.paths_path)
+
+    def _rewrite(self) -> None:
+        """Escribe el almacén completo, sin el texto de los chunks borrados ni las rutas sin uso."""
+        if not self._replace:
+            logger.info(f"{self.prefix}: compactando el almacén de chunks")
+        rows = np.empty(len(self), dtype=ROW_DTYPE)
+        offset = 0
+        tmp_text = self.text_path + ".tmp"
+
+        with open(tmp_text, "wb") as fh:
+            for i in range(len(self)):
+                path_id, text = self._row(i)
+                data = b"" if text is None else text.encode("utf-8")
+                rows[i] = (offset, len(data), path_id)
+                fh.write(data)
+                offset += len(data)
+
+        # Solo se guardan las rutas que siguen en uso
+        used = sorted(set(int(p) for p in rows["path_id"] if p != DELETED))
+        remap = np.full(len(self._paths) + 1, DELETED, dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        rows["path_id"] = np.where(rows["path_id"] == DELETED, DELETED, remap[rows["path_id"]])
+        paths = [self._paths[p] for p in used]
+        attrs = self.columns()[1]
+
+        self.close()
+        os.replace(tmp_text, self.text_path)
+        with open(self.rows_path + ".tmp", "wb") as fh:
+            np.save(fh, rows)
+        os.replace(self.rows_path + ".tmp", self.rows_path)
+        with open(self.attrs_path + ".tmp", "wb") as fh:
+            np.save(fh, attrs)
+        os.replace(self.attrs_path + ".tmp", self.attrs_path)
+        self._write_paths(paths)
+
+    # ---------- migración ----------
+    @classmethod
+    def migrate_text_file(cls, meta_path: str, prefix: str) -> "ChunkStore":
+        """Convierte un vectorized_db_meta.txt (`path|texto` por línea) al formato binario."""
+        store = cls(prefix)
+        with open(meta_path, encoding="utf-8") as fh:
+            for line in fh:
+                path, text = line.rstrip("\n").split("|", 1)
+                i = store.append(path or "", text)
+                if not path:
+                    store.delete(i)
+        store.save()
+        logger.info(f"Metadatos migrados de {meta_path} a {prefix}_*: {len(store)} chunks")
+        return store
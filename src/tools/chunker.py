@@ -0,0 +1,302 @@
+# chunker.py
+"""
+Troceado de documentos para RAGLocal.
+
+Troceadores disponibles:
+- structure: corta por párrafos y frases y llena cada chunk hasta max_tokens
+  (tiktoken), con overlap_tokens de frases completas repetidas entre chunks
+  consecutivos. Los títulos abren chunk nuevo. Antes de trocear limpia los
+  artefactos de PDF: cabeceras y pies repetidos entre páginas, números de
+  página, palabras partidas con guion al final de línea y títulos
+  espaciados letra a letra ("C A P Í T U L O").
+- chars: ventana fija de chunk_size caracteres con overlap (el troceado original).
+
+Cada chunk lleva la página (1, 2, ...) en que empieza, contada por los
+separadores PAGE_BREAK de la extracción (chunk_pages).
+
+Todo el proceso es lineal en el tamaño del texto: cada línea, frase y
+palabra se recorre un número acotado de veces y los tokens se cuentan una
+sola vez por unidad.
+"""
+import re
+import bisect
+import logging
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from src.tools.tokens import count_tokens_batch
+
+logger = logging.getLogger(__name__)
+
+CHUNKERS = ("structure", "chars")
+
+# Separador de páginas que deja la extracción de PDF
+PAGE_BREAK = "\f"
+
+DEFAULT_CHUNKER_CONFIG: Dict = {
+    "chunker": "structure",
+    "max_tokens": 256,       # tamaño objetivo de cada chunk
+    "overlap_tokens": 32,    # frases finales que se repiten en el chunk siguiente
+    "min_tokens": 64,        # un título solo abre chunk nuevo si el actual ya tiene este tamaño
+    "strip_headers": True,   # quitar cabeceras/pies repetidos y números de página
+    "chunk_size": 1000,      # solo "chars": caracteres por chunk
+    "overlap": 25,           # solo "chars": caracteres de solapamiento
+}
+
+# Líneas de cabecera/pie candidatas al principio y al final de cada página
+_EDGE_LINES = 3
+# Fracción mínima de páginas en que debe repetirse una cabecera o pie
+_REPEAT_RATIO = 0.5
+# Una línea sin puntuación final más corta que esta fracción del ancho típico
+# de línea del documento se trata como título, elemento de lista o fin de párrafo
+_SHORT_RATIO = 0.6
+
+_PAGE_NUMBER = re.compile(
+    r"^[-–—\s]*(?:p(?:á|a)g(?:ina)?\.?\s*)?\d{1,4}(?:\s*(?:/|de|of)\s*\d{1,4})?[-–—\s]*$",
+    re.IGNORECASE,
+)
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?…])\s+(?=[¿¡\"«“(\[]?[A-ZÁÉÍÓÚÜÑ0-9])")
+_TERMINAL = (".", "!", "?", "…", ":", ";")
+
+
+def make_chunker_config(**overrides) -> Dict:
+    """Configuración completa a partir de los valores por defecto."""
+    unknown = set(overrides) - set(DEFAULT_CHUNKER_CONFIG)
+    if unknown:
+        raise ValueError(f"Parámetros de troceado desconocidos: {sorted(unknown)}")
+    config = {**DEFAULT_CHUNKER_CONFIG, **{k: v for k, v in overrides.items() if v is not None}}
+    if config["chunker"] not in CHUNKERS:
+        raise ValueError(f"chunker debe ser uno de {CHUNKERS}")
+    if config["max_tokens"] < 16:
+        raise ValueError("max_tokens debe ser al menos 16")
+    if not 0 <= config["overlap_tokens"] < config["max_tokens"]:
+        raise ValueError("overlap_tokens debe estar entre 0 y max_tokens")
+    return config
+
+
+# ---------- limpieza ----------
+def _signature(line: str) -> str:
+    """Forma normalizada de una cabecera/pie: sin mayúsculas ni números (cambian por página)."""
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+
+def _edge_positions(lines: List[str]) -> List[int]:
+    """Índices de las primeras y últimas líneas no vacías de una página."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return sorted(set(filled[:_EDGE_LINES] + filled[-_EDGE_LINES:]))
+
+
+def clean_pages(pages: List[str], strip_headers: bool = True) -> List[str]:
+    """
+    Quita de cada página las cabeceras y pies que se repiten en al menos la
+    mitad de las páginas y los números de página sueltos en los bordes.
+    """
+    if not strip_headers or len(pages) < 3:
+        return pages
+    split = [page.split("\n") for page in pages]
+    edges = [_edge_positions(lines) for lines in split]
+
+    counts: Counter = Counter()
+    for lines, positions in zip(split, edges):
+        counts.update({_signature(lines[i]) for i in positions})
+    threshold = max(3, int(len(pages) * _REPEAT_RATIO + 0.5))
+    repeated = {sig for sig, n in counts.items() if n >= threshold}
+
+    cleaned, removed = [], 0
+    for lines, positions in zip(split, edges):
+        drop = {i for i in positions
+                if _signature(lines[i]) in repeated or _PAGE_NUMBER.match(lines[i])}
+        removed += len(drop)
+        cleaned.append("\n".join(line for i, line in enumerate(lines) if i not in drop))
+    if removed:
+        logger.debug(f"Eliminadas {removed} líneas de cabecera/pie/número de página en {len(pages)} páginas")
+    return cleaned
+
+
+def _fix_letter_spacing(line: str) -> str:
+    """'C A P Í T U L O   1' -> 'CAPÍTULO 1' (títulos espaciados letra a letra en PDF)."""
+    words = line.split()
+    if len(words) < 4 or any(len(w) > 1 for w in words):
+        return line
+    return " ".join(part.replace(" ", "") for part in re.split(r"\s{2,}", line.strip()))
+
+
+def _typical_width(lines: List[str]) -> int:
+    """Percentil 75 de la longitud de las líneas (histograma, tiempo lineal)."""
+    lengths = Counter(len(line) for line in lines if line)
+    total = sum(lengths.values())
+    seen = 0
+    for length in sorted(lengths):
+        seen += lengths[length]
+        if seen >= total * 0.75:
+            return length
+    return 0
+
+
+def _paragraphs(text: str) -> List[Tuple[str, bool, int]]:
+    """paragraphs con la página en que empieza cada párrafo: (párrafo, es_título, página)."""
+    result: List[Tuple[str, bool, int]] = []
+    current: List[str] = []
+    current_page = 1
+
+    def flush() -> None:
+        if current:
+            result.append((" ".join(current), False, current_page))
+            current.clear()
+
+    numbered = [(" ".join(_fix_letter_spacing(raw).split()), page)
+                for page, page_text in enumerate(text.split(PAGE_BREAK), 1)
+                for raw in page_text.split("\n")]
+    short_width = max(20, int(_typical_width([line for line, _ in numbered]) * _SHORT_RATIO))
+    for line, page in numbered:
+        if not line:
+            flush()
+            continue
+        short = len(line) < short_width and not line.endswith(_TERMINAL) and not line.endswith("-")
+        if short and not current:
+            # Línea corta aislada sin puntuación final: título o elemento de lista
+            result.append((line, True, page))
+            continue
+        if not current:
+            current_page = page
+        if current and current[-1].endswith("-") and line[:1].islower():
+            current[-1] = current[-1][:-1] + line
+        else:
+            current.append(line)
+        if line.endswith(_TERMINAL[:4]) or short:
+            # Fin de frase al final de línea: se admite como límite de párrafo
+            flush()
+    flush()
+    return result
+
+
+def paragraphs(text: str) -> List[Tuple[str, bool]]:
+    """
+    Reconstruye los párrafos del texto extraído: une las líneas partidas por
+    el ancho de página (y las palabras cortadas con guion) y separa títulos.
+    Devuelve (párrafo, es_título).
+    """
+    return [(para, is_title) for para, is_title, _ in _paragraphs(text)]
+
+
+# ---------- troceado ----------
+def _units(text: str, max_tokens: int) -> List[Tuple[str, int, str, int]]:
+    """
+    Frases del texto como (texto, tokens, tipo, página), con tipo "title",
+    "para" (primera frase de un párrafo) o "sent". Las frases más largas que
+    max_tokens se parten por palabras.
+    """
+    pieces: List[Tuple[str, str, int]] = []
+    for para, is_title, page in _paragraphs(text):
+        if is_title:
+            pieces.append((para, "title", page))
+            continue
+        for i, sentence in enumerate(_SENTENCE_BREAK.split(para)):
+            if sentence:
+                pieces.append((sentence, "sent" if i else "para", page))
+
+    counts = count_tokens_batch([p for p, _, _ in pieces])
+    units: List[Tuple[str, int, str, int]] = []
+    for (piece, kind, page), n in zip(pieces, counts):
+        if n <= max_tokens:
+            units.append((piece, n, kind, page))
+            continue
+        # Frase demasiado larga: trozos de palabras completas
+        words = piece.split(" ")
+        part, part_tokens = [], 0
+        for word, w in zip(words, count_tokens_batch(words)):
+            if part and part_tokens + w > max_tokens:
+                units.append((" ".join(part), part_tokens, kind, page))
+                part, part_tokens, kind = [], 0, "sent"
+            part.append(word)
+            part_tokens += w
+        if part:
+            units.append((" ".join(part), part_tokens, kind, page))
+    return units
+
+
+def _join(units: List[Tuple[str, int, str, int]]) -> str:
+    parts = []
+    for i, (text, _, kind, _) in enumerate(units):
+        if i:
+            parts.append("\n\n" if kind in ("title", "para") else " ")
+        parts.append(text)
+    return "".join(parts)
+
+
+def split_structured_pages(text: str, max_tokens: int = 256, overlap_tokens: int = 32,
+                           min_tokens: int = 64, strip_headers: bool = True) -> Tuple[List[str], List[int]]:
+    """split_structured y la página en que empieza cada chunk."""
+    pages = text.split(PAGE_BREAK)
+    if len(pages) > 1:
+        text = PAGE_BREAK.join(clean_pages(pages, strip_headers))
+
+    chunks: List[str] = []
+    chunk_pages: List[int] = []
+    current: List[Tuple[str, int, str, int]] = []
+    current_tokens = 0
+    for unit in _units(text, max_tokens):
+        _, n, kind, _ = unit
+        heading = kind == "title" and current_tokens >= min_tokens
+        if current and (heading or current_tokens + n > max_tokens):
+            chunks.append(_join(current))
+            chunk_pages.append(current[0][3])
+            carry: List[Tuple[str, int, str, int]] = []
+            carried = 0
+            if not heading:
+                # Solapamiento: las últimas frases completas que quepan en overlap_tokens
+                for prev in reversed(current):
+                    if carried + prev[1] > overlap_tokens or carried + prev[1] + n > max_tokens:
+                        break
+                    carry.append(prev)
+                    carried += prev[1]
+                carry.reverse()
+            current, current_tokens = carry, carried
+        current.append(unit)
+        current_tokens += n
+    if current:
+        chunks.append(_join(current))
+        chunk_pages.append(current[0][3])
+    return chunks, chunk_pages
+
+
+def split_structured(text: str, max_tokens: int = 256, overlap_tokens: int = 32,
+                     min_tokens: int = 64, strip_headers: bool = True) -> List[str]:
+    """Chunks de hasta max_tokens que respetan párrafos, frases y títulos."""
+    return split_structured_pages(text, max_tokens, overlap_tokens, min_tokens, strip_headers)[0]
+
+
+def _char_windows(text: str, chunk_size: int, overlap: int) -> List[Tuple[int, str]]:
+    """(posición inicial, chunk) de las ventanas no vacías de chunk_size caracteres."""
+    windows = []
+    for i in range(0, len(text), chunk_size - overlap):
+        chunk = text[i : i + chunk_size]
+        if chunk.strip():  # Solo añadir chunks no vacíos
+            windows.append((i, chunk))
+    return windows
+
+
+def split_chars(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """Divide el texto en chunks de chunk_size caracteres con overlap."""
+    return [chunk for _, chunk in _char_windows(text, chunk_size, overlap)]
+
+
+def chunk_pages(text: str, config: Dict) -> Tuple[List[str], List[int]]:
+    """Trocea el texto según la configuración y devuelve (chunks, página en que empieza cada uno)."""
+    if config["chunker"] == "chars":
+        # Sustituir PAGE_BREAK por un salto de línea no cambia las posiciones
+        breaks = [m.start() for m in re.finditer(PAGE_BREAK, text)]
+        windows = _char_windows(text.replace(PAGE_BREAK, "\n"), config["chunk_size"], config["overlap"])
+        return [chunk for _, chunk in windows], [bisect.bisect_right(breaks, i) + 1 for i, _ in windows]
+    return split_structured_pages(
+        text,
+        max_tokens=config["max_tokens"],
+        overlap_tokens=config["overlap_tokens"],
+        min_tokens=config["min_tokens"],
+        strip_headers=config["strip_headers"],
+    )
+
+
+def chunk_text(text: str, config: Dict) -> List[str]:
+    """Trocea el texto según la configuración (ver make_chunker_config)."""
+    return chunk_pages(text, config)[0]
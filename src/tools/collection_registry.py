@@ -0,0 +1,409 @@
+# collection_registry.py
+"""
+Colecciones de documentos (por equipo o por dominio) sobre RAGLocal.
+
+Cada colección es una carpeta de documentos con su propio índice,
+opcionalmente repartido en shards por documento (crc32 de la ruta relativa
+% número de shards) para corpus que no caben en un único índice plano. Una
+consulta calcula los embeddings de las preguntas una sola vez, busca en
+todos los shards a la vez en un pool de hilos (FAISS libera el GIL) y
+fusiona los k mejores de cada uno.
+
+Las colecciones se declaran en <datos>/collections.json, con las rutas
+relativas a la carpeta de datos:
+
+    {
+      "general": {"path": ".", "descripcion": "documentación general"},
+      "legal": {"path": "legal", "shards": 4}
+    }
+
+Sin ese archivo hay una única colección "default" con toda la carpeta de
+datos (el índice de siempre, data/faiss_indexes). Los documentos de una
+colección anidada dentro de otra solo se indexan en la anidada.
+"""
+import os, json, time, zlib, heapq, asyncio, threading, logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from src.tools.rag import RAGLocal
+from src.tools.retrieval import RetrievedChunk
+from src.tools.embedding_cache import EmbeddingCache
+from src.tools.embedders import Embedder, make_embedder
+from src.tools.reranker import make_reranker
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS_FILE = "collections.json"
+DEFAULT_COLLECTION = "default"
+# Nombre que consulta todas las colecciones
+ALL_COLLECTIONS = "all"
+
+
+def shard_of(path: str, root_folder: str, n_shards: int) -> int:
+    """Shard de un documento: estable entre ejecuciones y máquinas (crc32 de la ruta relativa)."""
+    relpath = os.path.relpath(path, root_folder).replace(os.sep, "/")
+    return zlib.crc32(relpath.encode("utf-8")) % n_shards
+
+
+def shard_filter(root_folder: str, index_folder: str, n_shards: int, shard: int,
+                 exclude: Iterable[str] = ()) -> Callable[[str], bool]:
+    """
+    file_filter de RAGLocal para un shard: los documentos de root_folder cuyo
+    shard_of es shard, salvo los de la carpeta del índice y los de exclude.
+    """
+    skip = [os.path.abspath(index_folder), *(os.path.abspath(p) for p in exclude)]
+
+    def owns(path: str) -> bool:
+        if any(os.path.commonpath([path, folder]) == folder for folder in skip):
+            return False
+        return n_shards == 1 or shard_of(path, root_folder, n_shards) == shard
+    return owns
+
+
+def merge_hits(lists: List[List[RetrievedChunk]], k: int, by_score: bool) -> List[RetrievedChunk]:
+    """
+    Fusiona los resultados de varios índices para una pregunta.
+    - by_score: los k de mayor score (exacto en búsqueda vectorial, donde el
+      orden de cada índice es el del coseno).
+    - si no (re-ranker, MMR), se intercalan por posición en su lista: el orden
+      de cada índice no es comparable por score, pero sí su primer puesto.
+    """
+    if by_score:
+        return heapq.nlargest(k, (hit for hits in lists for hit in hits), key=lambda hit: hit.score)
+    ranked = sorted(
+        ((rank, -hit.rank_score, n, hit) for n, hits in enumerate(lists) for rank, hit in enumerate(hits)),
+        key=lambda item: item[:3],
+    )
+    return [hit for *_, hit in ranked[:k]]
+
+
+class Collection:
+    """
+    Una colección: uno o varios índices RAGLocal (shards) que comparten
+    embedder, de modo que las preguntas se vectorizan una sola vez. Se crea
+    con Collection.create o a partir de índices ya creados.
+    """
+    def __init__(self, name: str, shards: List[RAGLocal], description: str = ""):
+        if not shards:
+            raise ValueError("Una colección necesita al menos un índice")
+        self.name = name
+        self.description = description
+        self.shards = shards
+        self.n_shards = len(shards)
+        # Un hilo por shard: las búsquedas de una consulta van en paralelo
+        self._pool = (ThreadPoolExecutor(max_workers=self.n_shards, thread_name_prefix=f"rag-{name}")
+                      if self.n_shards > 1 else None)
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    @classmethod
+    def create(cls, name: str, root_folder: str, index_folder: Optional[str] = None,
+               shards: int = 1, description: str = "", exclude: Optional[List[str]] = None,
+               embedder: Optional[Embedder] = None, **rag_kwargs) -> "Collection":
+        """
+        Reparte los documentos de root_folder en shards índices.
+
+        Args:
+            index_folder: carpeta del índice (por defecto, root_folder/faiss_indexes);
+                con varios shards cada uno usa index_folder/shard_<i>
+            exclude: carpetas bajo root_folder que no se indexan (otras colecciones)
+            embedder: por defecto, según RAG_EMBEDDER
+            **rag_kwargs: resto de parámetros de RAGLocal (reranker, index_type...)
+        """
+        if shards < 1:
+            raise ValueError("shards debe ser al menos 1")
+        root_folder = os.path.abspath(root_folder)
+        index_folder = os.path.abspath(index_folder or os.path.join(root_folder, "faiss_indexes"))
+        if embedder is None:
+            embedder = make_embedder()
+        use_cache = rag_kwargs.pop("use_embedding_cache", True)
+        if use_cache and rag_kwargs.get("embedding_cache") is None:
+            # Una sola caché para todos los shards: la misma pregunta no se vectoriza dos veces
+            os.makedirs(index_folder, exist_ok=True)
+            rag_kwargs["embedding_cache"] = EmbeddingCache(os.path.join(index_folder, "embeddings_cache.sqlite"))
+        return cls(name, [
+            RAGLocal(
+                root_folder=root_folder,
+                index_folder=index_folder if shards == 1 else os.path.join(index_folder, f"shard_{i}"),
+                embedder=embedder, use_embedding_cache=use_cache,
+                file_filter=shard_filter(root_folder, index_folder, shards, i, exclude or []),
+                **rag_kwargs,
+            )
+            for i in range(shards)
+        ], description)
+
+    def _live(self) -> List[RAGLocal]:
+        """Shards con índice (uno sin documentos no tiene)."""
+        return [shard for shard in self.shards if shard._index is not None]
+
+    def _map(self, fn, shards: List[RAGLocal]) -> list:
+        """Aplica fn a cada shard, en paralelo si hay varios."""
+        if self._pool is None or len(shards) == 1:
+            return [fn(shard) for shard in shards]
+        return [f.result() for f in [self._pool.submit(fn, shard) for shard in shards]]
+
+    # ---------- índices ----------
+    def load(self, mmap: bool = True) -> "Collection":
+        """Carga los índices de los shards (o los crea si no existen); solo la primera vez."""
+        with self._load_lock:
+            if self._loaded:
+                return self
+            started = time.perf_counter()
+            try:
+                for shard in self.shards:
+                    if shard._index is not None:
+                        continue
+                    try:
+                        shard.load_index(mmap=mmap)
+                    except FileNotFoundError:
+                        if not shard._list_files():
+                            # Con pocos documentos algún shard puede quedar vacío
+                            logger.info(f"Shard sin documentos: {shard.index_folder}")
+                            continue
+                        logger.info(f"Creando nuevo índice RAG en {shard.index_folder}...")
+                        shard.create_index()
+                if not self._live():
+                    raise RuntimeError(f"No se encontraron documentos válidos en la colección {self.name}")
+            except Exception as e:
+                logger.error(f"Error cargando la colección {self.name}: {str(e)}")
+                raise
+            self._loaded = True
+            logger.info(f"Colección {self.name} cargada ({self.n_shards} shards) en "
+                        f"{(time.perf_counter() - started) * 1000:.1f} ms")
+        return self
+
+    def create_index(self) -> None:
+        """Crea de cero el índice de cada shard con documentos."""
+        for shard in self.shards:
+            if shard._list_files():
+                shard.create_index()
+        self._loaded = bool(self._live())
+
+    def update_index(self) -> Dict[str, int]:
+        """Actualiza cada shard con los documentos nuevos, modificados o eliminados."""
+        totals: Dict[str, int] = {}
+        for shard in self.shards:
+            if shard._index is None and not shard._list_files():
+                continue
+            for key, value in shard.update_index().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    @property
+    def index_version(self) -> Optional[str]:
+        """Versión conjunta de los shards (cambia si cambia cualquiera)."""
+        versions = [shard.index_version for shard in self.shards]
+        if all(v is None for v in versions):
+            return None
+        return "-".join(v or "" for v in versions)
+
+    # ---------- consultas ----------
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        return self.shards[0].embed_texts(texts)
+
+    async def aembed_texts(self, texts: List[str]) -> np.ndarray:
+        return await self.shards[0].aembed_texts(texts)
+
+    def _by_score(self, mode: str, diversity: Optional[float], use_reranker: Optional[bool]) -> bool:
+        reranking = self.shards[0].reranker is not None and use_reranker is not False
+        return mode == "vector" and diversity is None and not reranking
+
+    def _search(self, clean: List[str], q_embeds: Optional[np.ndarray], k: int,
+                **kwargs) -> List[List[RetrievedChunk]]:
+        """Busca en todos los shards con los mismos embeddings y fusiona por pregunta."""
+        live = self._live()
+        if len(live) == 1:
+            return live[0].search_embedded(clean, q_embeds, k, **kwargs)
+        started = time.perf_counter()
+        per_shard = self._map(lambda shard: shard.search_embedded(clean, q_embeds, k, **kwargs), live)
+        by_score = self._by_score(kwargs.get("mode", "vector"), kwargs.get("diversity"),
+                                  kwargs.get("use_reranker"))
+        results = [merge_hits([hits[qi] for hits in per_shard], k, by_score) for qi in range(len(clean))]
+        logger.debug(f"Colección {self.name}: {len(clean)} preguntas en {len(live)} shards, "
+                     f"{(time.perf_counter() - started) * 1000:.1f} ms")
+        return results
+
+    def query_batch(self, questions: List[str], k: int = 3, mode: str = "vector",
+                    **kwargs) -> List[List[RetrievedChunk]]:
+        """
+        Igual que RAGLocal.query_batch (mismos argumentos) sobre todos los shards:
+        un lote de embeddings y una búsqueda por shard en paralelo.
+        """
+        self.load()
+        clean = self._live()[0]._check_query(questions, mode)
+        q_embeds = None
+        if self.shards[0]._needs_embeddings(mode, kwargs.get("min_score")):
+            try:
+                q_embeds = self.shards[0]._embed_texts(clean)
+            except Exception as e:
+                self.shards[0]._embed_failed(mode, e)
+        return self._search(clean, q_embeds, k, mode=mode, **kwargs)
+
+    async def aquery_batch(self, questions: List[str], k: int = 3, mode: str = "vector",
+                           **kwargs) -> List[List[RetrievedChunk]]:
+        """Versión asíncrona de query_batch: embeddings asíncronos y búsqueda en un hilo."""
+        await asyncio.to_thread(self.load)
+        clean = self._live()[0]._check_query(questions, mode)
+        q_embeds = None
+        if self.shards[0]._needs_embeddings(mode, kwargs.get("min_score")):
+            try:
+                q_embeds = await self.shards[0]._aembed_texts(clean)
+            except Exception as e:
+                self.shards[0]._embed_failed(mode, e)
+        return await asyncio.to_thread(self._search, clean, q_embeds, k, mode=mode, **kwargs)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+class CollectionRegistry:
+    """Colecciones por nombre; una consulta va a una de ellas o a todas (ALL_COLLECTIONS)."""
+    def __init__(self, collections: Optional[List[Collection]] = None):
+        self._collections: Dict[str, Collection] = {}
+        for collection in collections or []:
+            self.register(collection)
+
+    @classmethod
+    def from_folder(cls, path: str = "data", **kwargs) -> "CollectionRegistry":
+        """
+        Colecciones declaradas en <path>/collections.json (o una sola colección
+        "default" con toda la carpeta). Los kwargs se pasan a cada Collection.
+        """
+        path = os.path.abspath(path)
+        manifest_path = os.path.join(path, COLLECTIONS_FILE)
+        specs: Dict[str, Dict] = {DEFAULT_COLLECTION: {"path": "."}}
+        if os.path.isfile(manifest_path):
+            try:
+                with open(manifest_path, encoding="utf-8") as fh:
+                    specs = json.load(fh)
+            except Exception as e:
+                logger.error(f"Error leyendo {manifest_path}: {str(e)}")
+                raise
+            if not specs:
+                raise ValueError(f"{manifest_path} no declara ninguna colección")
+            if ALL_COLLECTIONS in specs:
+                raise ValueError(f"'{ALL_COLLECTIONS}' no puede ser el nombre de una colección")
+
+        roots = {name: os.path.abspath(os.path.join(path, spec.get("path", name))) for name, spec in specs.items()}
+        # Embedder y re-ranker compartidos salvo que se indiquen
+        if kwargs.get("embedder") is None:
+            kwargs["embedder"] = make_embedder()
+        if "reranker" not in kwargs:
+            kwargs["reranker"] = make_reranker()
+        registry = cls()
+        for name, spec in specs.items():
+            root = roots[name]
+            # Colecciones anidadas en esta: sus documentos solo van a la suya
+            nested = [other for other in roots.values()
+                      if other != root and os.path.commonpath([other, root]) == root]
+            registry.register(Collection.create(
+                name, root, index_folder=spec.get("index_folder"), shards=int(spec.get("shards", 1)),
+                description=spec.get("descripcion", spec.get("description", "")), exclude=nested, **kwargs,
+            ))
+        logger.info(f"Colecciones registradas: {registry.names()}")
+        return registry
+
+    def register(self, collection: Collection) -> Collection:
+        if collection.name == ALL_COLLECTIONS:
+            raise ValueError(f"'{ALL_COLLECTIONS}' no puede ser el nombre de una colección")
+        self._collections[collection.name] = collection
+        return collection
+
+    def names(self) -> List[str]:
+        return list(self._collections)
+
+    def get(self, name: str) -> Collection:
+        try:
+            return self._collections[name]
+        except KeyError:
+            raise ValueError(f"Colección desconocida: {name}. Disponibles: {', '.join(self.names())}") from None
+
+    def describe(self) -> List[Dict]:
+        """Nombre, descripción y shards de cada colección."""
+        return [{"nombre": c.name, "descripcion": c.description, "shards": c.n_shards}
+                for c in self._collections.values()]
+
+    def _targets(self, collection: Optional[str]) -> List[Collection]:
+        if collection in (None, ALL_COLLECTIONS):
+            return list(self._collections.values())
+        return [self.get(collection)]
+
+    def load(self, mmap: bool = True) -> "CollectionRegistry":
+        """Carga (o crea) los índices de todas las colecciones."""
+        for collection in self._collections.values():
+            collection.load(mmap=mmap)
+        return self
+
+    @property
+    def index_version(self) -> Optional[str]:
+        versions = [c.index_version for c in self._collections.values()]
+        if all(v is None for v in versions):
+            return None
+        return "-".join(v or "" for v in versions)
+
+    def index_versions(self) -> Dict[str, Optional[str]]:
+        """Versión de cada shard ("colección/i"); None si aún no se ha cargado. No carga nada."""
+        return {f"{c.name}/{i}": shard.index_version
+                for c in self._collections.values() for i, shard in enumerate(c.shards)}
+
+    # Los embeddings de la caché semántica son los de la primera colección
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        return next(iter(self._collections.values())).embed_texts(texts)
+
+    async def aembed_texts(self, texts: List[str]) -> np.ndarray:
+        return await next(iter(self._collections.values())).aembed_texts(texts)
+
+    def query_batch(self, questions: List[str], k: int = 3, collection: Optional[str] = None,
+                    mode: str = "vector", **kwargs) -> List[List[RetrievedChunk]]:
+        """
+        Consulta una colección por nombre o todas (None / ALL_COLLECTIONS), con
+        los argumentos de RAGLocal.query_batch. Con varias colecciones se
+        consultan en paralelo y se fusionan los k mejores de cada pregunta.
+        """
+        targets = self._targets(collection)
+        if len(targets) == 1:
+            return targets[0].query_batch(questions, k, mode=mode, **kwargs)
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="rag-colecciones") as pool:
+            per_collection = list(pool.map(lambda c: c.query_batch(questions, k, mode=mode, **kwargs), targets))
+        return self._merge(targets, per_collection, k, mode, kwargs)
+
+    async def aquery_batch(self, questions: List[str], k: int = 3, collection: Optional[str] = None,
+                           mode: str = "vector", **kwargs) -> List[List[RetrievedChunk]]:
+        """Versión asíncrona de query_batch; las colecciones se consultan a la vez."""
+        targets = self._targets(collection)
+        per_collection = await asyncio.gather(*(c.aquery_batch(questions, k, mode=mode, **kwargs) for c in targets))
+        if len(targets) == 1:
+            return per_collection[0]
+        return self._merge(targets, list(per_collection), k, mode, kwargs)
+
+    @staticmethod
+    def _merge(targets: List[Collection], per_collection: List[List[List[RetrievedChunk]]], k: int,
+               mode: str, kwargs: Dict) -> List[List[RetrievedChunk]]:
+        by_score = all(c._by_score(mode, kwargs.get("diversity"), kwargs.get("use_reranker")) for c in targets)
+        return [merge_hits([hits[qi] for hits in per_collection], k, by_score)
+                for qi in range(len(per_collection[0]))]
+
+
+# Un registro por carpeta de datos (ruta absoluta)
+_registries: Dict[str, CollectionRegistry] = {}
+_registries_lock = threading.Lock()
+
+def init_registry(path: str = "data") -> CollectionRegistry:
+    """
+    Registro de colecciones de la carpeta path, creado una sola vez por
+    proceso. Los índices se cargan en la primera consulta a cada colección
+    (o todos con load()).
+    """
+    key = os.path.abspath(path)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = CollectionRegistry.from_folder(path)
+        return registry
+
+def set_registry(registry: CollectionRegistry, path: str = "data") -> None:
+    """Registra un registro ya creado para la carpeta path (p. ej. el de un servidor de pruebas)."""
+    with _registries_lock:
+        _registries[os.path.abspath(path)] = registry
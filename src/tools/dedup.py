@@ -0,0 +1,257 @@
+# dedup.py
+"""
+Detección de chunks casi duplicados y diversidad de resultados.
+
+- MinHash sobre shingles de tokens (vectorizado con numpy) para estimar la
+  similitud de Jaccard entre chunks, con LSH por bandas para encontrar
+  candidatos sin comparar todos contra todos. RAGLocal descarta los casi
+  duplicados antes de vectorizarlos.
+- MMR (Maximal Marginal Relevance) para que los k resultados de una
+  consulta no sean copias del mismo pasaje.
+
+Las firmas se guardan en <prefijo>_minhash_ids.npy y
+<prefijo>_minhash_signatures.npy para deduplicar también en las
+actualizaciones incrementales. Guardar solo añade las firmas nuevas al final
+y marca los chunks borrados con id -1; los archivos se reescriben sin ellos
+en un índice nuevo o cuando superan compact_ratio de las filas.
+"""
+import os, zlib, logging
+import numpy as np
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.tools.npy_append import append_rows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 8
+DEFAULT_SHINGLE = 5
+# Fracción de filas borradas a partir de la cual save() reescribe las firmas
+COMPACT_RATIO = 0.3
+
+# Multiplicador para combinar los hashes de los tokens de un shingle
+_SHINGLE_PRIME = np.uint64(1_099_511_628_211)
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm: int, seed: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Coeficientes (a, b) de las funciones hash a*x + b (multiply-shift de 64 bits)."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(tokens: Sequence[str], size: int = DEFAULT_SHINGLE) -> np.ndarray:
+    """Hashes de 64 bits (únicos) de los n-gramas de tokens del chunk."""
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    token_hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens),
+                               dtype=np.uint64, count=len(tokens))
+    size = min(size, len(token_hashes))
+    n = len(token_hashes) - size + 1
+    out = np.zeros(n, dtype=np.uint64)
+    for j in range(size):
+        out = out * _SHINGLE_PRIME + token_hashes[j:j + n]
+    return np.unique(out)
+
+
+def minhash(tokens: Sequence[str], num_perm: int = DEFAULT_NUM_PERM,
+            shingle_size: int = DEFAULT_SHINGLE) -> Optional[np.ndarray]:
+    """Firma MinHash (num_perm valores uint32) o None si el chunk no tiene tokens."""
+    shingles = shingle_hashes(tokens, shingle_size)
+    if not len(shingles):
+        return None
+    a, b = _permutations(num_perm)
+    hashed = (a[:, None] * shingles[None, :] + b[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def jaccard(signatures: np.ndarray, signature: np.ndarray) -> np.ndarray:
+    """Similitud de Jaccard estimada entre cada fila de signatures y signature."""
+    return (signatures == signature).mean(axis=-1)
+
+
+class NearDuplicateIndex:
+    """
+    Índice LSH de firmas MinHash por id de chunk.
+
+    Args:
+        prefix: prefijo de los archivos del índice (<prefijo>_minhash_ids.npy y
+            <prefijo>_minhash_signatures.npy)
+        threshold: Jaccard estimado a partir del cual un chunk se considera duplicado
+        num_perm: funciones hash de la firma
+        bands: bandas LSH (num_perm / bands filas por banda)
+        compact_ratio: fracción de filas borradas a partir de la cual save() reescribe
+    """
+    def __init__(self, prefix: str, threshold: float = 0.9,
+                 num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 compact_ratio: float = COMPACT_RATIO):
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold debe estar en (0, 1]")
+        if num_perm % bands:
+            raise ValueError("num_perm debe ser múltiplo de bands")
+        self.ids_path = f"{prefix}_minhash_ids.npy"
+        self.signatures_path = f"{prefix}_minhash_signatures.npy"
+        # Formato anterior (un solo .npz); se migra en el primer save()
+        self.legacy_path = f"{prefix}_minhash.npz"
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.compact_ratio = compact_ratio
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: Dict[bytes, List[int]] = {}
+        # Fila en disco de cada chunk guardado, filas en disco y borrados pendientes de marcar
+        self._saved_rows: Dict[int, int] = {}
+        self._n_rows = 0
+        self._dead_rows = 0
+        self._deleted: set = set()
+        # Un índice sin abrir es nuevo: su primer save() escribe los archivos completos
+        self._replace = True
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _keys(self, signature: np.ndarray) -> List[bytes]:
+        return [bytes([band]) + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    # ---------- consulta / modificación ----------
+    def find(self, signature: Optional[np.ndarray]) -> Optional[int]:
+        """Id del chunk indexado más parecido si supera el umbral; None si no hay."""
+        if signature is None:
+            return None
+        candidates = {
+            chunk_id
+            for key in self._keys(signature)
+            for chunk_id in self._buckets.get(key, ())
+            if chunk_id in self._signatures
+        }
+        if not candidates:
+            return None
+        ids = list(candidates)
+        scores = jaccard(np.stack([self._signatures[i] for i in ids]), signature)
+        best = int(np.argmax(scores))
+        return ids[best] if scores[best] >= self.threshold else None
+
+    def add(self, chunk_id: int, signature: Optional[np.ndarray]) -> None:
+        if signature is None:
+            return
+        self._signatures[int(chunk_id)] = signature
+        for key in self._keys(signature):
+            self._buckets.setdefault(key, []).append(int(chunk_id))
+
+    def delete(self, chunk_id: int) -> None:
+        # Los buckets se limpian al compactar; find ignora los ids sin firma
+        self._signatures.pop(int(chunk_id), None)
+        if int(chunk_id) in self._saved_rows:
+            self._deleted.add(int(chunk_id))
+
+    # ---------- persistencia ----------
+    def exists(self) -> bool:
+        return (os.path.isfile(self.ids_path) and os.path.isfile(self.signatures_path)) \
+            or os.path.isfile(self.legacy_path)
+
+    def garbage_ratio(self) -> float:
+        """Fracción de las filas guardadas que son de chunks borrados (marcados o pendientes)."""
+        return (self._dead_rows + len(self._deleted)) / self._n_rows if self._n_rows else 0.0
+
+    def save(self) -> None:
+        """
+        Añade las firmas nuevas y marca las borradas. Reescribe los archivos si
+        el índice es nuevo, viene del formato .npz o supera compact_ratio de basura.
+        """
+        if self._replace or self.garbage_ratio() > self.compact_ratio:
+            self._rewrite()
+        else:
+            self._append()
+        self.open()
+
+    def _append(self) -> None:
+        new_ids = np.fromiter((i for i in self._signatures if i not in self._saved_rows), dtype=np.int64)
+        rows = np.asarray(sorted(self._saved_rows[i] for i in self._deleted), dtype=np.int64)
+        # Firmas antes que ids: un id guardado siempre tiene su firma
+        append_rows(self.signatures_path, self._stack(new_ids))
+        append_rows(self.ids_path, new_ids)
+        if len(rows):
+            ids = np.load(self.ids_path, mmap_mode="r+")
+            ids[rows] = -1
+            ids.flush()
+            del ids
+        logger.debug(f"{self.ids_path}: {len(new_ids)} firmas añadidas, {len(rows)} borradas")
+
+    def _rewrite(self) -> None:
+        ids = np.fromiter(self._signatures, dtype=np.int64, count=len(self._signatures))
+        for path, array in ((self.signatures_path, self._stack(ids)), (self.ids_path, ids)):
+            with open(path + ".tmp", "wb") as fh:
+                np.save(fh, array)
+            os.replace(path + ".tmp", path)
+        if os.path.isfile(self.legacy_path):
+            os.remove(self.legacy_path)
+
+    def _stack(self, ids: np.ndarray) -> np.ndarray:
+        return (np.stack([self._signatures[int(i)] for i in ids]) if len(ids)
+                else np.empty((0, self.num_perm), dtype=np.uint32))
+
+    def open(self) -> "NearDuplicateIndex":
+        if os.path.isfile(self.ids_path) and os.path.isfile(self.signatures_path):
+            ids, signatures = np.load(self.ids_path), np.load(self.signatures_path, mmap_mode="r")
+            # Firmas de más (guardado interrumpido) desalinearían las siguientes: se reescribe
+            self._replace = len(signatures) != len(ids)
+        else:
+            with np.load(self.legacy_path) as data:
+                ids, signatures = data["ids"], data["signatures"]
+            self._replace = True
+        if signatures.ndim != 2 or signatures.shape[1] != self.num_perm:
+            logger.warning(f"Firmas MinHash con {signatures.shape[1:]} permutaciones (se esperaban "
+                           f"{self.num_perm}); se ignoran")
+            ids, signatures = ids[:0], np.empty((0, self.num_perm), dtype=np.uint32)
+            self._replace = True
+        self._load_arrays(ids, np.asarray(signatures[:len(ids)]))
+        return self
+
+    def _load_arrays(self, ids: np.ndarray, signatures: np.ndarray) -> None:
+        self._signatures, self._buckets = {}, {}
+        live = ids >= 0
+        self._saved_rows = {int(chunk_id): row for row, chunk_id in zip(np.flatnonzero(live), ids[live])}
+        self._n_rows, self._dead_rows, self._deleted = len(ids), int((~live).sum()), set()
+        for chunk_id, signature in zip(ids[live], signatures[live]):
+            self.add(int(chunk_id), signature)
+
+
+# ---------- diversidad ----------
+def mmr(relevance: np.ndarray, similarity: np.ndarray, k: int, lambda_: float = 0.7) -> List[int]:
+    """
+    Maximal Marginal Relevance: elige k posiciones maximizando
+    lambda_ * relevancia - (1 - lambda_) * similitud máxima con las ya elegidas.
+    """
+    n = len(relevance)
+    if n == 0:
+        return []
+    selected = [int(np.argmax(relevance))]
+    # Similitud máxima de cada candidato con los ya elegidos
+    max_sim = similarity[selected[0]].astype(np.float64).copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        scores = lambda_ * relevance - (1 - lambda_) * max_sim
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim, similarity[best], out=max_sim)
+    return selected
+
+
+def signature_similarity(signatures: List[Optional[np.ndarray]], num_perm: int = DEFAULT_NUM_PERM) -> np.ndarray:
+    """Matriz de Jaccard estimado entre firmas (0 para los chunks sin firma)."""
+    n = len(signatures)
+    filled = np.array([s is not None for s in signatures])
+    stacked = np.stack([s if s is not None else np.zeros(num_perm, dtype=np.uint32) for s in signatures])
+    sim = (stacked[:, None, :] == stacked[None, :, :]).mean(axis=-1)
+    sim[~filled, :] = 0.0
+    sim[:, ~filled] = 0.0
+    sim[np.arange(n), np.arange(n)] = 1.0
+    return sim
@@ -0,0 +1,283 @@
+# embedders.py
+"""
+Backends de embeddings para RAGLocal.
+
+Todos exponen la misma interfaz (Embedder): name identifica el modelo
+(clave de la caché de embeddings y firma guardada con el índice),
+dimension es la longitud de los vectores y embed / aembed devuelven
+vectores float32 normalizados en el orden de entrada.
+
+- openai:  la API de OpenAI (text-embedding-3-large por defecto), con el
+           motor asíncrono de lotes concurrentes.
+- local:   un modelo de sentence embeddings exportado a ONNX (p. ej.
+           all-MiniLM-L6-v2 o multilingual-e5-small) en CPU, sin red.
+           Necesita onnxruntime y tokenizers.
+- hashing: hashing de palabras y bigramas con numpy, sin modelo ni red;
+           para pruebas offline del pipeline completo.
+
+make_embedder("local:modelos/minilm") crea el backend a partir de un texto
+(por defecto, la variable de entorno RAG_EMBEDDER).
+"""
+import os, zlib, asyncio, hashlib, logging
+import numpy as np
+import openai
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from src.tools.async_embedder import AsyncEmbeddingEngine
+from src.tools.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+EMBEDDER_BACKENDS = ("openai", "local", "hashing")
+
+# Dimensión nativa de los modelos de OpenAI conocidos
+_OPENAI_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+@lru_cache(maxsize=16)
+def _files_digest(files: Tuple[Tuple[str, int, int], ...]) -> str:
+    """SHA-256 del contenido de (ruta, tamaño, mtime_ns); se recalcula si cambia algún archivo."""
+    digest = hashlib.sha256()
+    for path, _, _ in files:
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def model_fingerprint(model_path: str, extra: Sequence[str] = ()) -> str:
+    """
+    Huella de un modelo ONNX: su archivo, los datos externos junto a él
+    (model.onnx_data, ...) y los archivos de extra que existan (tokenizer,
+    configuración). Cambia si se sustituye el modelo aunque la carpeta se llame igual.
+    """
+    folder, base = os.path.split(model_path)
+    paths = [model_path] + sorted(
+        os.path.join(folder, f) for f in os.listdir(folder) if f.startswith(base) and f != base
+    ) + [p for p in extra if os.path.isfile(p)]
+    files = tuple((p, os.path.getsize(p), os.stat(p).st_mtime_ns) for p in paths)
+    return _files_digest(files)
+
+
+class Embedder:
+    """Interfaz común de los backends de embeddings."""
+    name: str = ""
+    dimension: Optional[int] = None
+    # Lotes que conviene tener en vuelo a la vez durante la indexación
+    max_in_flight: int = 1
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        """Por defecto, embed en un hilo para no bloquear el bucle de eventos."""
+        return await asyncio.to_thread(self.embed, texts)
+
+    def identity(self) -> dict:
+        """Firma que se guarda con el índice para rechazar otro embedder al cargarlo."""
+        return {"embedder": self.name, "embedding_dimension": self.dimension}
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    Embeddings de la API de OpenAI.
+    - client: openai.OpenAI para las llamadas síncronas por lotes de batch_size.
+    - async_client: openai.AsyncOpenAI para max_in_flight lotes concurrentes. Si no
+      se inyecta ningún cliente se crea uno asíncrono por defecto.
+    - dimension: solo para modelos que no están en la tabla de dimensiones conocidas.
+    """
+    def __init__(self, model: str = "text-embedding-3-large",
+                 client: openai.OpenAI | None = None,
+                 async_client: openai.AsyncOpenAI | None = None,
+                 batch_size: int = 100, max_in_flight: int = 4,
+                 dimension: Optional[int] = None):
+        self.name = model
+        self.model = model
+        self.dimension = dimension or _OPENAI_DIMENSIONS.get(model)
+        self.batch_size = batch_size  # OpenAI permite hasta 2048 por request
+        self.engine: Optional[AsyncEmbeddingEngine] = None
+        if async_client is not None or client is None:
+            self.engine = AsyncEmbeddingEngine(
+                async_client or openai.AsyncOpenAI(),
+                model=model,
+                max_in_flight=max_in_flight,
+                max_batch_items=batch_size,
+            )
+            self.max_in_flight = max_in_flight
+        self.client = client or openai.OpenAI()
+
+    def _check(self, embeds: np.ndarray) -> np.ndarray:
+        """La dimensión real de la respuesta manda sobre la de la tabla."""
+        if self.dimension != embeds.shape[1]:
+            if self.dimension is not None:
+                logger.warning(f"{self.model} devuelve {embeds.shape[1]} dimensiones (se esperaban {self.dimension})")
+            self.dimension = embeds.shape[1]
+        return embeds
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if self.engine is not None:
+            # Lotes concurrentes agrupados por tokens
+            return self._check(self.engine.embed(texts))
+        parts = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = self.client.embeddings.create(model=self.model, input=texts[i:i + self.batch_size])
+            parts.append(np.asarray([r.embedding for r in batch.data], dtype=np.float32))
+            logger.debug(f"Batch {i // self.batch_size + 1} procesado: {len(parts[-1])} embeddings")
+        return self._check(np.vstack(parts))
+
+    async def aembed(self, texts: Sequence[str]) -> np.ndarray:
+        if self.engine is None:
+            return await super().aembed(texts)
+        return self._check(await self.engine.aembed_threadsafe(texts))
+
+
+class LocalEmbedder(Embedder):
+    """
+    Modelo de sentence embeddings en ONNX ejecutado en CPU.
+
+    Args:
+        model_dir: carpeta con model.onnx (o onnx/model.onnx) y tokenizer.json,
+            como las exportaciones de sentence-transformers / optimum
+        batch_size: textos por inferencia (se agrupan por longitud para rellenar poco)
+        max_length: tokens máximos por texto
+        pooling: "mean" (media de los tokens) o "cls" (primer token)
+        threads: hilos de onnxruntime (None = los que elija onnxruntime)
+    """
+    def __init__(self, model_dir: str, batch_size: int = 32, max_length: int = 256,
+                 pooling: str = "mean", threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                "El embedder local necesita onnxruntime y tokenizers: pip install onnxruntime tokenizers"
+            ) from e
+        if pooling not in ("mean", "cls"):
+            raise ValueError("pooling debe ser 'mean' o 'cls'")
+
+        model_dir = os.path.abspath(model_dir)
+        model_path = next(
+            (p for p in (os.path.join(model_dir, "model.onnx"), os.path.join(model_dir, "onnx", "model.onnx"))
+             if os.path.isfile(p)),
+            None,
+        )
+        if model_path is None:
+            raise FileNotFoundError(f"No se encontró model.onnx en {model_dir}")
+
+        # El nombre lleva la huella del modelo, el tokenizer y el pooling: otro modelo en una
+        # carpeta con el mismo nombre (o sustituido en el sitio) no pasa por el mismo
+        fingerprint = model_fingerprint(model_path, [
+            os.path.join(model_dir, name)
+            for name in ("tokenizer.json", "tokenizer_config.json", "config.json")
+        ])
+        fingerprint = hashlib.sha256(f"{fingerprint}:{pooling}".encode("utf-8")).hexdigest()
+        self.name = f"local:{os.path.basename(model_dir)}@{fingerprint[:16]}"
+        self.batch_size = batch_size
+        self.pooling = pooling
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=max_length)
+        self._tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self._session.get_inputs()}
+        width = self._session.get_outputs()[0].shape[-1]
+        self.dimension = width if isinstance(width, int) else None
+        logger.info(f"Embedder local cargado: {self.name} ({self.dimension or '?'} dimensiones)")
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self._session.run(None, feeds)[0]
+        if hidden.ndim == 2:
+            # El modelo ya devuelve un vector por texto
+            return hidden
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        weights = mask[..., None].astype(np.float32)
+        return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1.0)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        # Textos de longitud parecida en el mismo lote: menos relleno por inferencia
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: Optional[np.ndarray] = None
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            embeds = _normalize(self._run([texts[i] for i in batch]))
+            if out is None:
+                out = np.empty((len(texts), embeds.shape[1]), dtype=np.float32)
+                self.dimension = embeds.shape[1]
+            out[batch] = embeds
+        return out
+
+
+class HashingEmbedder(Embedder):
+    """
+    Embeddings por hashing de palabras y bigramas (sin modelo ni red). Solo
+    captura coincidencias léxicas; sirve para probar el pipeline offline.
+    """
+    def __init__(self, dimension: int = 384):
+        if dimension < 8:
+            raise ValueError("dimension debe ser al menos 8")
+        self.name = f"hashing-{dimension}"
+        self.dimension = dimension
+
+    def _vector(self, text: str) -> np.ndarray:
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if features:
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features),
+                                 dtype=np.uint64, count=len(features))
+            # El bit alto decide el signo para que las colisiones se compensen
+            signs = np.where(hashes & np.uint64(1 << 31), -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, (hashes % np.uint64(self.dimension)).astype(np.int64), signs)
+        return vector
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return _normalize(np.stack([self._vector(t) for t in texts]))
+
+
+def make_embedder(spec: Optional[str] = None, **kwargs) -> Embedder:
+    """
+    Crea un embedder a partir de "backend[:argumento]" (por defecto, la
+    variable RAG_EMBEDDER o "openai"):
+    - "openai" / "openai:text-embedding-3-small"
+    - "local:<carpeta del modelo ONNX>"
+    - "hashing" / "hashing:512"
+    Los kwargs se pasan al constructor del backend.
+    """
+    spec = spec or os.getenv("RAG_EMBEDDER", "openai")
+    backend, _, arg = spec.partition(":")
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"embedder debe ser uno de {EMBEDDER_BACKENDS}")
+    if backend == "openai":
+        return OpenAIEmbedder(model=arg or os.getenv("RAG_EMBEDDING_MODEL", "text-embedding-3-large"), **kwargs)
+    if backend == "local":
+        if not arg:
+            raise ValueError("El embedder local necesita la carpeta del modelo: local:<carpeta>")
+        return LocalEmbedder(arg, **kwargs)
+    return HashingEmbedder(int(arg) if arg else 384, **kwargs)
@@ -0,0 +1,134 @@
+# embedding_cache.py
+"""
+Caché persistente de embeddings direccionada por contenido.
+
+Cada vector se guarda en SQLite con la clave (modelo, sha256 del texto
+normalizado), así los chunks repetidos entre documentos, las re-indexaciones
+y las preguntas repetidas no vuelven a pasar por la API.
+"""
+import os, sqlite3, hashlib, threading, time, unicodedata, logging
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza unicode (NFC) y colapsa espacios en blanco."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(model: str, text: str) -> str:
+    """Clave de caché para un texto y un modelo de embeddings."""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings en disco con expulsión LRU acotada por número de entradas.
+    - path: archivo SQLite donde se guardan los vectores (float32).
+    - max_entries: número máximo de vectores antes de expulsar los menos usados.
+    """
+    def __init__(self, path: str, max_entries: int = 200_000):
+        if max_entries < 1:
+            raise ValueError("max_entries debe ser al menos 1")
+
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)"
+            )
+            self._conn.commit()
+            logger.debug(f"Caché de embeddings abierta: {self.path}")
+        except Exception as e:
+            logger.error(f"Error abriendo caché de embeddings {self.path}: {str(e)}")
+            raise
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Devuelve el vector cacheado de cada texto o None si no está."""
+        keys = [text_key(model, t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        now = time.time()
+
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # SQLite limita el número de parámetros por consulta
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+
+            result = [found.get(k) for k in keys]
+            n_hits = sum(v is not None for v in result)
+            self.hits += n_hits
+            self.misses += len(result) - n_hits
+        return result
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """Guarda los vectores de los textos y expulsa entradas si se supera el límite."""
+        now = time.time()
+        rows = [
+            (text_key(model, t), np.asarray(v, dtype=np.float32).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Expulsa las entradas menos usadas recientemente por encima de max_entries."""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (excess,),
+            )
+            logger.debug(f"Caché de embeddings: {excess} entradas expulsadas (LRU)")
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores de aciertos/fallos y tamaño actual."""
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,108 @@
+# full_vectors.py
+"""
+Vectores completos (float32, todas las dimensiones) en disco para el
+re-rank exacto de los índices comprimidos (fp16 / int8 / Matryoshka).
+
+Se guardan en <prefijo>_full.f32 como una matriz fila = id de chunk y se
+abren con mmap, así que no ocupan RAM: una consulta solo lee las filas de
+sus candidatos. Los chunks borrados dejan su fila sin usar.
+"""
+import os, json, shutil, logging
+import numpy as np
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FullVectorStore:
+    """Matriz de vectores por id de chunk; las filas nuevas se escriben en un archivo pendiente hasta save()."""
+    def __init__(self, prefix: str):
+        self.path = f"{prefix}_full.f32"
+        self.meta_path = f"{prefix}_full.json"
+        self.pending_path = self.path + ".pending"
+        self.dimension: Optional[int] = None
+        self._saved: Optional[np.memmap] = None
+        self._n_saved = 0
+        self._pending = None
+        self._n_pending = 0
+        # Tras reset() el próximo save() sustituye el archivo en lugar de ampliarlo
+        self._replace = False
+
+    def __len__(self) -> int:
+        return self._n_saved + self._n_pending
+
+    # ---------- carga ----------
+    def exists(self) -> bool:
+        return os.path.isfile(self.path) and os.path.isfile(self.meta_path)
+
+    def open(self) -> "FullVectorStore":
+        with open(self.meta_path, encoding="utf-8") as fh:
+            self.dimension = json.load(fh)["dimension"]
+        self._n_saved = os.path.getsize(self.path) // (4 * self.dimension)
+        self._saved = (np.memmap(self.path, dtype=np.float32, mode="r", shape=(self._n_saved, self.dimension))
+                       if self._n_saved else None)
+        return self
+
+    def reset(self) -> "FullVectorStore":
+        """Empieza una matriz nueva (create_index); la anterior sigue en disco hasta save()."""
+        self.discard()
+        self._saved, self._n_saved, self._replace = None, 0, True
+        return self
+
+    # ---------- escritura ----------
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Añade las filas de ids consecutivos (a partir del siguiente id libre)."""
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Dimensión {vectors.shape[1]} distinta de la guardada ({self.dimension})")
+        if self._pending is None:
+            self._pending = open(self.pending_path, "wb")
+        gap = int(ids[0]) - len(self)
+        if gap < 0 or np.any(np.diff(ids) != 1):
+            raise ValueError("Los ids de los vectores completos deben ser consecutivos")
+        if gap:
+            # Ids sin vector (p. ej. chunks descartados): filas a cero
+            self._pending.write(np.zeros((gap, self.dimension), dtype=np.float32).tobytes())
+        self._pending.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._n_pending += gap + len(ids)
+
+    def save(self) -> None:
+        """Vuelca las filas pendientes al archivo principal y lo reabre con mmap."""
+        if self._pending is None and not self._replace:
+            return
+        if self._pending is not None:
+            self._pending.close()
+            self._pending = None
+        self._saved = None
+        if self._replace or not os.path.isfile(self.path):
+            if os.path.isfile(self.pending_path):
+                os.replace(self.pending_path, self.path)
+            else:
+                open(self.path, "wb").close()
+        else:
+            with open(self.path, "ab") as dst, open(self.pending_path, "rb") as src:
+                shutil.copyfileobj(src, dst, 1 << 24)
+            os.remove(self.pending_path)
+        with open(self.meta_path, "w", encoding="utf-8") as fh:
+            json.dump({"dimension": self.dimension}, fh)
+        self._n_pending, self._replace = 0, False
+        self.open()
+
+    def discard(self) -> None:
+        """Descarta las filas pendientes (indexación fallida)."""
+        if self._pending is not None:
+            self._pending.close()
+            self._pending = None
+            os.remove(self.pending_path)
+        self._n_pending = 0
+
+    # ---------- lectura ----------
+    def get(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(vectores, máscara de ids con vector guardado); las filas sin vector son cero."""
+        ids = np.asarray(ids, dtype=np.int64)
+        valid = (ids >= 0) & (ids < self._n_saved)
+        out = np.zeros((len(ids), self.dimension or 0), dtype=np.float32)
+        if self._saved is not None and valid.any():
+            out[valid] = self._saved[ids[valid]]
+        return out, valid
@@ -0,0 +1,158 @@
+# index_benchmark.py
+"""
+Informe de recall@k frente a latencia y memoria de los tipos de índice FAISS.
+
+Toma los vectores de un índice RAGLocal ya creado (los completos del disco
+si existen), calcula la verdad de referencia con búsqueda exacta (flat) y
+mide cada configuración candidata, incluidos el almacenamiento comprimido
+(fp16 / int8), el recorte de dimensiones y el re-rank exacto.
+
+Uso:
+    python -m src.tools.index_benchmark --data data --k 10 --queries 200
+"""
+import argparse, time, logging
+import faiss
+import numpy as np
+from typing import Dict, List, Optional
+
+from src.tools.index_factory import (
+    make_index_config, build_index, needs_training, search_parameters, project, bytes_per_vector,
+)
+
+logger = logging.getLogger(__name__)
+
+# Configuraciones que se comparan si no se indican otras
+DEFAULT_CANDIDATES: List[Dict] = [
+    {"index_type": "flat"},
+    {"index_type": "ivf_flat", "nprobe": 8},
+    {"index_type": "ivf_flat", "nprobe": 32},
+    {"index_type": "ivf_pq", "nprobe": 16},
+    {"index_type": "ivf_pq", "nprobe": 64},
+    {"index_type": "hnsw", "ef_search": 32},
+    {"index_type": "hnsw", "ef_search": 128},
+    {"index_type": "flat", "storage": "fp16"},
+    {"index_type": "flat", "storage": "int8"},
+    {"index_type": "flat", "dimensions": 1024},
+    {"index_type": "flat", "dimensions": 256},
+    {"index_type": "flat", "storage": "int8", "dimensions": 256, "rerank": 4},
+    {"index_type": "hnsw", "storage": "int8", "ef_search": 64, "rerank": 4},
+]
+
+
+def _label(config: Dict) -> str:
+    if config["index_type"] in ("ivf_flat", "ivf_pq"):
+        label = f"{config['index_type']} (nlist={config['nlist']}, nprobe={config['nprobe']})"
+    elif config["index_type"] == "hnsw":
+        label = f"hnsw (M={config['hnsw_m']}, ef_search={config['ef_search']})"
+    else:
+        label = config["index_type"]
+    extras = [config["storage"]] if config["storage"] != "float32" else []
+    if config["dimensions"]:
+        extras.append(f"dim={config['dimensions']}")
+    if config["rerank"]:
+        extras.append(f"rerank={config['rerank']}")
+    return f"{label} [{', '.join(extras)}]" if extras else label
+
+
+def recall_latency_report(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+                          candidates: Optional[List[Dict]] = None) -> List[Dict]:
+    """
+    Mide recall@k, latencia por consulta y memoria de cada configuración
+    frente a la búsqueda exacta sobre los vectores completos. Las
+    configuraciones con rerank reordenan sus candidatos con esos vectores,
+    que en RAGLocal se leen del disco y no cuentan en la memoria del índice.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    ids = np.arange(len(vectors), dtype=np.int64)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for overrides in candidates or DEFAULT_CANDIDATES:
+        config = make_index_config(**overrides)
+        started = time.perf_counter()
+        indexed = project(vectors, config["dimensions"])
+        train = indexed[:config["train_size"]] if needs_training(config) else None
+        index, config = build_index(indexed.shape[1], config, train)
+        index.add_with_ids(indexed, ids)
+        build_s = time.perf_counter() - started
+
+        params = search_parameters(config, nprobe=config["nprobe"], ef_search=config["ef_search"])
+        projected = project(queries, config["dimensions"])
+        n_search = k * max(config["rerank"], 1)
+        latencies, found = [], np.empty_like(truth)
+        for i, q in enumerate(queries):
+            t0 = time.perf_counter()
+            _, idx = index.search(projected[i:i + 1], n_search, params=params)
+            idx = idx[0]
+            if config["rerank"]:
+                valid = idx[idx >= 0]
+                idx = valid[np.argsort(-(vectors[valid] @ q), kind="stable")]
+            latencies.append((time.perf_counter() - t0) * 1000)
+            found[i, :] = -1
+            found[i, :min(k, len(idx))] = idx[:k]
+
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        report.append({
+            "config": _label(config),
+            f"recall@{k}": round(float(recall), 4),
+            "latencia_ms_media": round(float(np.mean(latencies)), 3),
+            "latencia_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+            "bytes_vector": round(bytes_per_vector(config, indexed.shape[1]), 1),
+            "tamaño_mb": round(len(faiss.serialize_index(index)) / 2**20, 2),
+            "construcción_s": round(build_s, 2),
+        })
+        logger.info(f"{report[-1]}")
+    return report
+
+
+def print_report(report: List[Dict]) -> None:
+    """Imprime el informe como tabla."""
+    if not report:
+        return
+    headers = list(report[0])
+    widths = [max(len(h), *(len(str(r[h])) for r in report)) for h in headers]
+    print(" | ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("-+-".join("-" * w for w in widths))
+    for row in report:
+        print(" | ".join(str(row[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+def main() -> None:
+    from src.tools.rag import RAGLocal
+    from src.tools.full_vectors import FullVectorStore
+    from src.tools.embedders import make_embedder
+
+    parser = argparse.ArgumentParser(description="Recall@k vs latencia y memoria de índices FAISS")
+    parser.add_argument("--data", default="data", help="carpeta de documentos")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="consultas de muestra")
+    parser.add_argument("--preguntas", help="archivo con una pregunta por línea (opcional)")
+    args = parser.parse_args()
+
+    rag = RAGLocal(root_folder=args.data, index_folder=args.data + "/faiss_indexes", embedder=make_embedder())
+    rag.load_index()
+    live = rag._docs.live_ids()
+    full = FullVectorStore(rag.store_prefix)
+    if full.exists():
+        vectors = full.open().get(live)[0]
+    else:
+        # Sin vectores completos se usan los del índice (aproximados si está comprimido)
+        vectors = rag._index.reconstruct_batch(live)
+
+    if args.preguntas:
+        with open(args.preguntas, encoding="utf-8") as fh:
+            queries = rag._embed_texts([line.strip() for line in fh if line.strip()])
+    else:
+        # Sin preguntas reales se usan chunks del corpus como consultas
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+
+    print_report(recall_latency_report(vectors, queries, k=args.k))
+
+
+if __name__ == "__main__":
+    main()
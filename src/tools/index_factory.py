@@ -0,0 +1,171 @@
+# index_factory.py
+"""
+Construcción de índices FAISS configurables para RAGLocal.
+
+Tipos disponibles:
+- flat:     búsqueda exacta (IndexFlatL2), la referencia.
+- ivf_flat: listas invertidas con vectores completos; se ajusta con nprobe.
+- ivf_pq:   listas invertidas con product quantization (mucha menos memoria).
+- hnsw:     grafo HNSW; se ajusta con ef_search. No admite borrados.
+
+Almacenamiento de los vectores (flat, ivf_flat y hnsw):
+- float32: vectores completos (4 bytes por dimensión).
+- fp16:    cuantización escalar a float16 (la mitad de memoria, sin entrenamiento).
+- int8:    cuantización escalar de 8 bits (un cuarto; se entrena con una muestra).
+
+dimensions recorta los embeddings (Matryoshka) a sus primeras dimensiones
+antes de indexarlos, y rerank > 0 pide rerank * k candidatos al índice y
+los reordena con los vectores completos guardados en disco.
+
+Todos los índices usan como id el id del chunk, de modo que las
+actualizaciones incrementales funcionan igual con cualquier tipo.
+"""
+import logging
+import faiss
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGE_TYPES = ("float32", "fp16", "int8")
+
+# Codificación FAISS de cada tipo de almacenamiento
+_STORAGE_CODES = {"float32": "Flat", "fp16": "SQfp16", "int8": "SQ8"}
+
+DEFAULT_INDEX_CONFIG: Dict = {
+    "index_type": "flat",
+    "nlist": 1024,        # listas IVF (se reduce si hay pocos vectores de entrenamiento)
+    "pq_m": 64,           # subcuantizadores PQ (debe dividir la dimensión)
+    "hnsw_m": 32,         # vecinos por nodo en HNSW
+    "nprobe": 16,         # listas IVF exploradas por consulta
+    "ef_search": 64,      # tamaño de la cola de búsqueda HNSW
+    "train_size": 50_000, # vectores usados para entrenar los índices IVF (y SQ8)
+    "storage": "float32", # float32, fp16 o int8
+    "dimensions": None,   # dimensiones indexadas (None = las del modelo)
+    "rerank": 0,          # 0 = sin re-rank exacto; n = pide n * k candidatos al índice
+}
+
+# Puntos de entrenamiento por centroide que recomienda FAISS
+_POINTS_PER_CENTROID = 39
+_PQ_CENTROIDS = 256
+
+
+def make_index_config(**overrides) -> Dict:
+    """Configuración completa a partir de los valores por defecto."""
+    unknown = set(overrides) - set(DEFAULT_INDEX_CONFIG)
+    if unknown:
+        raise ValueError(f"Parámetros de índice desconocidos: {sorted(unknown)}")
+    config = {**DEFAULT_INDEX_CONFIG, **{k: v for k, v in overrides.items() if v is not None}}
+    if config["index_type"] not in INDEX_TYPES:
+        raise ValueError(f"index_type debe ser uno de {INDEX_TYPES}")
+    if config["storage"] not in STORAGE_TYPES:
+        raise ValueError(f"storage debe ser uno de {STORAGE_TYPES}")
+    if config["dimensions"] is not None and config["dimensions"] < 1:
+        raise ValueError("dimensions debe ser positivo")
+    if config["rerank"] < 0:
+        raise ValueError("rerank no puede ser negativo")
+    return config
+
+
+def _is_ivf(config: Dict) -> bool:
+    return config["index_type"] in ("ivf_flat", "ivf_pq")
+
+
+def needs_training(config: Dict) -> bool:
+    """Los IVF entrenan centroides y SQ8 el rango de cada dimensión."""
+    return _is_ivf(config) or (config["storage"] == "int8" and config["index_type"] != "ivf_pq")
+
+
+def project(vectors: np.ndarray, dimensions: Optional[int]) -> np.ndarray:
+    """Recorta embeddings Matryoshka a sus primeras dimensiones y los vuelve a normalizar."""
+    if dimensions is None or dimensions >= vectors.shape[1]:
+        return vectors
+    cut = np.ascontiguousarray(vectors[:, :dimensions], dtype=np.float32)
+    norms = np.linalg.norm(cut, axis=1, keepdims=True)
+    return cut / np.maximum(norms, 1e-12)
+
+
+def bytes_per_vector(config: Dict, dimension: int) -> float:
+    """Memoria aproximada de cada vector en el índice (sin la estructura IVF/HNSW)."""
+    if config["index_type"] == "ivf_pq":
+        return float(config["pq_m"])
+    return dimension * {"float32": 4, "fp16": 2, "int8": 1}[config["storage"]]
+
+
+def supports_remove(config: Dict) -> bool:
+    """HNSW no permite borrar vectores; el resto sí."""
+    return config["index_type"] != "hnsw"
+
+
+def build_index(dimension: int, config: Dict,
+                train_vectors: Optional[np.ndarray] = None) -> Tuple[faiss.Index, Dict]:
+    """
+    Crea (y entrena si hace falta) el índice descrito por config.
+    Devuelve el índice y la configuración efectiva (p. ej. nlist ajustado).
+    """
+    config = dict(config)
+    index_type = config["index_type"]
+    if index_type == "ivf_pq" and config["storage"] != "float32":
+        logger.warning("ivf_pq ya comprime los vectores con PQ; se ignora storage")
+        config["storage"] = "float32"
+    code = _STORAGE_CODES[config["storage"]]
+
+    if _is_ivf(config):
+        n_train = 0 if train_vectors is None else len(train_vectors)
+        if index_type == "ivf_pq" and (dimension % config["pq_m"] or n_train < _PQ_CENTROIDS):
+            logger.warning(
+                f"IVF-PQ no aplicable (dimensión {dimension}, pq_m {config['pq_m']}, "
+                f"{n_train} vectores de entrenamiento); se usa ivf_flat"
+            )
+            index_type = config["index_type"] = "ivf_flat"
+        nlist = min(config["nlist"], n_train // _POINTS_PER_CENTROID)
+        if nlist < 1:
+            logger.warning(f"Muy pocos vectores para entrenar IVF ({n_train}); se usa flat")
+            index_type = config["index_type"] = "flat"
+        else:
+            config["nlist"] = nlist
+
+    if index_type == "flat":
+        index = faiss.index_factory(dimension, f"IDMap2,{code}")
+    elif index_type == "hnsw":
+        suffix = "" if code == "Flat" else f"_{code}"
+        index = faiss.index_factory(dimension, f"IDMap2,HNSW{config['hnsw_m']}{suffix}")
+    elif index_type == "ivf_flat":
+        # Los IVF guardan ids propios y permiten borrar sin IDMap
+        index = faiss.index_factory(dimension, f"IVF{config['nlist']},{code}")
+    else:
+        index = faiss.index_factory(dimension, f"IVF{config['nlist']},PQ{config['pq_m']}")
+
+    if not index.is_trained:
+        logger.info(f"Entrenando índice {index_type} con {len(train_vectors)} vectores...")
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+
+    apply_search_params(index, config)
+    return index, config
+
+
+def apply_search_params(index: faiss.Index, config: Dict) -> None:
+    """Fija nprobe / efSearch por defecto del índice."""
+    if config["index_type"] in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = config["nprobe"]
+    elif config["index_type"] == "hnsw":
+        faiss.downcast_index(faiss.downcast_index(index).index).hnsw.efSearch = config["ef_search"]
+
+
+def search_parameters(config: Dict, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None,
+                      selector: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Parámetros de búsqueda para una consulta concreta (None = los del índice).
+    selector restringe la búsqueda a unos ids (p. ej. IDSelectorBitmap).
+    """
+    extra = {"sel": selector} if selector is not None else {}
+    if config["index_type"] in ("ivf_flat", "ivf_pq") and (nprobe is not None or selector is not None):
+        # Los parámetros de la consulta sustituyen a los del índice: nprobe no puede quedarse en 1
+        return faiss.SearchParametersIVF(nprobe=nprobe or config["nprobe"], **extra)
+    if config["index_type"] == "hnsw" and (ef_search is not None or selector is not None):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or config["ef_search"], **extra)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
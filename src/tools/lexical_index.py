@@ -0,0 +1,308 @@
+# lexical_index.py
+"""
+Índice invertido léxico con puntuación BM25.
+
+Complementa la búsqueda densa de FAISS con coincidencias exactas de
+términos (nombres de fórmulas, siglas, autores). Las listas de postings
+se guardan en formato CSR con arrays numpy junto al índice FAISS:
+- <prefijo>_bm25_vocab.json: término -> id de término.
+- <prefijo>_bm25_ptr.npy:    inicio de los postings de cada término.
+- <prefijo>_bm25_docs.npy:   id de chunk de cada posting.
+- <prefijo>_bm25_tf.npy:     frecuencia del término en el chunk.
+- <prefijo>_bm25_len.npy:    longitud (en términos) de cada chunk; 0 = sin términos
+                             o borrado, negativa = borrado pendiente de compactar.
+- <prefijo>_bm25_delta.npy:  postings (término, chunk, tf) añadidos desde la última
+                             compactación, en el orden en que se guardaron.
+
+Los arrays se abren con mmap y la búsqueda no necesita red.
+
+Guardar no reescribe los postings: los de los chunks nuevos se añaden al
+final de _bm25_delta.npy (que se ordena en memoria al abrir) y los chunks
+borrados se marcan negando su longitud. Los postings se fusionan y compactan
+en un índice nuevo (create_index) o cuando el delta o los postings borrados
+superan compact_ratio del índice.
+"""
+import os, re, json, unicodedata, logging
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from src.tools.npy_append import append_rows
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+POSTING_DTYPE = np.dtype([("term", np.int32), ("doc", np.int32), ("tf", np.float32)])
+# Fracción del índice que pueden ocupar el delta o los chunks borrados antes de compactar
+COMPACT_RATIO = 0.3
+
+# Palabras vacías frecuentes (español e inglés) que no aportan a BM25
+STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el
+ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue ha hay la las
+le les lo los mas me mi mientras muy no nos o otra otras otro otros para pero por porque que quien
+se sea ser si sin sobre son su sus tambien tiene tu un una uno unos y ya
+the of and to in is for on that with as by an be are this it from or at which
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Minúsculas, sin tildes, sin palabras vacías."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in _TOKEN_RE.findall(text) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fusiona varias listas ordenadas de ids con RRF: sum(1 / (k + rango))."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    Índice BM25 por id de chunk. Los chunks añadidos o borrados se
+    mantienen en memoria hasta save().
+    """
+    def __init__(self, prefix: str, k1: float = 1.2, b: float = 0.75, compact_ratio: float = COMPACT_RATIO):
+        self.prefix = prefix
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.vocab_path = f"{prefix}_bm25_vocab.json"
+        self.delta_path = f"{prefix}_bm25_delta.npy"
+        self._array_paths = {name: f"{prefix}_bm25_{name}.npy" for name in ("ptr", "docs", "tf", "len")}
+
+        self._vocab: Dict[str, int] = {}
+        self._ptr = np.zeros(1, dtype=np.int64)
+        self._docs = np.empty(0, dtype=np.int32)
+        self._tf = np.empty(0, dtype=np.float32)
+        self._len = np.empty(0, dtype=np.float32)
+        # Postings del delta guardado, en CSR en memoria
+        self._delta_ptr = np.zeros(1, dtype=np.int64)
+        self._delta_docs = np.empty(0, dtype=np.int32)
+        self._delta_tf = np.empty(0, dtype=np.float32)
+        # Cambios pendientes: (term_id, chunk_id, tf) y chunks borrados
+        self._new: List[Tuple[int, int, int]] = []
+        self._new_len: Dict[int, int] = {}
+        self._deleted: set = set()
+        # Un índice sin abrir es nuevo: su primer save() escribe los archivos completos
+        self._replace = True
+        self._n_saved_terms = 0
+        self._refresh_stats()
+
+    # ---------- carga ----------
+    def exists(self) -> bool:
+        return os.path.isfile(self.vocab_path) and all(os.path.isfile(p) for p in self._array_paths.values())
+
+    def open(self) -> "LexicalIndex":
+        with open(self.vocab_path, encoding="utf-8") as fh:
+            self._vocab = json.load(fh)
+        arrays = {name: np.load(path, mmap_mode="r") for name, path in self._array_paths.items()}
+        self._ptr, self._docs, self._tf, self._len = arrays["ptr"], arrays["docs"], arrays["tf"], arrays["len"]
+        delta = np.load(self.delta_path) if os.path.isfile(self.delta_path) else np.empty(0, dtype=POSTING_DTYPE)
+        # Los postings de cada término quedan ordenados por id de chunk, como en el CSR
+        delta = delta[np.lexsort((delta["doc"], delta["term"]))]
+        self._delta_ptr = np.zeros(len(self._vocab) + 1, dtype=np.int64)
+        self._delta_ptr[1:] = np.cumsum(np.bincount(delta["term"], minlength=len(self._vocab))[:len(self._vocab)])
+        self._delta_docs, self._delta_tf = delta["doc"], delta["tf"]
+        self._new, self._new_len, self._deleted = [], {}, set()
+        self._replace = False
+        self._n_saved_terms = len(self._vocab)
+        self._refresh_stats()
+        return self
+
+    def _refresh_stats(self) -> None:
+        live = self._len[self._len > 0]
+        self.n_docs = int(len(live))
+        self.avgdl = float(live.mean()) if len(live) else 0.0
+
+    # ---------- modificación ----------
+    def add(self, chunk_id: int, tokens: Iterable[str]) -> None:
+        """Añade los términos de un chunk (ya tokenizados)."""
+        counts: Dict[int, int] = {}
+        n = 0
+        for token in tokens:
+            term_id = self._vocab.setdefault(token, len(self._vocab))
+            counts[term_id] = counts.get(term_id, 0) + 1
+            n += 1
+        if n:
+            self._new.extend((t, chunk_id, c) for t, c in counts.items())
+            self._new_len[chunk_id] = n
+
+    def delete(self, chunk_id: int) -> None:
+        self._deleted.add(int(chunk_id))
+        self._new_len.pop(int(chunk_id), None)
+
+    def _compact_needed(self) -> bool:
+        """El delta o los chunks borrados (en términos) superan compact_ratio del índice."""
+        if len(self._delta_docs) + len(self._new) > self.compact_ratio * max(len(self._docs), 1):
+            return True
+        lengths = np.asarray(self._len)
+        total = float(np.abs(lengths).sum())
+        pending = [i for i in self._deleted if i < len(lengths)]
+        garbage = float(-lengths[lengths < 0].sum() + np.clip(lengths[pending], 0, None).sum())
+        return total > 0 and garbage > self.compact_ratio * total
+
+    def save(self) -> None:
+        """
+        Guarda los cambios pendientes: los postings nuevos se añaden al delta y
+        los chunks borrados se marcan en _bm25_len.npy. Fusiona y compacta todo
+        si el índice es nuevo o si el delta o la basura superan compact_ratio.
+        """
+        if self._replace or self._compact_needed():
+            self._rewrite()
+        else:
+            self._append()
+        self.open()
+
+    def _append(self) -> None:
+        """Añade los postings y longitudes nuevos y marca los borrados, sin reescribir lo guardado."""
+        n_saved = len(self._len)
+        tombstones = np.asarray(sorted(i for i in self._deleted if i < n_saved), dtype=np.int64)
+        new = np.asarray([p for p in self._new if p[1] not in self._deleted], dtype=POSTING_DTYPE)
+        lengths = np.zeros(max([n_saved - 1, *self._new_len.keys()], default=-1) + 1 - n_saved, dtype=np.float32)
+        for chunk_id, n in self._new_len.items():
+            lengths[chunk_id - n_saved] = n
+        self._ptr = self._docs = self._tf = self._len = None
+
+        if len(self._vocab) > self._n_saved_terms:
+            self._write_vocab()
+        # Longitudes antes que postings: un posting nunca apunta a un chunk sin longitud
+        append_rows(self._array_paths["len"], lengths)
+        if len(tombstones):
+            saved = np.load(self._array_paths["len"], mmap_mode="r+")
+            saved[tombstones] = -np.abs(saved[tombstones])
+            saved.flush()
+            del saved
+        append_rows(self.delta_path, new)
+        logger.debug(f"{self.prefix}: {len(new)} postings añadidos al delta BM25, {len(tombstones)} chunks borrados")
+
+    def _write_vocab(self) -> None:
+        with open(self.vocab_path + ".tmp", "w", encoding="utf-8") as fh:
+            json.dump(self._vocab, fh, ensure_ascii=False)
+        os.replace(self.vocab_path + ".tmp", self.vocab_path)
+
+    def _rewrite(self) -> None:
+        """Fusiona postings guardados, delta y cambios pendientes en un CSR sin chunks borrados."""
+        if not self._replace:
+            logger.info(f"{self.prefix}: compactando el índice BM25")
+        n_terms = len(self._vocab)
+        old_terms = np.repeat(np.arange(len(self._ptr) - 1, dtype=np.int32), np.diff(self._ptr))
+        delta_terms = np.repeat(np.arange(len(self._delta_ptr) - 1, dtype=np.int32), np.diff(self._delta_ptr))
+        terms = np.concatenate([old_terms, delta_terms, np.asarray([t for t, _, _ in self._new], dtype=np.int32)])
+        docs = np.concatenate([np.asarray(self._docs), self._delta_docs,
+                               np.asarray([d for _, d, _ in self._new], dtype=np.int32)])
+        tf = np.concatenate([np.asarray(self._tf), self._delta_tf,
+                             np.asarray([c for _, _, c in self._new], dtype=np.float32)])
+
+        max_id = max([len(self._len) - 1, *self._new_len.keys()], default=-1)
+        lengths = np.zeros(max_id + 1, dtype=np.float32)
+        lengths[:len(self._len)] = np.clip(self._len, 0, None)
+        for chunk_id, n in self._new_len.items():
+            lengths[chunk_id] = n
+        if self._deleted:
+            deleted = np.fromiter(self._deleted, dtype=np.int64)
+            lengths[deleted[deleted < len(lengths)]] = 0
+        # Postings de chunks borrados (ahora o con tombstone): fuera
+        keep = lengths[docs] > 0
+        terms, docs, tf = terms[keep], docs[keep], tf[keep]
+
+        order = np.lexsort((docs, terms))
+        terms, docs, tf = terms[order], docs[order], tf[order]
+        ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum(np.bincount(terms, minlength=n_terms))
+
+        for name, array in (("ptr", ptr), ("docs", docs), ("tf", tf), ("len", lengths)):
+            tmp = self._array_paths[name] + ".tmp"
+            with open(tmp, "wb") as fh:
+                np.save(fh, array)
+            os.replace(tmp, self._array_paths[name])
+        self._write_vocab()
+        if os.path.isfile(self.delta_path):
+            os.remove(self.delta_path)
+
+    # ---------- búsqueda ----------
+    def _term_ids(self, query: str) -> List[int]:
+        term_ids = {self._vocab[t] for t in tokenize(query) if t in self._vocab}
+        n_saved = max(len(self._ptr), len(self._delta_ptr)) - 1
+        return [t for t in term_ids if t < n_saved]
+
+    def _postings(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids de chunk, tf) del término t, ordenados por id: los del CSR y luego los del delta."""
+        docs, tf = [], []
+        for ptr, all_docs, all_tf in ((self._ptr, self._docs, self._tf),
+                                      (self._delta_ptr, self._delta_docs, self._delta_tf)):
+            if t < len(ptr) - 1 and ptr[t] < ptr[t + 1]:
+                # Los chunks del delta son posteriores a todos los del CSR
+                docs.append(np.asarray(all_docs[ptr[t]:ptr[t + 1]]))
+                tf.append(np.asarray(all_tf[ptr[t]:ptr[t + 1]]))
+        if len(docs) == 1:
+            return docs[0], tf[0]
+        if not docs:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        return np.concatenate(docs), np.concatenate(tf)
+
+    def _weights(self, post_docs: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        """Contribución BM25 de un término en cada posting (0 en los chunks borrados)."""
+        dl = self._len[post_docs]
+        live = dl > 0
+        df = int(live.sum())
+        idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+        weights = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * np.abs(dl) / self.avgdl))
+        return np.where(live, weights, 0.0)
+
+    def score_ids(self, query: str, ids: Sequence[int]) -> np.ndarray:
+        """BM25 de la pregunta para unos chunks concretos (0 si no contienen ningún término)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        scores = np.zeros(len(ids), dtype=np.float64)
+        if self.n_docs == 0 or not len(ids):
+            return scores
+        for t in self._term_ids(query):
+            # Los postings de cada término están ordenados por id de chunk
+            post_docs, post_tf = self._postings(t)
+            if not len(post_docs):
+                continue
+            pos = np.minimum(np.searchsorted(post_docs, ids), len(post_docs) - 1)
+            hit = post_docs[pos] == ids
+            if hit.any():
+                weights = self._weights(post_docs, post_tf)
+                scores[hit] += weights[pos[hit]]
+        return scores
+
+    def search(self, query: str, k: int = 10,
+               allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k chunks por BM25 como [(chunk_id, puntuación)]. allowed (máscara
+        por id de chunk) descarta el resto antes de elegir los k mejores.
+        """
+        if self.n_docs == 0:
+            return []
+        term_ids = self._term_ids(query)
+        if not term_ids:
+            return []
+
+        docs, weights = [], []
+        for t in term_ids:
+            post_docs, post_tf = self._postings(t)
+            if not len(post_docs):
+                continue
+            weights.append(self._weights(post_docs, post_tf))
+            docs.append(post_docs)
+        if not docs:
+            return []
+
+        unique, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        if self._deleted:
+            scores[np.isin(unique, list(self._deleted))] = 0
+        if allowed is not None:
+            inside = unique < len(allowed)
+            scores[~inside] = 0
+            scores[inside] *= allowed[unique[inside]]
+        top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(unique[i]), float(scores[i])) for i in top if scores[i] > 0]
@@ -0,0 +1,72 @@
+# npy_append.py
+"""
+Escritura incremental de archivos .npy: añadir filas al final sin reescribir
+las que ya están en disco.
+
+np.save rellena la cabecera con espacios hasta un múltiplo de 64 bytes, así
+que casi siempre la nueva forma cabe en la misma cabecera y solo se escriben
+las filas nuevas y la cabecera. Si no cabe, se reescribe el archivo completo.
+Las filas se escriben antes que la cabecera: si el proceso se interrumpe, el
+archivo sigue siendo válido con la forma anterior.
+"""
+import io, os
+import numpy as np
+from numpy.lib import format as npy_format
+
+
+def _read_header(fh) -> tuple[tuple, tuple, np.dtype, int]:
+    """(versión, forma, dtype, inicio de los datos) de un .npy abierto en binario."""
+    version = npy_format.read_magic(fh)
+    if version == (1, 0):
+        shape, fortran, dtype = npy_format.read_array_header_1_0(fh)
+    else:
+        shape, fortran, dtype = npy_format.read_array_header_2_0(fh)
+    if fortran:
+        raise ValueError("Solo se admiten arrays en orden C")
+    return version, shape, dtype, fh.tell()
+
+
+def _header(version: tuple, shape: tuple, dtype: np.dtype) -> bytes:
+    header = io.BytesIO()
+    fields = {"descr": npy_format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape}
+    if version == (1, 0):
+        npy_format.write_array_header_1_0(header, fields)
+    else:
+        npy_format.write_array_header_2_0(header, fields)
+    return header.getvalue()
+
+
+def append_rows(path: str, rows: np.ndarray) -> None:
+    """
+    Añade rows (mismo dtype y mismas dimensiones salvo la primera) al final
+    del array guardado en path, o lo crea si no existe.
+    """
+    if not os.path.isfile(path):
+        with open(path, "wb") as fh:
+            np.save(fh, rows)
+        return
+    with open(path, "r+b") as fh:
+        version, shape, dtype, data_start = _read_header(fh)
+        if dtype != rows.dtype or tuple(shape[1:]) != rows.shape[1:]:
+            raise ValueError(f"{path}: no se pueden añadir filas {rows.dtype}{rows.shape[1:]} "
+                             f"a un array {dtype}{tuple(shape[1:])}")
+        if not len(rows):
+            return
+        new_shape = (shape[0] + len(rows), *shape[1:])
+        header = _header(version, new_shape, dtype)
+        if len(header) == data_start:
+            # Se descartan restos de una escritura interrumpida antes de añadir
+            fh.seek(data_start + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize)
+            fh.write(np.ascontiguousarray(rows).tobytes())
+            fh.truncate()
+            fh.flush()
+            fh.seek(0)
+            fh.write(header)
+            return
+    # La cabecera crece: se reescribe el archivo
+    saved = np.load(path, mmap_mode="r")
+    merged = np.concatenate([saved, rows])
+    del saved
+    with open(path + ".tmp", "wb") as fh:
+        np.save(fh, merged)
+    os.replace(path + ".tmp", path)
@@ -1,12 +1,37 @@
 # rag_local.py
-import os, faiss, numpy as np, fitz, docx , logging
+import os, json, time, asyncio, hashlib, itertools, threading, faiss, numpy as np, fitz, docx , logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 import openai   # SDK v1.13+
-from functools import lru_cache
-from typing import List, Dict, Optional
+from typing import Callable, Iterable, Iterator, List, Dict, Optional
+
+from src.tools.embedding_cache import EmbeddingCache
+from src.tools.chunk_store import ChunkStore
+from src.tools.retrieval import RetrievedChunk, format_chunks
+from src.tools.lexical_index import LexicalIndex, tokenize, reciprocal_rank_fusion
+from src.tools.embedders import Embedder, OpenAIEmbedder, make_embedder
+from src.tools.reranker import Reranker, make_reranker
+from src.tools.chunker import PAGE_BREAK, chunk_pages, chunk_text, make_chunker_config, split_chars
+from src.tools.chunk_filter import chunk_mask, filter_key, make_chunk_filter
+from src.tools.dedup import NearDuplicateIndex, minhash, mmr, signature_similarity
+from src.tools.tokens import count_tokens_batch
+from src.tools.full_vectors import FullVectorStore
+from src.tools.index_factory import (
+    make_index_config, build_index, needs_training, supports_remove, search_parameters, project,
+)
 
-rag_local = None
 logger = logging.getLogger(__name__)
+
+# Modos de búsqueda: densa (FAISS), léxica (BM25) o híbrida (fusión RRF)
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+# Con un filtro que deja como mucho estos chunks, la búsqueda densa es exacta
+# sobre sus vectores en lugar de recorrer el índice con un IDSelector
+FILTER_EXACT_MAX = 4096
+
+# Lectura con mmap sin copia (FAISS >= 1.10); en versiones anteriores, mmap clásico
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
 load_dotenv()   # lee .env (OPENAI_API_KEY, etc.)
 
 class RAGLocal:
@@ -14,10 +39,53 @@ class RAGLocal:
     RAG sobre documentos en disco.
     - root_folder: carpeta donde buscar PDF / DOCX / TXT.
     - index_folder: carpeta para guardar índice FAISS y metadatos.
+    - embedding_cache: caché de embeddings en disco (por defecto, en index_folder).
+      Con use_embedding_cache=False se desactiva.
+    - workers: procesos para extraer documentos en paralelo (None = núcleos de la CPU, 1 = sin pool).
+    - queue_depth: archivos extraídos en vuelo como máximo; acota la memoria de la indexación.
+    - async_client: cliente openai.AsyncOpenAI para vectorizar con max_in_flight lotes
+      concurrentes. Si no se inyecta ningún cliente se crea uno por defecto.
+    - embedder: backend de embeddings (ver embedders; p. ej. LocalEmbedder para no
+      depender de la red). Por defecto, OpenAI con client / async_client. Su nombre
+      y dimensión se guardan con el índice y load_index rechaza otro embedder.
+    - reranker: re-ranker de candidatos (ver reranker; None = orden de la búsqueda).
+      Se piden rerank_candidates candidatos y se puntúan por lotes; si el re-ranking
+      supera rerank_budget_ms se conserva el orden de la búsqueda.
+    - index_type: tipo de índice FAISS ("flat", "ivf_flat", "ivf_pq", "hnsw").
+    - index_params: nlist, pq_m, hnsw_m, nprobe, ef_search, train_size, storage
+      (float32 / fp16 / int8), dimensions (recorte Matryoshka) y rerank (re-rank
+      exacto con los vectores completos en disco); ver index_factory.
+    - min_score: similitud coseno mínima para devolver un chunk (None = sin umbral).
+    - chunker: "structure" (párrafos/frases por tokens, limpieza de PDF) o "chars"
+      (ventana fija de chunk_size caracteres con overlap).
+    - chunker_params: max_tokens, overlap_tokens, min_tokens, strip_headers (ver chunker).
+    - dedup_threshold: similitud de Jaccard (MinHash) a partir de la cual un chunk se
+      descarta por casi duplicado antes de vectorizarlo (None = sin deduplicar).
+    - file_filter: función ruta -> bool para indexar solo parte de root_folder
+      (p. ej. los documentos de un shard de una colección; ver collection_registry).
     """
+    embedding_model = "text-embedding-3-large"
+
     def __init__(self, root_folder: str, index_folder: str = "faiss_indexes",
                  client: openai.OpenAI | None = None,
-                 chunk_size: int = 1000, overlap: int = 25):
+                 chunk_size: int = 1000, overlap: int = 25,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 use_embedding_cache: bool = True,
+                 workers: Optional[int] = None, queue_depth: int = 8,
+                 batch_size: int = 100,
+                 async_client: openai.AsyncOpenAI | None = None,
+                 max_in_flight: int = 4,
+                 index_type: str = "flat",
+                 index_params: Optional[Dict] = None,
+                 min_score: Optional[float] = None,
+                 chunker: str = "structure",
+                 chunker_params: Optional[Dict] = None,
+                 dedup_threshold: Optional[float] = 0.9,
+                 embedder: Optional[Embedder] = None,
+                 reranker: Optional[Reranker] = None,
+                 rerank_candidates: int = 50,
+                 rerank_budget_ms: float = 150.0,
+                 file_filter: Optional[Callable[[str], bool]] = None):
 
         self.root_folder = os.path.abspath(root_folder)
         if not os.path.isdir(self.root_folder):
@@ -27,7 +95,10 @@ class RAGLocal:
         os.makedirs(self.index_folder, exist_ok=True)
 
         self.index_path = os.path.join(self.index_folder, "vectorized_db.bin")
-        self.meta_path  = os.path.join(self.index_folder, "vectorized_db_meta.txt")
+        self.meta_path  = os.path.join(self.index_folder, "vectorized_db_meta.txt")  # formato antiguo
+        self.store_prefix = os.path.join(self.index_folder, "vectorized_db")
+        self.manifest_path = os.path.join(self.index_folder, "vectorized_db_manifest.json")
+        self.config_path = os.path.join(self.index_folder, "vectorized_db_config.json")
 
         # Validar parámetros
         if chunk_size < 100:
@@ -35,18 +106,68 @@ class RAGLocal:
         if overlap < 0 or overlap >= chunk_size:
             raise ValueError("overlap debe estar entre 0 y chunk_size")
             
+        if queue_depth < 1:
+            raise ValueError("queue_depth debe ser al menos 1")
+        if batch_size < 1:
+            raise ValueError("batch_size debe ser al menos 1")
+        if rerank_candidates < 1:
+            raise ValueError("rerank_candidates debe ser al menos 1")
+
         self.chunk_size = chunk_size
         self.overlap = overlap
+        # Configuración de troceado; se guarda en el manifiesto
+        self.chunk_config = make_chunker_config(
+            chunker=chunker, chunk_size=chunk_size, overlap=overlap, **(chunker_params or {})
+        )
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = queue_depth
+        self.batch_size = batch_size  # OpenAI permite hasta 2048 por request
+        # Configuración pedida; la efectiva (p. ej. nlist ajustado) se guarda con el índice
+        self.index_config = make_index_config(index_type=index_type, **(index_params or {}))
+        self._active_config: Dict = dict(self.index_config)
+        self.min_score = min_score
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        self.file_filter = file_filter
         
-        # Inicializar cliente OpenAI
+        # Inicializar el embedder (por defecto, cliente OpenAI)
         try:
-            self.client = client or openai.OpenAI()
-            logger.info("Cliente OpenAI inicializado correctamente")
+            if embedder is None:
+                embedder = OpenAIEmbedder(
+                    self.embedding_model, client=client, async_client=async_client,
+                    batch_size=batch_size, max_in_flight=max_in_flight,
+                )
+                logger.info("Cliente OpenAI inicializado correctamente")
+            self.embedder = embedder
         except Exception as e:
-            logger.error(f"Error al inicializar cliente OpenAI: {str(e)}")
+            logger.error(f"Error al inicializar el embedder: {str(e)}")
             raise
             
-        self._docs, self._index, self.dimension = [], None, None
+        if embedding_cache is None and use_embedding_cache:
+            embedding_cache = EmbeddingCache(os.path.join(self.index_folder, "embeddings_cache.sqlite"))
+        self.embedding_cache = embedding_cache
+
+        self._docs, self._index, self.dimension = ChunkStore(self.store_prefix), None, None
+        self._lexical = LexicalIndex(self.store_prefix)
+        self.dedup_threshold = dedup_threshold
+        self._dedup = self._new_dedup()
+        # Vectores completos en disco para el re-rank exacto (solo con rerank > 0)
+        self._full: Optional[FullVectorStore] = None
+        # Chunks y tokens de embedding ahorrados por la deduplicación en la última indexación
+        self.dedup_stats: Dict[str, int] = {}
+        # Índice abierto con mmap (solo lectura) y medida del tiempo hasta la primera consulta
+        self._index_mmapped = False
+        self._created_at = time.perf_counter()
+        self._first_query_logged = False
+        # path -> {size, mtime, sha256, first_id, n_chunks}
+        self._manifest: Dict[str, Dict] = {}
+        # Cambia cada vez que se guarda el índice (invalida cachés de respuestas)
+        self.index_version: Optional[str] = None
+        # Vectores a la espera de entrenar un índice IVF
+        self._train_buffer: List[tuple[np.ndarray, np.ndarray]] = []
+        # Máscaras de chunks por filtro de metadatos (se invalidan al guardar o cargar)
+        self._filter_masks: Dict[tuple, np.ndarray] = {}
 
     # ---------- extracción de texto ----------
     @staticmethod
@@ -54,7 +175,8 @@ class RAGLocal:
         """Extrae texto de un archivo PDF."""
         try:
             with fitz.open(path) as doc:
-                text = "\n".join(page.get_text() for page in doc)
+                # Las páginas se separan con PAGE_BREAK para detectar cabeceras y pies
+                text = PAGE_BREAK.join(page.get_text() for page in doc)
                 logger.debug(f"PDF extraído: {path} ({len(text)} caracteres)")
                 return text
         except Exception as e:
@@ -65,7 +187,7 @@ class RAGLocal:
     def _extract_docx(path: str) -> str:
         """Extrae texto de un archivo DOCX."""
         try:
-            text = "\n".join(p.text for p in docx.Document(path).paragraphs)
+            text = "\n\n".join(p.text for p in docx.Document(path).paragraphs)
             logger.debug(f"DOCX extraído: {path} ({len(text)} caracteres)")
             return text
         except Exception as e:
@@ -100,125 +222,904 @@ class RAGLocal:
             raise
 
     # ---------- utilidades ----------
+    @staticmethod
+    def _split(text: str, chunk_size: int, overlap: int) -> List[str]:
+        """Divide el texto en chunks de chunk_size caracteres con overlap."""
+        return split_chars(text, chunk_size, overlap)
+
     def _chunk(self, text: str) -> List[str]:
-        """Divide el texto en chunks con overlap."""
-        chunks = []
-        for i in range(0, len(text), self.chunk_size - self.overlap):
-            chunk = text[i : i + self.chunk_size]
-            if chunk.strip():  # Solo añadir chunks no vacíos
-                chunks.append(chunk)
-        return chunks
+        """Divide el texto en chunks según chunk_config."""
+        return chunk_text(text, self.chunk_config)
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Genera embeddings para una lista de textos en lotes.
+        Los textos presentes en la caché no se envían al embedder.
+        """
+        cached = (self.embedding_cache.get_many(self.embedder.name, texts)
+                  if self.embedding_cache is not None else [None] * len(texts))
+
+        # Textos sin caché (sin repetir) que hay que vectorizar
+        pending = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        fresh: Dict[str, np.ndarray] = {}
+
+        if pending:
+            embeds = self.embedder.embed(pending)
+            fresh.update(zip(pending, embeds))
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(self.embedder.name, pending, embeds)
+
+        if self.embedding_cache is not None and texts:
+            logger.debug(
+                f"Caché de embeddings: {len(texts) - len(pending)}/{len(texts)} aciertos "
+                f"({self.embedding_cache.hits} aciertos, {self.embedding_cache.misses} fallos acumulados)"
+            )
+
+        return np.vstack([v if v is not None else fresh[t] for t, v in zip(texts, cached)])
 
     def _embed(self, text: str) -> np.ndarray:
         """Genera embeddings para un texto."""
         try:
-            resp = self.client.embeddings.create(
-                model="text-embedding-3-large",
-                input=[text]
-            )
-            return np.asarray(resp.data[0].embedding, dtype=np.float32)
+            return self._embed_texts([text])[0]
         except Exception as e:
             logger.error(f"Error generando embedding: {str(e)}")
             raise
 
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embeddings (normalizados, con caché) de textos arbitrarios, p. ej. preguntas."""
+        return self._embed_texts(texts)
+
     # ---------- construcción / carga de índice ----------
-    def create_index(self) -> None:
-        """Crea el índice FAISS desde los documentos."""
-        file_paths = [
-            os.path.join(root, f)
+    @classmethod
+    def _extract(cls, path: str) -> str:
+        """Extrae el texto de un documento según su extensión."""
+        ext = path.lower().rsplit(".", 1)[-1]
+        if ext == "pdf":
+            return cls._extract_pdf(path)
+        if ext == "docx":
+            return cls._extract_docx(path)
+        return cls._extract_txt(path)
+
+    def _list_files(self) -> List[str]:
+        """Lista los documentos indexables bajo root_folder (sin la carpeta del índice)."""
+        return sorted(
+            path
             for root, _, files in os.walk(self.root_folder)
+            if os.path.commonpath([root, self.index_folder]) != self.index_folder
             for f in files
             if f.lower().endswith((".pdf", ".docx", ".txt"))
-        ]
+            for path in (os.path.join(root, f),)
+            if self.file_filter is None or self.file_filter(path)
+        )
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        """SHA-256 del contenido del archivo (lectura por bloques)."""
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _iter_processed(self, file_paths: Iterable[str]) -> Iterator[Dict]:
+        """
+        Extrae y trocea los archivos en un pool de procesos y los devuelve
+        en orden a medida que terminan. Como mucho hay queue_depth archivos
+        en vuelo, de modo que la memoria no depende del tamaño del corpus.
+        """
+        paths = iter(file_paths)
+
+        if self.workers <= 1:
+            for path in paths:
+                try:
+                    yield _process_file(path, self.chunk_config, self._dedup is not None)
+                except Exception as e:
+                    logger.error(f"Error procesando {path}: {str(e)}")
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque(
+                (path, pool.submit(_process_file, path, self.chunk_config, self._dedup is not None))
+                for path in itertools.islice(paths, self.queue_depth)
+            )
+            while pending:
+                path, future = pending.popleft()
+                # Reponer la cola antes de esperar para mantener el pool ocupado
+                for nxt in itertools.islice(paths, 1):
+                    pending.append((nxt, pool.submit(_process_file, nxt, self.chunk_config, self._dedup is not None)))
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.error(f"Error procesando {path}: {str(e)}")
+
+    def _add_batch(self, texts: List[str], ids: List[int]) -> None:
+        """
+        Vectoriza un lote de chunks y lo añade al índice. La caché y el almacén
+        de vectores completos guardan todas las dimensiones; el índice, las
+        de dimensions.
+        """
+        embeds, ids = self._embed_texts(texts), np.asarray(ids, dtype=np.int64)
+        if self._full is not None:
+            self._full.append(ids, embeds)
+        self._add_vectors(project(embeds, self._active_config["dimensions"]), ids)
+
+    def _add_vectors(self, embeds: np.ndarray, ids: np.ndarray) -> None:
+        """
+        Añade vectores al índice creándolo si hace falta. Los índices que
+        requieren entrenamiento acumulan vectores hasta tener train_size.
+        """
+        if self._index is None:
+            self.dimension = embeds.shape[1]
+            if needs_training(self.index_config):
+                self._train_buffer.append((embeds, ids))
+                if sum(len(e) for e, _ in self._train_buffer) >= self.index_config["train_size"]:
+                    self._build_trained_index()
+                return
+            self._index, self._active_config = build_index(self.dimension, self.index_config)
+        self._index.add_with_ids(embeds, ids)
+
+    def _build_trained_index(self) -> None:
+        """Entrena el índice con los vectores acumulados y los añade."""
+        embeds = np.vstack([e for e, _ in self._train_buffer])
+        ids = np.concatenate([i for _, i in self._train_buffer])
+        self._train_buffer = []
+        self._index, self._active_config = build_index(
+            self.dimension, self.index_config, embeds[:self.index_config["train_size"]]
+        )
+        self._index.add_with_ids(embeds, ids)
+
+    def _rebuild_live(self) -> None:
+        """
+        Reconstruye el índice solo con los chunks vivos (para índices sin borrado),
+        manteniendo su configuración y sin volver a vectorizar.
+        """
+        live = self._docs.live_ids()
+        if self._full is not None:
+            # Los vectores guardados son exactos; los reconstruidos de fp16/int8, aproximados
+            vectors = project(self._full.get(live)[0], self._active_config["dimensions"])
+        else:
+            vectors = self._index.reconstruct_batch(live)
+        train = vectors[:self._active_config["train_size"]] if needs_training(self._active_config) else None
+        self._index, self._active_config = build_index(self.dimension, self._active_config, train)
+        self._index.add_with_ids(vectors, live)
+
+    def _new_dedup(self) -> Optional[NearDuplicateIndex]:
+        if self.dedup_threshold is None:
+            return None
+        return NearDuplicateIndex(self.store_prefix, threshold=self.dedup_threshold)
+
+    def _new_full_store(self, config: Dict) -> Optional[FullVectorStore]:
+        if not config["rerank"]:
+            return None
+        return FullVectorStore(self.store_prefix).reset()
+
+    def _ingest(self, file_paths: Iterable[str]) -> int:
+        """
+        Pipeline de indexación: los chunks llegan en streaming desde la
+        extracción y se vectorizan por lotes mientras los procesos siguen
+        extrayendo el resto de archivos. Los ids se asignan de forma
+        consecutiva a partir de len(self._docs).
+        Los chunks casi duplicados de uno ya indexado se descartan antes de
+        vectorizarlos; el archivo anota de qué documentos dependía
+        ("dedup_against") para reindexarlo si estos cambian.
+        Devuelve el número de chunks añadidos.
+        """
+        texts, ids, added = [], [], 0
+        dropped: List[str] = []
+        # Con el motor asíncrono se acumulan varios lotes para tenerlos en vuelo a la vez
+        window = self.batch_size * self.embedder.max_in_flight
+
+        for result in self._iter_processed(file_paths):
+            path, chunks = result["path"], result["chunks"]
+            entry = self._manifest[path] = {
+                "size": result["size"],
+                "mtime": result["mtime"],
+                "sha256": result["sha256"],
+                "first_id": len(self._docs),
+                "n_chunks": 0,
+            }
+            signatures = result.get("minhash") or [None] * len(chunks)
+            sources = set()
+            for chunk, page, tokens, signature in zip(chunks, result["pages"], result["tokens"], signatures):
+                if self._dedup is not None:
+                    duplicate = self._dedup.find(signature)
+                    if duplicate is not None:
+                        dropped.append(chunk)
+                        sources.add(self._docs[duplicate]["path"])
+                        continue
+                chunk_id = self._docs.append(path, chunk, page, result["mtime"])
+                entry["n_chunks"] += 1
+                self._lexical.add(chunk_id, tokens)
+                if self._dedup is not None:
+                    self._dedup.add(chunk_id, signature)
+                ids.append(chunk_id)
+                texts.append(chunk)
+                if len(texts) >= window:
+                    self._add_batch(texts, ids)
+                    added += len(texts)
+                    texts, ids = [], []
+
+            sources.discard(path)
+            if sources:
+                entry["dedup_against"] = sorted(sources)
+            logger.debug(f"Documento procesado: {path} -> {entry['n_chunks']}/{len(chunks)} chunks")
+
+        if texts:
+            self._add_batch(texts, ids)
+            added += len(texts)
+        if self._train_buffer:
+            self._build_trained_index()
+
+        self.dedup_stats = {
+            "chunks": added + len(dropped),
+            "duplicados": len(dropped),
+            "tokens_ahorrados": sum(count_tokens_batch(dropped)) if dropped else 0,
+        }
+        if dropped:
+            logger.info(
+                f"Deduplicación: {len(dropped)}/{self.dedup_stats['chunks']} chunks casi duplicados "
+                f"descartados, {self.dedup_stats['tokens_ahorrados']} tokens de embedding ahorrados"
+            )
+        return added
+
+    def _save(self) -> None:
+        """Guarda índice, metadatos y manifiesto."""
+        faiss.write_index(self._index, self.index_path)
+        self._docs.save()
+        self._lexical.save()
+        if self._dedup is not None:
+            self._dedup.save()
+        if self._full is not None:
+            self._full.save()
+        self.index_version = f"{time.time_ns():x}"
+        self._filter_masks = {}
+        self._write_manifest()
+        with open(self.config_path, "w", encoding="utf-8") as fh:
+            json.dump({**self._active_config, "dimension": self.dimension, **self.embedder.identity()},
+                      fh, indent=1)
+
+    def _write_manifest(self) -> None:
+        with open(self.manifest_path, "w", encoding="utf-8") as fh:
+            json.dump({
+                "version": 1,
+                "index_version": self.index_version,
+                "chunk_size": self.chunk_size,
+                "overlap": self.overlap,
+                "chunker": self.chunk_config,
+                "files": self._manifest,
+            }, fh, ensure_ascii=False, indent=1)
+
+    def create_index(self) -> None:
+        """Crea el índice FAISS desde los documentos."""
+        file_paths = self._list_files()
 
         if not file_paths:
             raise RuntimeError(f"No se encontraron documentos válidos en {self.root_folder}")
 
-        logger.info(f"Procesando {len(file_paths)} documentos...")
-        documents = []
-        
-        for path in file_paths:
+        logger.info(f"Procesando {len(file_paths)} documentos con {self.workers} procesos...")
+        previous = (self._docs, self._lexical, self._dedup, self._full, self._index, self.dimension,
+                    self._manifest, self._active_config)
+        self._docs, self._index, self.dimension, self._manifest = ChunkStore(self.store_prefix), None, None, {}
+        self._lexical = LexicalIndex(self.store_prefix)
+        self._dedup = self._new_dedup()
+        # build_index sustituye esta configuración por la efectiva al crear el índice
+        self._active_config = dict(self.index_config)
+        self._full = self._new_full_store(self.index_config)
+        self._train_buffer = []
+
+        try:
+            n_chunks = self._ingest(file_paths)
+            if not n_chunks:
+                raise RuntimeError("No se pudieron procesar documentos válidos")
+
+            # Liberar los mmap del almacén anterior antes de sobrescribir sus archivos
+            previous[0].close()
+            self._index_mmapped = False
+            # Guardar índice, metadatos y manifiesto
+            self._save()
+
+            logger.info(f"Índice creado exitosamente: {n_chunks} documentos, {self.dimension} dimensiones")
+            
+        except Exception as e:
+            # Si falla, se conserva el índice anterior en memoria
+            if self._full is not None:
+                self._full.discard()
+            (self._docs, self._lexical, self._dedup, self._full, self._index, self.dimension,
+             self._manifest, self._active_config) = previous
+            self._train_buffer = []
+            logger.error(f"Error creando índice: {str(e)}")
+            raise
+
+    def update_index(self) -> Dict[str, int]:
+        """
+        Actualiza el índice de forma incremental usando el manifiesto:
+        solo extrae y vectoriza los archivos nuevos o modificados y
+        elimina los vectores de los archivos borrados.
+        Si no hay un índice incremental previo, lo crea desde cero.
+        """
+        if self._index is None or self._index_mmapped:
             try:
-                ext = path.lower().rsplit(".", 1)[-1]
-                if ext == "pdf":
-                    text = self._extract_pdf(path)
-                elif ext == "docx":
-                    text = self._extract_docx(path)
-                else:
-                    text = self._extract_txt(path)
-
-                # Dividir en chunks
-                chunks = self._chunk(text)
-                for chunk in chunks:
-                    documents.append({"path": path, "text": chunk})
-                    
-                logger.debug(f"Documento procesado: {path} -> {len(chunks)} chunks")
-                
-            except Exception as e:
-                logger.error(f"Error procesando {path}: {str(e)}")
+                # Un índice abierto con mmap es de solo lectura: se carga en memoria
+                self.load_index(mmap=False)
+            except FileNotFoundError:
+                logger.info("No existe índice previo, se crea uno nuevo")
+                self.create_index()
+                return {"nuevos": len(self._manifest), "modificados": 0, "eliminados": 0}
+
+        if not self._manifest:
+            logger.info("Índice sin manifiesto (formato antiguo), se reconstruye completo")
+            self.create_index()
+            return {"nuevos": len(self._manifest), "modificados": 0, "eliminados": 0}
+
+        current = set(self._list_files())
+        deleted = [p for p in self._manifest if p not in current]
+        added, modified = [], []
+        touched = False
+
+        for path in sorted(current):
+            entry = self._manifest.get(path)
+            if entry is None:
+                added.append(path)
+                continue
+            stat = os.stat(path)
+            if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+                continue
+            # Solo se recalcula el hash si cambian tamaño o fecha
+            if stat.st_size == entry["size"] and self._file_hash(path) == entry["sha256"]:
+                entry["mtime"] = stat.st_mtime
+                touched = True
                 continue
+            modified.append(path)
 
-        if not documents:
-            raise RuntimeError("No se pudieron procesar documentos válidos")
+        # Archivos cuyos chunks duplicados se descartaron frente a uno que cambia o desaparece
+        changed = set(deleted) | set(modified)
+        for path in sorted(current):
+            entry = self._manifest.get(path)
+            if (entry is not None and path not in changed and path not in added
+                    and changed.intersection(entry.get("dedup_against", ()))):
+                modified.append(path)
+
+        summary = {"nuevos": len(added), "modificados": len(modified), "eliminados": len(deleted)}
+        if not (added or modified or deleted):
+            logger.info("Índice al día, no hay cambios")
+            if touched:
+                # Solo cambió la fecha de algún archivo: se guarda el manifiesto, sin nueva versión
+                self._write_manifest()
+            return summary
 
-        logger.info(f"Generando embeddings para {len(documents)} chunks...")
-        
         try:
-            # Generar embeddings en lotes
-            batch_size = 100  # OpenAI permite hasta 2048 por request
-            all_embeds = []
-            
-            for i in range(0, len(documents), batch_size):
-                batch_docs = documents[i:i + batch_size]
-                batch = self.client.embeddings.create(
-                    model="text-embedding-3-large",
-                    input=[d["text"] for d in batch_docs],
-                )
-                batch_embeds = [r.embedding for r in batch.data]
-                all_embeds.extend(batch_embeds)
-                logger.debug(f"Batch {i//batch_size + 1} procesado: {len(batch_embeds)} embeddings")
-            
-            embeds = np.vstack(all_embeds)
-            self.dimension = embeds.shape[1]
-            self._index = faiss.IndexFlatL2(self.dimension)
-            self._index.add(embeds)
-            self._docs = documents
-
-            # Guardar índice y metadatos
-            faiss.write_index(self._index, self.index_path)
-            with open(self.meta_path, "w", encoding="utf-8") as fh:
-                for d in documents:
-                    line = f"{d['path']}|{d['text'].replace(chr(10), ' ')}\n"
-                    fh.write(line)
-
-            logger.info(f"Índice creado exitosamente: {len(documents)} documentos, {self.dimension} dimensiones")
-            
+            # 1) Quitar los chunks de archivos borrados o modificados
+            stale_ids = []
+            for path in deleted + modified:
+                entry = self._manifest.pop(path)
+                ids = range(entry["first_id"], entry["first_id"] + entry["n_chunks"])
+                stale_ids.extend(ids)
+                for i in ids:
+                    self._docs.delete(i)
+                    self._lexical.delete(i)
+                    if self._dedup is not None:
+                        self._dedup.delete(i)
+            if stale_ids and supports_remove(self._active_config):
+                self._index.remove_ids(np.asarray(stale_ids, dtype=np.int64))
+            elif stale_ids:
+                logger.info(f"El índice {self._active_config['index_type']} no admite borrados, se reconstruye con los vectores vivos")
+                self._rebuild_live()
+
+            # 2) Añadir los chunks de archivos nuevos o modificados con ids nuevos
+            n_added = self._ingest(added + modified)
+
+            self._save()
+            logger.info(
+                f"Índice actualizado: {summary} -> {n_added} chunks añadidos, "
+                f"{len(stale_ids)} eliminados"
+            )
+            return summary
+
         except Exception as e:
-            logger.error(f"Error creando índice: {str(e)}")
+            logger.error(f"Error actualizando índice: {str(e)}")
             raise
 
-    def load_index(self) -> None:
-        """Carga el índice y metadatos ya existentes."""
-        if not (os.path.isfile(self.index_path) and os.path.isfile(self.meta_path)):
+    def load_index(self, mmap: bool = False) -> None:
+        """
+        Carga el índice y metadatos ya existentes.
+        Con mmap=True el índice FAISS se mapea en memoria en solo lectura: la carga
+        es casi instantánea y varios procesos comparten la misma caché de páginas.
+        """
+        store = ChunkStore(self.store_prefix)
+        if not (os.path.isfile(self.index_path) and (store.exists() or os.path.isfile(self.meta_path))):
             raise FileNotFoundError(f"No existe un índice previo en {self.index_folder}. Ejecuta create_index().")
 
         try:
-            self._index = faiss.read_index(self.index_path)
-            with open(self.meta_path, encoding="utf-8") as fh:
-                self._docs = []
-                for line in fh:
-                    path, text = line.rstrip("\n").split("|", 1)
-                    self._docs.append({"path": path, "text": text})
+            started = time.perf_counter()
+            self._index = faiss.read_index(self.index_path, _MMAP_FLAGS if mmap else 0)
+            self._index_mmapped = mmap
+            if store.exists():
+                self._docs.close()
+                self._docs = store.open()
+            else:
+                # Migración única desde vectorized_db_meta.txt
+                self._docs = ChunkStore.migrate_text_file(self.meta_path, self.store_prefix)
+            self._filter_masks = {}
+            self._lexical = LexicalIndex(self.store_prefix)
+            if self._lexical.exists():
+                self._lexical.open()
+            else:
+                # Índices anteriores al BM25: se construye una vez desde los chunks guardados
+                for i in self._docs.live_ids():
+                    self._lexical.add(int(i), tokenize(self._docs[i]["text"]))
+                self._lexical.save()
+                logger.info(f"Índice léxico BM25 creado a partir de {self._lexical.n_docs} chunks")
+            self._dedup = self._new_dedup()
+            if self._dedup is not None and self._dedup.exists():
+                self._dedup.open()
+            elif self._dedup is not None:
+                # Índices anteriores a la deduplicación: firmas de los chunks guardados
+                for i in self._docs.live_ids():
+                    self._dedup.add(int(i), minhash(tokenize(self._docs[i]["text"])))
+                self._dedup.save()
+                logger.info(f"Firmas MinHash creadas para {len(self._dedup)} chunks")
             self.dimension = self._index.d
-            logger.info(f"Índice cargado: {len(self._docs)} documentos, {self.dimension} dimensiones")
+            # Índices antiguos sin configuración: IndexFlatL2 con embeddings de OpenAI
+            self._active_config = make_index_config()
+            identity = {"embedder": self.embedding_model, "embedding_dimension": None}
+            if os.path.isfile(self.config_path):
+                with open(self.config_path, encoding="utf-8") as fh:
+                    saved = json.load(fh)
+                saved.pop("dimension", None)
+                identity = {key: saved.pop(key, identity[key]) for key in identity}
+                self._active_config = make_index_config(**saved)
+            self._check_embedder(identity)
+            self._full = None
+            if self._active_config["rerank"]:
+                self._full = FullVectorStore(self.store_prefix)
+                if self._full.exists():
+                    self._full.open()
+                else:
+                    logger.warning("Faltan los vectores completos del re-rank; se busca sin re-rank")
+                    self._full = None
+            self._manifest = {}
+            # Índices sin versión: la fecha de modificación del índice FAISS
+            self.index_version = f"{os.stat(self.index_path).st_mtime_ns:x}"
+            if os.path.isfile(self.manifest_path):
+                with open(self.manifest_path, encoding="utf-8") as fh:
+                    manifest = json.load(fh)
+                self.index_version = manifest.get("index_version", self.index_version)
+                # Si cambió el troceado los ids del manifiesto ya no son válidos
+                # (los índices sin "chunker" en el manifiesto se trocearon por caracteres)
+                if "chunker" in manifest:
+                    saved_chunker = make_chunker_config(**manifest["chunker"])
+                else:
+                    saved_chunker = make_chunker_config(
+                        chunker="chars", chunk_size=manifest.get("chunk_size") or 1000,
+                        overlap=manifest.get("overlap") or 0,
+                    )
+                if saved_chunker == self.chunk_config:
+                    self._manifest = manifest.get("files", {})
+            logger.info(
+                f"Índice cargado{' (mmap)' if mmap else ''}: {len(self._docs)} documentos, "
+                f"{self.dimension} dimensiones en {(time.perf_counter() - started) * 1000:.1f} ms"
+            )
             
         except Exception as e:
             logger.error(f"Error cargando índice: {str(e)}")
             raise
 
+    def _check_embedder(self, identity: Dict) -> None:
+        """Rechaza un índice creado con otro embedder: sus vectores no son comparables."""
+        legacy = identity["embedder"] == self.embedder.name.split("@")[0] != self.embedder.name
+        if legacy:
+            # Índices anteriores a la huella de los modelos locales: solo se puede comparar la carpeta
+            logger.warning(f"El índice de {self.index_folder} no guarda la huella del modelo "
+                           f"'{identity['embedder']}'; no se puede comprobar que sea el mismo. "
+                           f"Ejecuta create_index() para guardarla")
+        elif identity["embedder"] != self.embedder.name:
+            raise ValueError(
+                f"El índice de {self.index_folder} se creó con el embedder '{identity['embedder']}' "
+                f"y se está usando '{self.embedder.name}'; usa el mismo embedder o ejecuta create_index()"
+            )
+        saved, current = identity["embedding_dimension"], self.embedder.dimension
+        if saved is not None and current is not None and saved != current:
+            raise ValueError(
+                f"El índice de {self.index_folder} tiene embeddings de {saved} dimensiones y el "
+                f"embedder '{self.embedder.name}' produce {current}; ejecuta create_index()"
+            )
+        expected = current or saved or self.dimension
+        if self._active_config["dimensions"]:
+            expected = min(expected, self._active_config["dimensions"])
+        if expected != self.dimension:
+            raise ValueError(
+                f"El índice FAISS tiene {self.dimension} dimensiones y se esperaban {expected}; "
+                f"ejecuta create_index()"
+            )
+
     # ---------- consulta ----------
-    def query(self, question: str, k: int = 3) -> str:
-        """Realiza una consulta al índice RAG."""
+    def _dense_search(self, q_embeds: np.ndarray, k: int, nprobe: Optional[int],
+                      ef_search: Optional[int],
+                      allowed: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Una búsqueda FAISS sobre la matriz de consultas; devuelve (similitudes, ids).
+        allowed (máscara por id de chunk) restringe la búsqueda a esos chunks.
+        """
+        config = self._active_config
+        selector = None
+        if allowed is not None:
+            ids = np.flatnonzero(allowed)
+            if len(ids) <= FILTER_EXACT_MAX:
+                try:
+                    return self._exact_search(q_embeds, ids, k)
+                except RuntimeError:
+                    pass  # el índice no reconstruye vectores (IVF sin mapa directo)
+            # Bitmap de ids permitidos: FAISS descarta el resto durante la búsqueda
+            bitmap = np.packbits(allowed, bitorder="little")
+            selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bitmap))
+        params = search_parameters(config, nprobe=nprobe, ef_search=ef_search, selector=selector)
+        rerank = config["rerank"] if self._full is not None else 0
+        dist, idxs = self._index.search(project(q_embeds, config["dimensions"]),
+                                        k * rerank if rerank > 1 else k, params=params)
+        # Con embeddings normalizados: coseno = 1 - L2² / 2
+        scores = 1.0 - dist / 2.0
+        if rerank:
+            scores, idxs = self._rerank_exact(q_embeds, scores, idxs, k)
+        return scores, idxs
+
+    def _exact_search(self, q_embeds: np.ndarray, ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Búsqueda exacta sobre unos pocos chunks (filtro muy selectivo): el
+        coseno con sus vectores, sin recorrer el índice. Las posiciones que
+        faltan hasta k quedan con id -1.
+        """
+        vectors = self._candidate_vectors(ids)
+        if self._full is None:
+            q_embeds = project(q_embeds, self._active_config["dimensions"])
+        scores = q_embeds @ vectors.T
+        top = min(k, len(ids))
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top]
+        out_scores = np.full((len(q_embeds), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(q_embeds), k), -1, dtype=np.int64)
+        out_scores[:, :top] = np.take_along_axis(scores, order, axis=1)
+        out_ids[:, :top] = ids[order]
+        return out_scores, out_ids
+
+    def _allowed(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Máscara de chunks que cumplen el filtro (None = sin filtro); se cachea hasta el siguiente guardado."""
+        try:
+            normalized = make_chunk_filter(**(filters or {}))
+        except TypeError as e:
+            raise ValueError(f"Filtro no válido: {str(e)}") from None
+        if normalized is None:
+            return None
+        key = filter_key(normalized)
+        mask = self._filter_masks.get(key)
+        if mask is None:
+            if len(self._filter_masks) >= 64:
+                self._filter_masks.clear()
+            mask = self._filter_masks[key] = chunk_mask(self._docs, normalized)
+        return mask
+
+    def _rerank_exact(self, q_embeds: np.ndarray, scores: np.ndarray, idxs: np.ndarray,
+                      k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Recalcula el coseno de los candidatos con los vectores completos del
+        disco (solo se leen sus filas) y se queda con los k mejores. Los
+        candidatos sin vector guardado conservan la similitud aproximada.
+        """
+        vectors, valid = self._full.get(idxs.reshape(-1))
+        exact = np.einsum("qcd,qd->qc", vectors.reshape(*idxs.shape, -1), q_embeds)
+        valid = valid.reshape(idxs.shape)
+        scores = np.where(valid, exact, scores)
+        scores[idxs < 0] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(idxs, order, axis=1)
+
+    def _make_chunk(self, chunk_id: int, score: float, rank_score: float) -> Optional[RetrievedChunk]:
+        """Decodifica un chunk del almacén (None si fue borrado); score es el coseno (o NaN)."""
+        doc = self._docs[chunk_id] if 0 <= chunk_id < len(self._docs) else None
+        if doc is None:
+            return None
+        # Con embeddings normalizados: L2² = 2 (1 - coseno)
+        return RetrievedChunk(int(chunk_id), doc["path"], float(score), 2.0 * (1.0 - float(score)),
+                              doc["text"], doc["page"], float(rank_score))
+
+    def _check_query(self, questions: List[str], mode: str) -> List[str]:
+        """Valida la consulta y devuelve las preguntas limpias."""
+        if self._index is None:
+            raise RuntimeError("Índice no cargado. Usa load_index() o create_index().")
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode debe ser uno de {SEARCH_MODES}")
+
+        clean = [q.strip() if q else "" for q in questions]
+        if not clean or not all(clean):
+            raise ValueError("Las preguntas no pueden estar vacías.")
+        return clean
+
+    def _needs_embeddings(self, mode: str, min_score: Optional[float]) -> bool:
+        """La búsqueda léxica solo vectoriza la pregunta si hay umbral de similitud que aplicar."""
+        threshold = self.min_score if min_score is None else min_score
+        return mode != "lexical" or threshold is not None
+
+    def _embed_failed(self, mode: str, error: Exception) -> None:
+        """En modo híbrido un fallo de embeddings degrada a BM25; en vectorial se propaga."""
+        if mode == "vector":
+            raise error
+        logger.warning(f"Búsqueda densa no disponible, se usa solo BM25: {str(error)}")
+
+    def _candidate_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Vectores de unos chunks: los completos del disco si hay re-rank exacto
+        y si no los del índice (RuntimeError si el índice no los reconstruye).
+        """
+        if self._full is not None:
+            return self._full.get(ids)[0]
+        return self._index.reconstruct_batch(ids)
+
+    def _cosines(self, q_embed: Optional[np.ndarray], ids: List[int], known: Dict[int, float]) -> Dict[int, float]:
+        """
+        Similitud coseno de unos candidatos con la pregunta: la de la búsqueda
+        densa si la tienen y, para los que solo encontró BM25, con sus vectores
+        (los completos del disco o los del índice). NaN si no se puede calcular.
+        """
+        cosines = {i: known.get(i, np.nan) for i in ids}
+        missing = np.asarray([i for i in ids if i not in known], dtype=np.int64)
+        if not len(missing) or q_embed is None:
+            return cosines
+        try:
+            if self._full is not None:
+                vectors, valid = self._full.get(missing)
+                exact = np.where(valid, vectors @ q_embed, np.nan)
+            else:
+                vectors = self._index.reconstruct_batch(missing)
+                exact = vectors @ project(q_embed[None], self._active_config["dimensions"])[0]
+        except RuntimeError:
+            return cosines  # el índice no reconstruye vectores (IVF sin mapa directo)
+        cosines.update(zip(missing.tolist(), exact.tolist()))
+        return cosines
+
+    def _rerank(self, question: str, ranked: List[tuple[int, float]], cosines: Dict[int, float],
+                deadline: float) -> Optional[List[tuple[int, float]]]:
+        """
+        Puntúa los candidatos con el re-ranker y los reordena, con las
+        puntuaciones llevadas a [0, 1] (para MMR). None si se agota el plazo.
+        """
+        ids = np.asarray([i for i, _ in ranked], dtype=np.int64)
+        texts = [(self._docs[i] or {}).get("text", "") for i in ids]
+        dense = np.asarray([cosines[i] for i, _ in ranked], dtype=np.float64)
+        scores = self.reranker.score(question, texts, dense, deadline, ids=ids, lexical=self._lexical)
+        if scores is None:
+            return None
+        spread = scores.max() - scores.min()
+        scores = (scores - scores.min()) / spread if spread > 0 else np.ones(len(scores))
+        order = np.argsort(-scores, kind="stable")
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def _diversify(self, ranked: List[tuple[int, float]], k: int, diversity: float,
+                   mode: str) -> List[tuple[int, float]]:
+        """
+        Reordena los candidatos con MMR. La similitud entre chunks es el coseno
+        de sus vectores (los completos del disco si hay re-rank); si el índice
+        no permite reconstruirlos (IVF sin mapa directo), el Jaccard estimado
+        con MinHash sobre sus textos.
+        """
+        if len(ranked) <= 1:
+            return ranked[:k]
+        ids = np.asarray([i for i, _ in ranked], dtype=np.int64)
+        relevance = np.asarray([sc for _, sc in ranked], dtype=np.float64)
+        if mode != "vector":
+            # BM25 / RRF no están en la escala del coseno: se normalizan a [0, 1]
+            relevance = relevance / relevance.max() if relevance.max() > 0 else relevance
+        try:
+            vectors = self._candidate_vectors(ids)
+            similarity = vectors @ vectors.T
+        except RuntimeError:
+            texts = [(self._docs[i] or {}).get("text", "") for i in ids]
+            similarity = signature_similarity([minhash(tokenize(t)) for t in texts])
+        order = mmr(relevance, similarity, k, diversity)
+        return [ranked[i] for i in order]
+
+    def _rank(self, clean: List[str], q_embeds: Optional[np.ndarray], k: int,
+              nprobe: Optional[int], ef_search: Optional[int], min_score: Optional[float],
+              mode: str, q_started: float, diversity: Optional[float] = None,
+              use_reranker: Optional[bool] = None,
+              filters: Optional[Dict] = None) -> List[List[RetrievedChunk]]:
+        """Búsqueda FAISS / BM25, fusión y decodificación a partir de los embeddings ya calculados."""
+        threshold = self.min_score if min_score is None else min_score
+        allowed = self._allowed(filters)
+        if allowed is not None and not allowed.any():
+            logger.debug(f"Ningún chunk cumple el filtro {filters}")
+            return [[] for _ in clean]
+        reranking = self.reranker is not None and use_reranker is not False
+        # En modo híbrido (o con MMR) se piden más candidatos para fusionar o diversificar
+        n_candidates = k if mode == "vector" and diversity is None else max(k * 4, 20)
+        if reranking:
+            # El re-ranker elige entre muchos candidatos baratos
+            n_candidates = max(n_candidates, self.rerank_candidates)
+        wide = diversity is not None or reranking
+
+        scores = idxs = None
+        if q_embeds is not None and mode != "lexical":
+            scores, idxs = self._dense_search(q_embeds, n_candidates, nprobe, ef_search, allowed)
+
+        results = []
+        rerank_deadline = time.perf_counter() + self.rerank_budget_ms / 1000.0
+        late = 0
+        for qi, question in enumerate(clean):
+            # Coseno de todos los candidatos densos, pasen o no el umbral
+            known: Dict[int, float] = {}
+            if idxs is not None:
+                known = {int(i): float(sc) for sc, i in zip(scores[qi], idxs[qi]) if i >= 0}
+            # Solo se decodifica el texto de los chunks que pasan el umbral
+            dense = [(i, sc) for i, sc in known.items() if threshold is None or sc >= threshold]
+
+            if mode == "vector":
+                ranked = dense
+            else:
+                if mode == "lexical" or idxs is None:
+                    # Con umbral se piden más candidatos: parte de ellos se descarta por similitud
+                    wanted = n_candidates if wide or threshold is not None else k
+                    ranked = self._lexical.search(question, wanted, allowed)
+                else:
+                    lexical = self._lexical.search(question, n_candidates, allowed)
+                    ranked = reciprocal_rank_fusion([[i for i, _ in dense], [i for i, _ in lexical]])
+                q_embed = q_embeds[qi] if q_embeds is not None else None
+                known = self._cosines(q_embed, [i for i, _ in ranked], known)
+                if threshold is not None:
+                    # El umbral es de similitud coseno también para lo que solo encontró BM25;
+                    # sin coseno (NaN: sin embedding de la pregunta) no se puede aplicar
+                    ranked = [(i, sc) for i, sc in ranked if not known[i] < threshold]
+            # Los chunks conservan la puntuación de la búsqueda; el re-ranker solo cambia el orden
+            retrieval_scores = dict(ranked)
+            if reranking and len(ranked) > 1:
+                reranked = None
+                if time.perf_counter() < rerank_deadline:
+                    reranked = self._rerank(question, ranked, known, rerank_deadline)
+                if reranked is None:
+                    late += 1
+                else:
+                    ranked = reranked
+            if diversity is not None:
+                ranked = self._diversify(ranked, k, diversity, mode)
+            ranked = ranked[:k]
+
+            hits = []
+            for chunk_id, _ in ranked:
+                chunk = self._make_chunk(chunk_id, known.get(chunk_id, np.nan), retrieval_scores[chunk_id])
+                if chunk is not None:
+                    hits.append(chunk)
+            results.append(hits)
+
+        if late:
+            logger.warning(
+                f"Re-ranking fuera de plazo ({self.rerank_budget_ms:.0f} ms) en {late}/{len(clean)} "
+                f"preguntas; se usa el orden de la búsqueda"
+            )
+
+        if not self._first_query_logged:
+            self._first_query_logged = True
+            now = time.perf_counter()
+            logger.info(
+                f"Tiempo hasta la primera consulta: {(now - self._created_at) * 1000:.1f} ms "
+                f"desde la inicialización (consulta: {(now - q_started) * 1000:.1f} ms)"
+            )
+        logger.debug(
+            f"Consulta en lote ({mode}): {len(clean)} preguntas, k={k}, "
+            f"{(time.perf_counter() - q_started) * 1000:.1f} ms"
+        )
+        return results
+
+    def search_embedded(self, questions: List[str], q_embeds: Optional[np.ndarray], k: int = 3,
+                        nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                        min_score: Optional[float] = None, mode: str = "vector",
+                        diversity: Optional[float] = None,
+                        use_reranker: Optional[bool] = None,
+                        filters: Optional[Dict] = None) -> List[List[RetrievedChunk]]:
+        """
+        query_batch con los embeddings de las preguntas ya calculados (None en
+        modo léxico o si fallaron en modo híbrido), p. ej. una sola vez para
+        todos los shards de una colección.
+        """
+        clean = self._check_query(questions, mode)
+        return self._rank(clean, q_embeds, k, nprobe, ef_search, min_score, mode, time.perf_counter(),
+                          diversity, use_reranker, filters)
+
+    def query_batch(self, questions: List[str], k: int = 3,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                    min_score: Optional[float] = None,
+                    mode: str = "vector",
+                    diversity: Optional[float] = None,
+                    use_reranker: Optional[bool] = None,
+                    filters: Optional[Dict] = None) -> List[List[RetrievedChunk]]:
+        """
+        Consulta varias preguntas a la vez: un único lote de embeddings y una
+        única búsqueda FAISS sobre la matriz de consultas.
+        Devuelve, por pregunta, los chunks encontrados ordenados por relevancia.
+        Los chunks con similitud coseno menor que min_score (o self.min_score) se
+        descartan en todos los modos; score es siempre ese coseno y rank_score la
+        puntuación con la que se ordenaron.
+
+        mode:
+        - "vector": búsqueda densa; rank_score es la similitud coseno.
+        - "lexical": BM25 sobre el índice invertido; rank_score es la puntuación BM25.
+          Sin umbral no usa la red; con umbral se vectoriza la pregunta para aplicarlo.
+        - "hybrid": fusión RRF de ambas listas; rank_score es la puntuación RRF.
+          Si la API de embeddings falla, se responde solo con BM25 (sin umbral).
+
+        diversity: lambda de MMR en [0, 1] (1 = solo relevancia). Con un valor
+        se piden más candidatos y se eligen k que no repitan el mismo pasaje.
+
+        use_reranker: False desactiva el re-ranker en esta consulta. Con re-ranker
+        se piden rerank_candidates candidatos y se devuelven los k mejores según
+        él (score y rank_score siguen siendo los de la búsqueda).
+
+        filters: filtro de metadatos, p. ej. {"file_type": "pdf", "page_from": 3} o
+        {"source": "informe.pdf", "modified_after": "2024-01-01"} (ver chunk_filter).
+        Se aplica dentro de la búsqueda FAISS / BM25, no sobre los resultados.
+        """
+        clean = self._check_query(questions, mode)
+        q_started = time.perf_counter()
+
+        q_embeds = None
+        if self._needs_embeddings(mode, min_score):
+            try:
+                q_embeds = self._embed_texts(clean)
+            except Exception as e:
+                self._embed_failed(mode, e)
+        return self._rank(clean, q_embeds, k, nprobe, ef_search, min_score, mode, q_started,
+                          diversity, use_reranker, filters)
+
+    async def _aembed_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Versión asíncrona de _embed_texts: las preguntas sin caché se piden con
+        embedder.aembed (AsyncOpenAI o un hilo) sin bloquear el bucle del llamante.
+        """
+        cached = (self.embedding_cache.get_many(self.embedder.name, texts)
+                  if self.embedding_cache is not None else [None] * len(texts))
+        pending = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        fresh: Dict[str, np.ndarray] = {}
+        if pending:
+            embeds = await self.embedder.aembed(pending)
+            fresh.update(zip(pending, embeds))
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(self.embedder.name, pending, embeds)
+        return np.vstack([v if v is not None else fresh[t] for t, v in zip(texts, cached)])
+
+    async def aembed_texts(self, texts: List[str]) -> np.ndarray:
+        """Versión asíncrona de embed_texts."""
+        return await self._aembed_texts(texts)
+
+    async def aquery_batch(self, questions: List[str], k: int = 3,
+                           nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                           min_score: Optional[float] = None,
+                           mode: str = "vector",
+                           diversity: Optional[float] = None,
+                           use_reranker: Optional[bool] = None,
+                           filters: Optional[Dict] = None) -> List[List[RetrievedChunk]]:
+        """
+        Versión asíncrona de query_batch: embeddings con AsyncOpenAI y la
+        búsqueda FAISS / BM25 en un hilo, para no bloquear el bucle de eventos.
+        """
+        clean = self._check_query(questions, mode)
+        q_started = time.perf_counter()
+
+        q_embeds = None
+        if self._needs_embeddings(mode, min_score):
+            try:
+                q_embeds = await self._aembed_texts(clean)
+            except Exception as e:
+                self._embed_failed(mode, e)
+        return await asyncio.to_thread(
+            self._rank, clean, q_embeds, k, nprobe, ef_search, min_score, mode, q_started,
+            diversity, use_reranker, filters
+        )
+
+    def query(self, question: str, k: int = 3,
+              nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+              min_score: Optional[float] = None, mode: str = "vector",
+              diversity: Optional[float] = None, use_reranker: Optional[bool] = None,
+              filters: Optional[Dict] = None) -> str:
+        """
+        Realiza una consulta al índice RAG.
+        nprobe / ef_search ajustan la precisión de los índices IVF / HNSW en esta consulta.
+        filters restringe la búsqueda por documento, tipo, páginas o fechas (ver query_batch).
+        """
         if self._index is None:
             return "Índice no cargado. Usa load_index() o create_index()."
 
@@ -226,42 +1127,108 @@ class RAGLocal:
             return "La pregunta no puede estar vacía."
 
         try:
-            q_embed = self._embed(question.strip()).reshape(1, -1)
-            dist, idxs = self._index.search(q_embed, k)
-            
-            answers = []
-            for i, idx in enumerate(idxs[0]):
-                if idx != -1 and idx < len(self._docs):
-                    doc = self._docs[idx]
-                    answers.append(f"{i+1}. {doc['text']}\n")
-            
-            if not answers:
+            hits = self.query_batch([question], k=k, nprobe=nprobe, ef_search=ef_search,
+                                    min_score=min_score, mode=mode, diversity=diversity,
+                                    use_reranker=use_reranker, filters=filters)[0]
+
+            if not hits:
                 return "No se encontraron documentos relevantes para tu pregunta."
-                
-            return "".join(answers)
+
+            return format_chunks(hits)
             
         except Exception as e:
             logger.error(f"Error en consulta RAG: {str(e)}")
             return f"Error interno en la consulta: {str(e)}"
-    
-# ← objeto global (vacío)
 
-@lru_cache
-def init_rag(path: str = "data") -> RAGLocal:
+    async def aquery(self, question: str, k: int = 3,
+                     nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                     min_score: Optional[float] = None, mode: str = "vector",
+                     diversity: Optional[float] = None, use_reranker: Optional[bool] = None,
+                     filters: Optional[Dict] = None) -> str:
+        """Versión asíncrona de query."""
+        if self._index is None:
+            return "Índice no cargado. Usa load_index() o create_index()."
+
+        if not question or not question.strip():
+            return "La pregunta no puede estar vacía."
+
+        try:
+            hits = (await self.aquery_batch([question], k=k, nprobe=nprobe, ef_search=ef_search,
+                                            min_score=min_score, mode=mode, diversity=diversity,
+                                            use_reranker=use_reranker, filters=filters))[0]
+
+            if not hits:
+                return "No se encontraron documentos relevantes para tu pregunta."
+
+            return format_chunks(hits)
+
+        except Exception as e:
+            logger.error(f"Error en consulta RAG: {str(e)}")
+            return f"Error interno en la consulta: {str(e)}"
+
+
+def _process_file(path: str, chunk_config: Dict, dedup: bool = False) -> Dict:
+    """
+    Extrae, trocea y firma un archivo. Función de módulo para poder
+    ejecutarse en los procesos del pool de extracción.
+    """
+    text = RAGLocal._extract(path)
+    stat = os.stat(path)
+    chunks, pages = chunk_pages(text, chunk_config)
+    if not path.lower().endswith(".pdf"):
+        # Solo los PDF tienen páginas
+        pages = [0] * len(chunks)
+    # Tokenización BM25 (y firmas MinHash) en el proceso del pool
+    tokens = [tokenize(c) for c in chunks]
+    return {
+        "path": path,
+        "chunks": chunks,
+        "pages": pages,
+        "tokens": tokens,
+        "minhash": [minhash(t) for t in tokens] if dedup else None,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": RAGLocal._file_hash(path),
+    }
+
+# Una instancia por carpeta de datos (ruta absoluta)
+_rags: Dict[str, RAGLocal] = {}
+_rags_lock = threading.Lock()
+
+def init_rag(path: str = "data", mmap: bool = True) -> RAGLocal:
     """
-    Carga o crea el índice una sola vez y lo guarda en rag_local.
-    Devuelve la instancia para quien quiera usarla.
+    Carga o crea el índice de la carpeta path una sola vez por proceso.
+    Devuelve la instancia para quien quiera usarla; cada carpeta tiene la suya.
+    Por defecto el índice se abre con mmap (solo lectura, compartido entre procesos).
+    Para varias colecciones o un índice repartido en shards, ver collection_registry.
     """
-    global rag_local
-    if rag_local is None:
+    key = os.path.abspath(path)
+    with _rags_lock:
+        rag = _rags.get(key)
+        if rag is not None:
+            return rag
         try:
-            rag_local = RAGLocal(root_folder=path, index_folder=path+"/faiss_indexes")
-            rag_local.load_index()
+            started = time.perf_counter()
+            # Backend de embeddings según RAG_EMBEDDER (por defecto, OpenAI) y re-ranker según RAG_RERANKER
+            rag = RAGLocal(root_folder=path, index_folder=os.path.join(path, "faiss_indexes"),
+                           embedder=make_embedder(), reranker=make_reranker())
+            try:
+                rag.load_index(mmap=mmap)
+            except FileNotFoundError:
+                logger.info("Creando nuevo índice RAG...")
+                rag.create_index()
+            logger.info(f"RAG inicializado en {(time.perf_counter() - started) * 1000:.1f} ms")
             logger.info("RAG inicializado correctamente")
-        except FileNotFoundError:
-            logger.info("Creando nuevo índice RAG...")
-            rag_local.create_index()
         except Exception as e:
             logger.error(f"Error inicializando RAG: {str(e)}")
             raise
-    return rag_local
+        _rags[key] = rag
+        return rag
+
+def set_rag(rag: RAGLocal, path: Optional[str] = None) -> None:
+    """
+    Registra una instancia ya creada como RAG de la carpeta path (por defecto,
+    su root_folder), p. ej. un índice de prueba con embedder falso.
+    """
+    with _rags_lock:
+        _rags[os.path.abspath(path or rag.root_folder)] = rag
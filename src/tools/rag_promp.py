@@ -1,5 +1,7 @@
 from langchain.prompts.chat import ChatPromptTemplate
 from src.tools.rag import RAGLocal
+from src.tools.retrieval import format_chunks
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,7 +12,8 @@ def modelo_rag(
     rag_client: RAGLocal,
     prompt_template: ChatPromptTemplate,
     chat_model,
-    k: int = 3
+    k: int = 3,
+    min_score: Optional[float] = None
 ) -> str:
     """
     Realiza una consulta RAG y envía al modelo la pregunta con contexto.
@@ -21,13 +24,15 @@ def modelo_rag(
     - prompt_template: ChatPromptTemplate parcialmente configurado (time y client).
     - chat_model: modelo de chat inicializado (p.ej. gpt-4.1-2025-04-14).
     - k: número de documentos a recuperar para contexto (por defecto 3).
+    - min_score: similitud mínima de un fragmento para entrar en el contexto.
 
     Devuelve:
     - La respuesta generada por el modelo de chat.
     """
-    # 1. Recuperar los k fragmentos más relevantes
-    retrieved_text = rag_client.query(query, k=k)
-    logger.debug("Contexto recuperado: %s", retrieved_text[:200])
+    # 1. Recuperar los k fragmentos más relevantes (los poco relevantes se descartan)
+    hits = rag_client.query_batch([query], k=k, min_score=min_score)[0]
+    logger.debug("Contexto recuperado: %s", hits)
+    retrieved_text = format_chunks(hits) or "Sin contexto relevante."
     # 2. Construir el mensaje humano incluyendo el contexto
     #    Podrías adaptar el prefijo “Contexto relevante” al estilo que prefieras.
     human_input = (
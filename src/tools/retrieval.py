@@ -0,0 +1,50 @@
+# retrieval.py
+"""
+Resultados tipados de la recuperación RAG.
+"""
+import os
+from typing import Dict, Optional, Sequence
+
+
+class RetrievedChunk:
+    """
+    Un chunk recuperado del índice.
+    - id: id del chunk en el índice FAISS.
+    - path: documento de origen.
+    - score: similitud coseno con la pregunta en todos los modos (NaN si no se
+      pudo calcular, p. ej. en búsqueda léxica sin embedding de la pregunta).
+    - distance: distancia L2 al cuadrado equivalente al coseno (NaN si score lo es).
+    - text: texto del chunk.
+    - page: página en que empieza el chunk (0 si el documento no tiene páginas).
+    - rank_score: puntuación con la que la búsqueda ordenó el chunk: el coseno
+      en vectorial, BM25 en léxica y RRF en híbrida (por defecto, score).
+    """
+    __slots__ = ("id", "path", "score", "distance", "text", "page", "rank_score")
+
+    def __init__(self, id: int, path: str, score: float, distance: float, text: str, page: int = 0,
+                 rank_score: Optional[float] = None):
+        self.id = id
+        self.path = path
+        self.score = score
+        self.distance = distance
+        self.text = text
+        self.page = page
+        self.rank_score = score if rank_score is None else rank_score
+
+    @property
+    def source(self) -> str:
+        """Nombre del archivo de origen."""
+        return os.path.basename(self.path)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"RetrievedChunk(id={self.id}, source={self.source!r}, score={self.score:.3f})"
+
+
+def format_chunks(chunks: Sequence[RetrievedChunk]) -> str:
+    """Texto numerado para el prompt, con el documento (y la página) de origen de cada chunk."""
+    return "".join(
+        f"{i}. ({c.source}{f', p. {c.page}' if c.page else ''}) {c.text}\n" for i, c in enumerate(chunks, 1)
+    )
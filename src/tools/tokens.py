@@ -0,0 +1,52 @@
+# tokens.py
+"""
+Conteo de tokens con tiktoken.
+
+La codificación se carga de forma perezosa: tiktoken la descarga la primera
+vez, así que sin red (o sin tiktoken) se usa una estimación por caracteres.
+"""
+import logging
+from functools import lru_cache
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Caracteres por token aproximados para texto en español
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = "cl100k_base"):
+    """Devuelve la codificación de tiktoken o None si no se puede cargar."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"No se pudo cargar tiktoken ({name}), se estimarán los tokens: {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Número de tokens de un texto (estimado si tiktoken no está disponible)."""
+    enc = get_encoding()
+    if enc is None:
+        return len(text) // _CHARS_PER_TOKEN + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Conteo de tokens para varios textos de una vez."""
+    enc = get_encoding()
+    if enc is None:
+        return [len(t) // _CHARS_PER_TOKEN + 1 for t in texts]
+    return [len(ids) for ids in enc.encode_batch(texts, disallowed_special=())]
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Primeros max_tokens tokens del texto (por caracteres si no hay tiktoken)."""
+    enc = get_encoding()
+    if enc is None:
+        limit = max_tokens * _CHARS_PER_TOKEN
+        return text if len(text) <= limit else text[:limit]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
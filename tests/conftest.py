@@ -0,0 +1,39 @@
+# tests/conftest.py
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+from src.components.agent_builder import build_agent
+from src.components.retry import shared_circuit_breaker
+from src.tools.collection_registry import DEFAULT_COLLECTION, Collection, CollectionRegistry, set_registry
+from fakes import FakeChatModel, make_fake_rag
+
+
+@pytest.fixture
+def fake_rag(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    return make_fake_rag(docs)
+
+
+@pytest.fixture
+def fake_registry(fake_rag):
+    """Registra el índice falso como colección de "data" (la que consulta Herramienta_RAG)."""
+    registry = CollectionRegistry([Collection(DEFAULT_COLLECTION, [fake_rag])])
+    set_registry(registry, "data")
+    return registry
+
+
+@pytest.fixture
+def make_agent():
+    """Construye el grafo con FakeChatModel y checkpointer en memoria."""
+    def build(model: FakeChatModel | None = None, **kwargs):
+        kwargs.setdefault("use_semantic_cache", False)
+        return build_agent(model or FakeChatModel(), checkpointer=InMemorySaver(), **kwargs)
+    return build
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breaker():
+    """El circuit breaker es global del proceso: cada prueba empieza con el circuito cerrado."""
+    shared_circuit_breaker().record_success()
+    yield
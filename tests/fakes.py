@@ -0,0 +1,77 @@
+# tests/fakes.py
+"""
+Dobles de prueba sin red: un modelo de chat determinista y un índice RAG con
+HashingEmbedder sobre unos pocos documentos de texto.
+"""
+import re, json, time, asyncio
+from typing import List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from src.tools.embedders import HashingEmbedder
+from src.tools.rag import RAGLocal
+
+DOCUMENTS = {
+    "lstm.txt": "La red LSTM usa puertas de olvido para controlar la memoria a largo plazo.",
+    "cnn.txt": "Las redes convolucionales aplican filtros sobre la imagen para extraer rasgos locales.",
+    "transformer.txt": "El transformador usa atención sobre todos los tokens de la secuencia a la vez.",
+}
+
+_HUMAN = re.compile(r"HumanMessage\(content='([^']*)'")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modelo de chat sin red. En cada turno pide una vez Herramienta_RAG con la
+    pregunta del usuario y, con la salida de la herramienta, responde
+    "Respuesta <n>: <pregunta>". delay simula la latencia del proveedor.
+    """
+    delay: float = 0.0
+    calls: int = 0
+    last_prompt: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages) -> AIMessage:
+        self.calls += 1
+        # El prompt del agente incrusta el historial como texto en el último mensaje
+        text = self.last_prompt = str(messages[-1].content)
+        questions = _HUMAN.findall(text)
+        question = questions[-1] if questions else text
+        if text.rfind("HumanMessage(") > text.rfind("ToolMessage("):
+            return AIMessage(content="", tool_calls=[{
+                "name": "Herramienta_RAG", "args": {"input": question}, "id": f"call_{self.calls}",
+            }])
+        return AIMessage(content=f"Respuesta {self.calls}: {question}")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+
+def make_fake_rag(folder, dimension: int = 64) -> RAGLocal:
+    """RAGLocal sobre DOCUMENTS en *folder*, con embeddings por hashing (sin crear el índice)."""
+    for name, text in DOCUMENTS.items():
+        (folder / name).write_text(text, encoding="utf-8")
+    return RAGLocal(str(folder), str(folder / "faiss_indexes"), embedder=HashingEmbedder(dimension),
+                    workers=1, dedup_threshold=None)
+
+
+def sse_events(body: str) -> List[tuple]:
+    """[(evento, datos)] de una respuesta Server-Sent Events."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        events.append((lines.get("event"), json.loads(lines.get("data", "null"))))
+    return events
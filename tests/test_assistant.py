@@ -0,0 +1,71 @@
+# tests/test_assistant.py
+"""Reintentos y plazo por turno del Assistant, en sus caminos síncrono y asíncrono."""
+import time, asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.components.assistant import Assistant
+from src.components.retry import CircuitBreaker, RetryPolicy
+
+
+def _slow_runnable(seconds: float) -> RunnableLambda:
+    async def aslow(state):
+        await asyncio.sleep(seconds)
+        return AIMessage(content="tarde")
+
+    def slow(state):
+        time.sleep(seconds)
+        return AIMessage(content="tarde")
+    return RunnableLambda(slow, afunc=aslow)
+
+
+def _assistant(runnable, deadline: float) -> Assistant:
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, deadline=deadline)
+    return Assistant(runnable, retry_policy=policy, circuit_breaker=CircuitBreaker())
+
+
+@pytest.mark.parametrize("path", ["sync", "async"])
+def test_hung_call_is_bounded_by_deadline(path):
+    assistant = _assistant(_slow_runnable(2.0), deadline=0.2)
+    started = time.perf_counter()
+    with pytest.raises(RuntimeError, match="agotó los re‑intentos"):
+        if path == "sync":
+            assistant({"messages": []})
+        else:
+            asyncio.run(assistant.acall({"messages": []}))
+    assert time.perf_counter() - started < 1.0
+
+
+@pytest.mark.parametrize("path", ["sync", "async"])
+def test_call_within_deadline_returns(path):
+    assistant = _assistant(_slow_runnable(0.01), deadline=5.0)
+    if path == "sync":
+        result = assistant({"messages": []})
+    else:
+        result = asyncio.run(assistant.acall({"messages": []}))
+    assert result["messages"].content == "tarde"
+
+
+def test_deadline_is_passed_as_provider_timeout():
+    timeouts = []
+
+    def with_timeout(timeout: float):
+        timeouts.append(timeout)
+        return _slow_runnable(0.01)
+
+    policy = RetryPolicy(max_attempts=1, deadline=5.0)
+    assistant = Assistant(_slow_runnable(0.01), retry_policy=policy, circuit_breaker=CircuitBreaker(),
+                          timeout_runnable=with_timeout)
+    assistant({"messages": []})
+    asyncio.run(assistant.acall({"messages": []}))
+    assert len(timeouts) == 2 and all(0 < t <= 5.0 for t in timeouts)
+
+
+def test_sync_calls_share_one_executor():
+    assistant = _assistant(_slow_runnable(0.01), deadline=5.0)
+    assistant({"messages": []})
+    executor = assistant._executor
+    assistant({"messages": []})
+    assert executor is not None and assistant._executor is executor
@@ -0,0 +1,75 @@
+# tests/test_chunk_store.py
+"""ChunkStore: guardado incremental (solo por el final), tombstones y compactación."""
+import os
+
+import numpy as np
+
+from src.tools.chunk_store import ChunkStore
+from src.tools.npy_append import append_rows
+
+
+def _store(tmp_path, n=4, **kwargs) -> ChunkStore:
+    store = ChunkStore(str(tmp_path / "db"), **kwargs)
+    for i in range(n):
+        store.append(f"/docs/{i % 2}.txt", f"texto del chunk {i} " * 5, page=i)
+    store.save()
+    return store
+
+
+def test_save_appends_and_marks_deleted(tmp_path):
+    store = _store(tmp_path)
+    inode = os.stat(store.text_path).st_ino
+    with open(store.text_path, "rb") as fh:
+        saved = fh.read()
+
+    store.delete(1)
+    new_id = store.append("/docs/nuevo.txt", "chunk nuevo", page=7)
+    store.save()
+    # El blob de texto no se reescribe: conserva lo guardado y crece con el chunk nuevo
+    assert os.stat(store.text_path).st_ino == inode
+    with open(store.text_path, "rb") as fh:
+        assert fh.read() == saved + "chunk nuevo".encode("utf-8")
+
+    reopened = ChunkStore(store.prefix).open()
+    assert reopened[1] is None
+    assert reopened[new_id] == {"path": "/docs/nuevo.txt", "text": "chunk nuevo", "page": 7}
+    assert reopened.live_ids().tolist() == [0, 2, 3, 4]
+    assert reopened.garbage_ratio() > 0
+
+
+def test_compacts_above_garbage_ratio(tmp_path):
+    store = _store(tmp_path, compact_ratio=0.3)
+    store.delete(0)
+    store.save()
+    inode = os.stat(store.text_path).st_ino
+    assert store.garbage_ratio() == 0.25
+
+    store.delete(2)
+    store.save()
+    # Con la mitad del texto borrado se reescribe sin basura; los ids se conservan
+    assert os.stat(store.text_path).st_ino != inode
+    assert store.garbage_ratio() == 0.0
+    assert store.paths == ["/docs/1.txt"]
+    assert [store[i] is not None for i in range(4)] == [False, True, False, True]
+    assert store[3]["text"].startswith("texto del chunk 3")
+
+
+def test_append_rows_grows_npy(tmp_path):
+    path = str(tmp_path / "a.npy")
+    np.save(path, np.arange(3, dtype=np.int64))
+    for n in range(1, 200):
+        append_rows(path, np.full(n % 7, n, dtype=np.int64))
+    expected = np.concatenate([np.arange(3)] + [np.full(n % 7, n) for n in range(1, 200)])
+    assert np.array_equal(np.load(path), expected)
+
+
+def test_interrupted_save_is_rewritten(tmp_path):
+    store = _store(tmp_path)
+    # Guardado interrumpido: los atributos se añadieron pero las filas no
+    append_rows(store.attrs_path, np.asarray(store._attrs[:1]))
+    reopened = ChunkStore(store.prefix).open()
+    assert len(reopened) == 4
+    new_id = reopened.append("/docs/nuevo.txt", "chunk nuevo", page=9)
+    reopened.save()
+    assert len(np.load(reopened.attrs_path)) == len(np.load(reopened.rows_path)) == 5
+    assert reopened[new_id]["page"] == 9
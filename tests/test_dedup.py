@@ -0,0 +1,63 @@
+# tests/test_dedup.py
+"""NearDuplicateIndex: firmas añadidas por el final, borrados marcados y migración del .npz."""
+import os
+
+import numpy as np
+
+from src.tools.dedup import NearDuplicateIndex, minhash
+from src.tools.lexical_index import tokenize
+
+
+def _signature(i: int) -> np.ndarray:
+    return minhash(tokenize(f"el chunk número {i} habla de redes neuronales y de su entrenamiento"))
+
+
+def _index(tmp_path, n=6, **kwargs) -> NearDuplicateIndex:
+    index = NearDuplicateIndex(str(tmp_path / "db"), **kwargs)
+    for i in range(n):
+        index.add(i, _signature(i))
+    index.save()
+    return index
+
+
+def test_save_appends_and_marks_deleted(tmp_path):
+    index = _index(tmp_path)
+    inode = os.stat(index.signatures_path).st_ino
+
+    index.delete(2)
+    index.add(6, _signature(6))
+    index.save()
+    # Las firmas guardadas no se reescriben: la nueva va al final y el borrado queda con id -1
+    assert os.stat(index.signatures_path).st_ino == inode
+    assert np.load(index.ids_path).tolist() == [0, 1, -1, 3, 4, 5, 6]
+
+    reopened = NearDuplicateIndex(str(tmp_path / "db")).open()
+    assert len(reopened) == 6
+    assert reopened.find(_signature(2)) != 2
+    assert reopened.find(_signature(6)) == 6
+
+
+def test_compacts_above_garbage_ratio(tmp_path):
+    index = _index(tmp_path, n=4, compact_ratio=0.3)
+    index.delete(0)
+    index.save()
+    assert index.garbage_ratio() == 0.25
+
+    index.delete(1)
+    index.save()
+    assert np.load(index.ids_path).tolist() == [2, 3]
+    assert index.garbage_ratio() == 0.0
+
+
+def test_migrates_npz(tmp_path):
+    ids = np.arange(3, dtype=np.int64)
+    np.savez(tmp_path / "db_minhash.npz", ids=ids, signatures=np.stack([_signature(i) for i in ids]))
+    index = NearDuplicateIndex(str(tmp_path / "db"))
+    assert index.exists()
+    index.open()
+    assert index.find(_signature(1)) == 1
+
+    index.add(3, _signature(3))
+    index.save()
+    assert not os.path.isfile(index.legacy_path)
+    assert np.load(index.ids_path).tolist() == [0, 1, 2, 3]
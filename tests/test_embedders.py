@@ -0,0 +1,57 @@
+# tests/test_embedders.py
+"""Identidad de los embedders: huella de los modelos locales y comprobación al cargar un índice."""
+import os
+
+import pytest
+
+from src.tools.embedders import HashingEmbedder, model_fingerprint
+
+
+def _model(folder, weights: bytes):
+    folder.mkdir(parents=True)
+    (folder / "model.onnx").write_bytes(weights)
+    (folder / "tokenizer.json").write_text("{}", encoding="utf-8")
+    return str(folder / "model.onnx")
+
+
+def _extras(model_path):
+    return [os.path.join(os.path.dirname(model_path), "tokenizer.json")]
+
+
+def test_same_folder_name_different_model(tmp_path):
+    a = _model(tmp_path / "a" / "minilm", b"pesos-a")
+    b = _model(tmp_path / "b" / "minilm", b"pesos-b")
+    assert model_fingerprint(a, _extras(a)) != model_fingerprint(b, _extras(b))
+
+
+def test_model_replaced_in_place(tmp_path):
+    path = _model(tmp_path / "minilm", b"pesos-a")
+    before = model_fingerprint(path, _extras(path))
+    assert model_fingerprint(path, _extras(path)) == before
+    with open(path, "wb") as fh:
+        fh.write(b"pesos-nuevos")
+    assert model_fingerprint(path, _extras(path)) != before
+    # Los datos externos del modelo también cuentan
+    (tmp_path / "minilm" / "model.onnx_data").write_bytes(b"tensores")
+    assert model_fingerprint(path, _extras(path)) not in (before, model_fingerprint(path))
+
+
+class _NamedEmbedder(HashingEmbedder):
+    def __init__(self, name: str):
+        super().__init__(64)
+        self.name = name
+
+
+def test_load_checks_embedder_identity(fake_rag):
+    fake_rag.embedder = _NamedEmbedder("local:minilm@aaaa")
+    fake_rag.create_index()
+
+    fake_rag.embedder = _NamedEmbedder("local:minilm@bbbb")
+    with pytest.raises(ValueError, match="embedder"):
+        fake_rag.load_index()
+
+    # Índices guardados sin huella (solo la carpeta): se aceptan con un aviso
+    fake_rag.embedder = _NamedEmbedder("local:minilm")
+    fake_rag.create_index()
+    fake_rag.embedder = _NamedEmbedder("local:minilm@bbbb")
+    fake_rag.load_index()
@@ -0,0 +1,31 @@
+# tests/test_herramienta_rag.py
+"""Validación de Herramienta_RAG en lote: una llamada mal formada no tumba el lote."""
+import asyncio
+
+import pytest
+
+from src.tools.Herramienta_RAG import aherramienta_rag_batch, herramienta_rag_batch
+
+BAD_FILTERS = [
+    {"documento": 123},                  # TypeError al normalizar
+    {"tipo": ["pdf", 5]},
+    {"pagina_desde": 0},                 # ValueError
+    {"modificado_desde": [2024, 5, 1]},  # ni fecha ni texto ISO
+]
+
+
+@pytest.mark.parametrize("handler", ["sync", "async"])
+@pytest.mark.parametrize("bad", BAD_FILTERS)
+def test_bad_filter_is_reported_per_call(fake_registry, handler, bad):
+    calls = [{"input": "puertas de olvido LSTM", **bad}, {"input": "puertas de olvido LSTM", "k": 1}]
+    if handler == "sync":
+        out = herramienta_rag_batch(calls)
+    else:
+        out = asyncio.run(aherramienta_rag_batch(calls))
+    assert out[0].startswith("Error: Filtro no válido")
+    assert "lstm.txt" in out[1]
+
+
+def test_non_text_input_is_reported(fake_registry):
+    out = herramienta_rag_batch([{"input": 42}])
+    assert out == ["Error: El texto de búsqueda no puede estar vacío."]
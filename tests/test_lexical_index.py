@@ -0,0 +1,68 @@
+# tests/test_lexical_index.py
+"""LexicalIndex: postings nuevos en el delta, tombstones y compactación."""
+import os
+
+import pytest
+
+from src.tools.lexical_index import LexicalIndex, tokenize
+
+TEXTS = [
+    "la red lstm usa puertas de olvido",
+    "las redes convolucionales aplican filtros",
+    "el transformador usa atención sobre los tokens",
+    "la atención multicabeza del transformador",
+    "filtros de la red convolucional",
+    "puertas de entrada y olvido en la lstm",
+    "memoria a largo plazo de la red",
+    "tokens y posiciones en la secuencia",
+]
+
+
+def _index(tmp_path, texts, **kwargs) -> LexicalIndex:
+    index = LexicalIndex(str(tmp_path / "db"), **kwargs)
+    for i, text in enumerate(texts):
+        index.add(i, tokenize(text))
+    index.save()
+    return index
+
+
+def _scores(index, query):
+    return {doc: round(score, 5) for doc, score in index.search(query, k=20)}
+
+
+def test_save_appends_delta_and_tombstones(tmp_path):
+    index = _index(tmp_path, TEXTS)
+    inodes = {name: os.stat(path).st_ino for name, path in index._array_paths.items() if name != "len"}
+
+    index.delete(0)
+    index.add(len(TEXTS), tokenize("la lstm con atención"))
+    index.save()
+    # El CSR guardado no se reescribe: los postings nuevos van al delta
+    assert {name: os.stat(index._array_paths[name]).st_ino for name in inodes} == inodes
+    assert os.path.isfile(index.delta_path)
+
+    # Mismas puntuaciones que un índice construido desde cero con los mismos chunks
+    live = {i: t for i, t in enumerate(TEXTS + ["la lstm con atención"]) if i != 0}
+    fresh = LexicalIndex(str(tmp_path / "fresh"))
+    for i, text in live.items():
+        fresh.add(i, tokenize(text))
+    fresh.save()
+    reopened = LexicalIndex(index.prefix).open()
+    for query in ("lstm olvido", "atención transformador", "red"):
+        assert _scores(reopened, query) == pytest.approx(_scores(fresh, query))
+    assert 0 not in _scores(reopened, "lstm olvido")
+    assert reopened.score_ids("lstm", [0, len(TEXTS)])[0] == 0.0
+
+
+def test_compacts_above_ratio(tmp_path):
+    index = _index(tmp_path, TEXTS, compact_ratio=0.3)
+    docs_inode = os.stat(index._array_paths["docs"]).st_ino
+    for i in range(3):
+        index.delete(i)
+    index.save()
+    # Más del 30 % de los términos borrados: se reescribe el CSR sin ellos y sin delta
+    assert os.stat(index._array_paths["docs"]).st_ino != docs_inode
+    assert not os.path.isfile(index.delta_path)
+    assert (index._len >= 0).all()
+    assert index.n_docs == len(TEXTS) - 3
+    assert not {0, 1, 2} & set(_scores(index, "lstm filtros transformador"))
@@ -0,0 +1,70 @@
+# tests/test_rag.py
+"""RAGLocal con HashingEmbedder: actualización incremental y búsqueda."""
+import math
+import os
+
+import pytest
+
+
+def test_update_without_changes_keeps_version(fake_rag):
+    fake_rag.create_index()
+    version = fake_rag.index_version
+    written = os.stat(fake_rag.index_path).st_mtime_ns
+
+    # Solo cambia la fecha de un archivo: no se reescribe el índice ni cambia la versión
+    os.utime(os.path.join(fake_rag.root_folder, "lstm.txt"), None)
+    assert fake_rag.update_index() == {"nuevos": 0, "modificados": 0, "eliminados": 0}
+    assert fake_rag.index_version == version
+    assert os.stat(fake_rag.index_path).st_mtime_ns == written
+
+
+def _cosines(rag, question):
+    return {hit.id: hit.score for hit in rag.query_batch([question], k=10, mode="vector", min_score=-1.0)[0]}
+
+
+def test_min_score_applies_to_lexical_and_hybrid(fake_rag):
+    fake_rag.create_index()
+    question = "puertas de olvido"
+    cosines = _cosines(fake_rag, question)
+    for mode in ("lexical", "hybrid"):
+        hits = fake_rag.query_batch([question], k=3, mode=mode, min_score=-1.0)[0]
+        assert hits
+        # score es el coseno de la búsqueda densa, también en lo que encontró BM25
+        for hit in hits:
+            assert hit.score == pytest.approx(cosines[hit.id], abs=1e-5)
+        # Un umbral por encima de todos los cosenos deja fuera también los aciertos de BM25
+        threshold = max(cosines.values()) + 0.01
+        assert fake_rag.query_batch([question], k=3, mode=mode, min_score=threshold)[0] == []
+
+
+def test_hybrid_keeps_rrf_in_rank_score(fake_rag):
+    fake_rag.create_index()
+    hits = fake_rag.query_batch(["puertas de olvido"], k=3, mode="hybrid", min_score=-1.0)[0]
+    assert [h.rank_score for h in hits] == sorted((h.rank_score for h in hits), reverse=True)
+    # RRF: 1 / (60 + puesto) por lista, muy por debajo de un coseno alto
+    assert all(0 < h.rank_score < 0.05 for h in hits)
+    assert hits[0].score > 0.3
+
+
+def test_lexical_without_threshold_has_no_cosine(fake_rag):
+    fake_rag.create_index()
+    hit = fake_rag.query_batch(["puertas de olvido"], k=1, mode="lexical")[0][0]
+    assert math.isnan(hit.score) and math.isnan(hit.distance) and hit.rank_score > 0
+
+
+def test_update_appends_to_chunk_store(fake_rag):
+    # Con más documentos, cambiar uno deja poca basura y no hace falta compactar
+    for i in range(6):
+        with open(os.path.join(fake_rag.root_folder, f"extra_{i}.txt"), "w", encoding="utf-8") as fh:
+            fh.write(f"Documento adicional número {i} sobre optimización de redes neuronales.")
+    fake_rag.create_index()
+    text_path = fake_rag._docs.text_path
+    inode, size = os.stat(text_path).st_ino, os.path.getsize(text_path)
+
+    with open(os.path.join(fake_rag.root_folder, "cnn.txt"), "a", encoding="utf-8") as fh:
+        fh.write(" Los filtros comparten pesos en toda la imagen.")
+    assert fake_rag.update_index()["modificados"] == 1
+    # El chunk nuevo se añade al final; el viejo queda marcado como borrado
+    assert os.stat(text_path).st_ino == inode and os.path.getsize(text_path) > size
+    hit = fake_rag.query_batch(["filtros comparten pesos"], k=1, mode="lexical")[0][0]
+    assert hit.source == "cnn.txt" and "comparten pesos" in hit.text
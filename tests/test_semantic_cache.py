@@ -0,0 +1,196 @@
+# tests/test_semantic_cache.py
+"""Caché semántica con embeddings por hashing: aciertos, TTL, LRU, versión y huella del contexto."""
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.components import semantic_cache
+from src.components.agent_builder import default_semantic_cache
+from src.components.semantic_cache import CACHE_MARK, SemanticCache, history_scope
+from src.tools.embedders import HashingEmbedder
+from fakes import FakeChatModel
+
+QUESTION = "¿Qué son las puertas de olvido de una LSTM?"
+OTHER = "¿Cómo aplican filtros las redes convolucionales?"
+
+
+@pytest.fixture
+def make_cache():
+    embedder = HashingEmbedder(64)
+
+    def make(**kwargs):
+        kwargs.setdefault("threshold", 0.9)
+        return SemanticCache(embed_fn=embedder.embed, **kwargs)
+    return make
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj controlado para el TTL (time.time dentro de semantic_cache)."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_lookup_hit_and_miss(make_cache):
+    cache = make_cache()
+    cache.store(QUESTION, "respuesta", "fp")
+    hit = cache.lookup(QUESTION)
+    assert hit["answer"] == "respuesta" and hit["similarity"] == pytest.approx(1.0)
+    assert cache.lookup(OTHER) is None
+    # Preguntas demasiado cortas no se cachean ni se consultan
+    assert cache.lookup("¿y eso?") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+
+def test_ttl_expires_entries(make_cache, clock):
+    cache = make_cache(ttl_seconds=60)
+    cache.store(QUESTION, "respuesta", "fp")
+    clock[0] += 59
+    assert cache.lookup(QUESTION) is not None
+    clock[0] += 2
+    assert cache.lookup(QUESTION) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_evicts_least_recently_used(make_cache):
+    cache = make_cache(max_entries=2)
+    third = "¿Qué hace la atención de un transformador?"
+    cache.store(QUESTION, "r1", "fp")
+    cache.store(OTHER, "r2", "fp")
+    assert cache.lookup(QUESTION) is not None  # QUESTION pasa a ser la más reciente
+    cache.store(third, "r3", "fp")
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup(OTHER) is None
+    assert cache.lookup(QUESTION)["answer"] == "r1"
+    assert cache.lookup(third)["answer"] == "r3"
+
+
+def test_version_change_invalidates(make_cache):
+    version = ["v1"]
+    cache = make_cache(version_fn=lambda: version[0])
+    cache.store(QUESTION, "respuesta", "fp")
+    assert cache.lookup(QUESTION) is not None
+    version[0] = "v2"
+    assert cache.lookup(QUESTION) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_new_components_do_not_invalidate(make_cache):
+    # Un shard que se carga más tarde añade su versión sin vaciar la caché
+    versions = {"a/0": "v1", "b/0": None}
+    cache = make_cache(version_fn=lambda: dict(versions))
+    cache.store(QUESTION, "respuesta", "fp")
+    versions["b/0"] = "v7"
+    assert cache.lookup(QUESTION) is not None
+    versions["b/0"] = "v8"
+    assert cache.lookup(QUESTION) is None
+
+
+STEPS = [[{"name": "Herramienta_RAG", "args": {"input": "puertas de olvido"}}]]
+
+
+def test_context_checked_only_for_candidates(make_cache):
+    contexts = {"puertas de olvido": "lstm.txt#0"}
+    replayed = []
+
+    def context_fn(steps):
+        replayed.append(steps)
+        return contexts[steps[0][0]["args"]["input"]]
+
+    cache = make_cache(context_fn=context_fn)
+    cache.store(QUESTION, "respuesta", "lstm.txt#0", calls=STEPS)
+    assert cache.lookup(OTHER) is None
+    assert replayed == []  # sin candidato no se repite la búsqueda
+    assert cache.lookup(QUESTION)["answer"] == "respuesta"
+    assert replayed == [STEPS]
+    # Las mismas búsquedas devuelven ahora otros fragmentos: la respuesta guardada no vale
+    contexts["puertas de olvido"] = "lstm.txt#7"
+    assert cache.lookup(QUESTION) is None
+
+
+def test_async_lookup_uses_context_fn(make_cache):
+    cache = make_cache(context_fn=lambda steps: "fp")
+    asyncio.run(cache.astore(QUESTION, "respuesta", "fp", calls=STEPS))
+    assert asyncio.run(cache.alookup(QUESTION))["answer"] == "respuesta"
+
+
+def test_default_cache_replays_tool_calls(fake_registry, make_agent, monkeypatch):
+    cache = default_semantic_cache()
+    model = FakeChatModel()
+    agent = make_agent(model, semantic_cache=cache)
+    searches = []
+    query_batch = fake_registry.query_batch
+    monkeypatch.setattr(fake_registry, "query_batch", lambda *a, **kw: searches.append(a) or query_batch(*a, **kw))
+
+    _ask(agent, "t1", QUESTION)
+    # Una sola búsqueda (la de la herramienta): guardar no recupera de nuevo
+    assert len(searches) == 1
+    assert cache.stats()["entries"] == 1 and cache.version_fn()
+
+    answer = _ask(agent, "t2", QUESTION)
+    assert answer.response_metadata[CACHE_MARK] and model.calls == 2
+    assert len(searches) == 2
+
+
+# ---------- en el grafo ----------
+def _ask(agent, thread_id: str, text: str):
+    state = agent.invoke({"messages": [("user", text)]}, {"configurable": {"thread_id": thread_id}})
+    return state["messages"][-1]
+
+
+def test_cache_hit_skips_llm(fake_registry, make_agent, make_cache):
+    model = FakeChatModel()
+    agent = make_agent(model, semantic_cache=make_cache())
+    first = _ask(agent, "t1", QUESTION)
+    assert model.calls == 2 and not first.response_metadata.get(CACHE_MARK)
+
+    # Otra conversación, misma pregunta: responde la caché sin llamar al modelo
+    second = _ask(agent, "t2", QUESTION)
+    assert model.calls == 2
+    assert isinstance(second, AIMessage) and second.response_metadata[CACHE_MARK]
+    assert second.content == first.content
+
+
+def test_follow_up_is_scoped_to_previous_exchange(fake_registry, make_agent, make_cache):
+    model = FakeChatModel()
+    cache = make_cache()
+    agent = make_agent(model, semantic_cache=cache)
+    _ask(agent, "t1", QUESTION)
+    _ask(agent, "t1", OTHER)
+    assert model.calls == 4 and cache.stats()["entries"] == 2
+
+    # Otra conversación con el mismo comienzo: también el seguimiento sale de la caché
+    assert _ask(agent, "t2", QUESTION).response_metadata[CACHE_MARK]
+    assert _ask(agent, "t2", OTHER).response_metadata[CACHE_MARK]
+    assert model.calls == 4
+
+    # La misma pregunta tras otro intercambio depende de otra conversación: pasa por el modelo
+    _ask(agent, "t3", OTHER)
+    answer = _ask(agent, "t3", QUESTION)
+    assert model.calls == 8
+    assert not answer.response_metadata.get(CACHE_MARK)
+    assert cache.stats()["entries"] == 4
+
+
+def test_history_scope():
+    first = [HumanMessage("hola"), AIMessage("", tool_calls=[{"name": "t", "args": {}, "id": "c1"}]),
+             ToolMessage("fragmentos", tool_call_id="c1"), AIMessage("respuesta")]
+    assert history_scope([]) == ""
+    # Solo cuenta el último intercambio y sin herramientas
+    assert history_scope(first) == history_scope([HumanMessage("otra"), AIMessage("r"), *first[:1], first[-1]])
+    assert history_scope(first) != history_scope([HumanMessage("hola"), AIMessage("otra respuesta")])
+
+
+def test_async_graph_cache_hit(fake_registry, make_agent, make_cache):
+    model = FakeChatModel()
+    agent = make_agent(model, semantic_cache=make_cache())
+
+    async def ask(thread_id: str):
+        state = await agent.ainvoke({"messages": [("user", QUESTION)]}, {"configurable": {"thread_id": thread_id}})
+        return state["messages"][-1]
+
+    asyncio.run(ask("t1"))
+    answer = asyncio.run(ask("t2"))
+    assert model.calls == 2 and answer.response_metadata[CACHE_MARK]
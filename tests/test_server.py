@@ -0,0 +1,110 @@
+# tests/test_server.py
+"""Servidor ASGI con modelo de chat y embedder falsos: sin red."""
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.components.server import create_app
+from fakes import FakeChatModel, sse_events
+
+
+@pytest.fixture
+def client_for(fake_rag, make_agent):
+    """TestClient (con lifespan) de create_app(agent=grafo falso, rag=índice falso, **kwargs)."""
+    clients = []
+
+    def make(model: FakeChatModel | None = None, **kwargs):
+        # Herramienta_RAG busca en la colección registrada para "data": la del índice falso
+        app = create_app(agent=make_agent(model), rag=fake_rag, **kwargs)
+        client = TestClient(app)
+        client.__enter__()
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.__exit__(None, None, None)
+
+
+def test_health(client_for):
+    response = client_for().get("/health")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert body["en_curso"] == 0
+    assert body["circuito_llm"]["estado"] == "closed"
+
+
+def test_chat_runs_tool_and_answers(client_for):
+    model = FakeChatModel()
+    question = "¿Para qué usa la red LSTM puertas de olvido?"
+    response = client_for(model).post("/chat", json={"thread_id": "t1", "input": question})
+    assert response.status_code == 200
+    assert response.json() == {"thread_id": "t1", "respuesta": f"Respuesta 2: {question}"}
+    # Una llamada pide la herramienta y otra responde con su salida (fragmentos del índice falso)
+    assert model.calls == 2
+    assert "lstm.txt" in model.last_prompt
+
+
+def test_chat_stream_sse(client_for):
+    with client_for().stream("POST", "/chat/stream", json={"thread_id": "t1", "input": "puertas de olvido"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = sse_events(response.read().decode("utf-8"))
+
+    names = [name for name, _ in events]
+    assert names[0] == "tool" and names[-1] == "end"
+    assert events[0][1]["label"] == "Buscando en los documentos…"
+    tokens = "".join(data["content"] for name, data in events if name == "token")
+    end = events[-1][1]
+    assert end["respuesta"] == tokens == "Respuesta 2: puertas de olvido"
+    assert end["thread_id"] == "t1" and end["ttft_ms"] is not None
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+def test_empty_input_is_422(client_for, path):
+    response = client_for().post(path, json={"thread_id": "t1", "input": "   "})
+    assert response.status_code == 422
+
+
+def test_queue_full_is_503(client_for):
+    client = client_for(FakeChatModel(delay=0.5), max_concurrency=1, queue_timeout=0.05)
+    started = threading.Event()
+    first = {}
+
+    def busy():
+        started.set()
+        first["response"] = client.post("/chat", json={"thread_id": "lento", "input": "hola"})
+
+    worker = threading.Thread(target=busy)
+    worker.start()
+    started.wait()
+    # Espera a que la primera petición ocupe el único hueco
+    for _ in range(100):
+        if client.get("/health").json()["en_curso"] == 1:
+            break
+        threading.Event().wait(0.01)
+
+    response = client.post("/chat", json={"thread_id": "otro", "input": "hola"})
+    worker.join()
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert first["response"].status_code == 200
+    assert client.get("/health").json()["rechazadas"] == 1
+
+
+def test_timeout_is_504(client_for):
+    client = client_for(FakeChatModel(delay=1.0), request_timeout=0.1)
+    response = client.post("/chat", json={"thread_id": "t1", "input": "hola"})
+    assert response.status_code == 504
+    health = client.get("/health").json()
+    assert health["timeouts"] == 1 and health["en_curso"] == 0
+
+
+def test_stream_timeout_sends_error_event(client_for):
+    client = client_for(FakeChatModel(delay=1.0), request_timeout=0.1)
+    with client.stream("POST", "/chat/stream", json={"thread_id": "t1", "input": "hola"}) as response:
+        events = sse_events(response.read().decode("utf-8"))
+    assert events[-1] == ("error", {"detail": "Tiempo de respuesta agotado"})
+    assert client.get("/health").json()["en_curso"] == 0